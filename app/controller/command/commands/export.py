@@ -84,7 +84,7 @@ class ExportCommand(Command):
                     users = self.get_team_users(args.team)
                     return self.export_emails_helper(users)
                 else:  # if team name is not provided, export all emails
-                    users = self.facade.query(User)
+                    users = self.facade.query(User, attributes=['email'])
                     return self.export_emails_helper(users)
             except LookupError:
                 return self.lookup_error, 200
@@ -71,7 +71,8 @@ class IQuitCommand(Command):
 
     def get_leads(self, user: User) -> List[User]:
         """Return a list of team leads user is in a team with."""
-        teams: List[Team] = self.facade.query(Team)
+        team_ids = self.facade.get_membership(user.github_id).member_of
+        teams: List[Team] = self.facade.bulk_retrieve(Team, sorted(team_ids))
         leads: List[User] = []
         for team in teams:
             if len(team.team_leads) > 0 and team.has_member(user.github_id):
@@ -97,8 +98,8 @@ class IQuitCommand(Command):
 
     def get_teamlead_specialtext(self, user: User) -> str:
         """Return special text for team leads."""
-        teams: List[Team] = self.facade.query_or(Team, [("team_leads",
-                                                         user.github_id)])
+        team_ids = self.facade.get_membership(user.github_id).lead_of
+        teams: List[Team] = self.facade.bulk_retrieve(Team, sorted(team_ids))
         ctx: Dict[str, str] = {}
         for team in teams:
             # Find a random member in the team and use them to replace you. If
@@ -5,6 +5,9 @@ from app.controller.command.commands.base import Command
 from argparse import ArgumentParser, _SubParsersAction
 from app.model import User, Permissions
 from app.controller import ResponseTuple
+from db.facade import VersionConflict
+from db.utils import update_with_retry
+from typing import Iterator
 
 
 class KarmaCommand(Command):
@@ -15,6 +18,7 @@ class KarmaCommand(Command):
            "\n\nOptions:\n\n" \
            "user"
     lookup_error = "User doesn't exist"
+    conflict_error = "User was changed by someone else, please try again"
     desc = "for dealing with " + command_name
     permission_error = "You do not have the sufficient " \
                        "permission level for this command!"
@@ -90,14 +94,18 @@ class KarmaCommand(Command):
         try:
             user = self.facade.retrieve(User, user_id)
             if user.permissions_level == Permissions.admin:
-                user = self.facade.retrieve(User, slack_id)
-                user.karma = amount
-                self.facade.store(user)
+                def set_karma(user: User):
+                    user.karma = amount
+
+                user = update_with_retry(self.facade, User, slack_id,
+                                         set_karma)
                 return f"set {user.name}'s karma to {amount}", 200
             else:
                 return self.permission_error, 200
         except LookupError:
             return self.lookup_error, 200
+        except VersionConflict:
+            return self.conflict_error, 200
 
     def reset_helper(self,
                      user_id: str,
@@ -108,10 +116,16 @@ class KarmaCommand(Command):
             if not user.permissions_level == Permissions.admin:
                 return self.permission_error, 200
             if reset_all:
-                user_list = self.facade.query(User, [])
-                for user in user_list:
-                    user.karma = self.karma_default_amount
-                    self.facade.store(user)
+                # Bulk writes are last-writer-wins, so karma given during
+                # the reset may be reset too
+                def reset_karma(users: Iterator[User]) -> Iterator[User]:
+                    for user in users:
+                        if user.karma != self.karma_default_amount:
+                            user.karma = self.karma_default_amount
+                            yield user
+
+                self.facade.bulk_store(
+                    reset_karma(self.facade.iter_query(User)))
                 return (
                     "reset all users karma to"
                     f"{self.karma_default_amount}",
@@ -42,9 +42,8 @@ class MentionCommand(Command):
         if giver_id == receiver_id:
             return "cannot give karma to self", 200
         try:
-            user = self.facade.retrieve(User, receiver_id)
-            user.karma += self.karma_add_amount
-            self.facade.store(user)
+            user = self.facade.increment(User, receiver_id, 'karma',
+                                         self.karma_add_amount)
             return f"gave {self.karma_add_amount} karma to {user.name}", 200
         except LookupError:
             return self.lookup_error, 200
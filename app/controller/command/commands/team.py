@@ -5,8 +5,9 @@ from argparse import ArgumentParser, _SubParsersAction, Namespace
 from app.controller import ResponseTuple
 from app.controller.command.commands.base import Command
 from app.model import Permissions
-from db.facade import DBFacade
-from db.utils import get_team_by_name, get_team_members
+from db.facade import DBFacade, VersionConflict
+from db.utils import get_team_by_name, get_team_members, \
+    get_users_by_ghid, update_with_retry
 from interface.github import GithubAPIException, GithubInterface
 from interface.slack import SlackAPIError
 from interface.gcp import GCPInterface
@@ -25,6 +26,8 @@ class TeamCommand(Command):
     permission_error = "You do not have the sufficient " \
                        "permission level for this command!"
     lookup_error = "Lookup error: Object not found!"
+    conflict_error = "Changed by someone else at the same time, please " \
+        "try again"
     no_ghusername_error = "Couldn't add user because they haven't set a "\
         "Github username."
 
@@ -229,21 +232,12 @@ class TeamCommand(Command):
         """
         try:
             team = get_team_by_name(self.facade, team_name)
-            team_leads_set = team.team_leads
-            team_leads_list = list(map(lambda i: ('github_user_id',
-                                                  str(i)), team_leads_set))
-            team_leads: List[User] = []
-            if team_leads_list:
-                team_leads = self.facade.query_or(User, team_leads_list)
+            team_leads = get_users_by_ghid(self.facade,
+                                           list(team.team_leads))
             names = set(map(lambda m: m.github_username, team_leads))
             team.team_leads = names
 
-            members_set = team.members
-            members_list = list(map(lambda i: ('github_user_id',
-                                               str(i)), members_set))
-            members: List[User] = []
-            if members_list:
-                members = self.facade.query_or(User, members_list)
+            members = get_team_members(self.facade, team)
             names = set(map(lambda m: m.github_username, members))
             team.members = names
             return {'attachments': [team.get_attachment()]}, 200
@@ -362,7 +356,8 @@ class TeamCommand(Command):
                 return self.no_ghusername_error, 200
             team.add_member(user.github_id)
             self.gh.add_team_member(user.github_username, team.github_team_id)
-            self.facade.store(team)
+            self.facade.update_set(Team, team.github_team_id, 'members',
+                                   add=[user.github_id])
             msg = "Added User to " + command_team
 
             # Update drive shares
@@ -379,14 +374,21 @@ class TeamCommand(Command):
             # Only perform promotion if it is actually a promotion.
             if promoted_level > user.permissions_level:
                 logging.info(f"Promoting {command_user} to {promoted_level}")
-                user.permissions_level = promoted_level
-                self.facade.store(user)
+
+                def promote(user: User):
+                    user.permissions_level = max(user.permissions_level,
+                                                 promoted_level)
+
+                update_with_retry(self.facade, User, user.slack_id, promote,
+                                  current=user)
                 msg += f" and promoted user to {promoted_level}"
             ret = {'attachments': [team.get_attachment()], 'text': msg}
             return ret, 200
 
         except LookupError:
             return self.lookup_error, 200
+        except VersionConflict:
+            return self.conflict_error, 200
         except GithubAPIException as e:
             logging.error("user added unsuccessfully to team")
             return f"User added unsuccessfully with the " \
@@ -417,12 +419,17 @@ class TeamCommand(Command):
             if not self.gh.has_team_member(user.github_username,
                                            team.github_team_id):
                 return "User not in team!", 200
+            was_lead = team.has_team_lead(user.github_id)
             team.discard_member(user.github_id)
-            if team.has_team_lead(user.github_id):
+            if was_lead:
                 team.discard_team_lead(user.github_id)
             self.gh.remove_team_member(user.github_username,
                                        team.github_team_id)
-            self.facade.store(team)
+            self.facade.update_set(Team, team.github_team_id, 'members',
+                                   remove=[user.github_id])
+            if was_lead:
+                self.facade.update_set(Team, team.github_team_id,
+                                       'team_leads', remove=[user.github_id])
 
             msg = "Removed User from " + command_team
 
@@ -456,14 +463,20 @@ class TeamCommand(Command):
 
             if demoted_level is not None:
                 logging.info(f"Demoting {command_user} to member")
-                user.permissions_level = demoted_level
-                self.facade.store(user)
+
+                def demote(user: User):
+                    user.permissions_level = demoted_level
+
+                update_with_retry(self.facade, User, user.slack_id, demote,
+                                  current=user)
                 msg += " and demoted user"
             ret = {'attachments': [team.get_attachment()], 'text': msg}
             return ret, 200
 
         except LookupError:
             return self.lookup_error, 200
+        except VersionConflict:
+            return self.conflict_error, 200
         except GithubAPIException as e:
             logging.error("user removed unsuccessfully from team")
             return f"User removed unsuccessfully with " \
@@ -490,19 +503,26 @@ class TeamCommand(Command):
             msg = f"Team edited: {command_team}, "
             if args.displayname is not None:
                 msg += f"displayname: {args.displayname}, "
-                team.displayname = args.displayname
             if args.platform is not None:
                 msg += f"platform: {args.platform}"
-                team.platform = args.platform
             if args.folder is not None:
                 msg += f"folder: {args.folder}"
-                team.folder = args.folder
             if args.github is not None:
                 msg += f"new github team name: {args.github}"
-                team.github_team_name = args.github
-                self.gh.org_edit_team(
-                    int(team.github_team_id), team.github_team_name)
-            self.facade.store(team)
+                self.gh.org_edit_team(int(team.github_team_id), args.github)
+
+            def edit(team: Team):
+                if args.displayname is not None:
+                    team.displayname = args.displayname
+                if args.platform is not None:
+                    team.platform = args.platform
+                if args.folder is not None:
+                    team.folder = args.folder
+                if args.github is not None:
+                    team.github_team_name = args.github
+
+            team = update_with_retry(self.facade, Team, team.github_team_id,
+                                     edit, current=team)
 
             # Update drive shares if folder was changed
             if args.folder:
@@ -512,6 +532,8 @@ class TeamCommand(Command):
             return ret, 200
         except LookupError:
             return self.lookup_error, 200
+        except VersionConflict:
+            return self.conflict_error, 200
 
     def lead_helper(self, args: Namespace, user_id: str) -> ResponseTuple:
         """
@@ -538,7 +560,9 @@ class TeamCommand(Command):
                     return "User not in team!", 200
                 if team.has_team_lead(user.github_id):
                     team.discard_team_lead(user.github_id)
-                self.facade.store(team)
+                    self.facade.update_set(Team, team.github_team_id,
+                                           'team_leads',
+                                           remove=[user.github_id])
                 msg = f"User removed as team lead from" \
                       f" {command_team}"
             else:
@@ -546,8 +570,11 @@ class TeamCommand(Command):
                     team.add_member(user.github_id)
                     self.gh.add_team_member(user.github_username,
                                             team.github_team_id)
+                    self.facade.update_set(Team, team.github_team_id,
+                                           'members', add=[user.github_id])
                 team.add_team_lead(user.github_id)
-                self.facade.store(team)
+                self.facade.update_set(Team, team.github_team_id,
+                                       'team_leads', add=[user.github_id])
                 msg = f"User added as team lead to" \
                       f" {command_team}"
             ret = {'attachments': [team.get_attachment()], 'text': msg}
@@ -610,16 +637,19 @@ class TeamCommand(Command):
                                     for team in remote_teams)
 
             # remove teams not in github anymore
+            deleted_ids = []
             for local_id in local_team_dict:
                 if local_id not in remote_team_dict:
-                    self.facade.delete(Team, local_id)
+                    deleted_ids.append(local_id)
                     num_deleted += 1
                     modified.append(local_team_dict[local_id].get_attachment())
+            self.facade.bulk_delete(Team, deleted_ids)
 
             # add teams to db that are in github but not in local database
+            updated_teams = []
             for remote_id in remote_team_dict:
                 if remote_id not in local_team_dict:
-                    self.facade.store(remote_team_dict[remote_id])
+                    updated_teams.append(remote_team_dict[remote_id])
                     num_added += 1
                     modified.append(remote_team_dict[remote_id]
                                     .get_attachment())
@@ -633,9 +663,12 @@ class TeamCommand(Command):
                         # update the old team, to retain additional parameters
                         old_team.github_team_name = new_team.github_team_name
                         old_team.members = new_team.members
-                        self.facade.store(old_team)
+                        updated_teams.append(old_team)
                         num_changed += 1
                         modified.append(old_team.get_attachment())
+            # Bulk writes are last-writer-wins: edits made to these teams
+            # while refreshing are overwritten with what was read here
+            self.facade.bulk_store(updated_teams)
 
             # add all members (if not already added) to the 'all' team
             self.refresh_all_team()
@@ -672,16 +705,20 @@ class TeamCommand(Command):
             return
 
         logging.info(f'refreshing all team {all_name}')
+        created = False
         try:
             team_all = get_team_by_name(self.facade, all_name)
         except LookupError:
             t_id = str(self.gh.org_create_team(all_name))
             logging.info(f'team {all_name} created')
             team_all = Team(t_id, all_name, all_name)
+            created = True
 
         if team_all is not None:
-            all_members = self.facade.query(User)
-            for m in all_members:
+            added = []
+            users = self.facade.iter_query(
+                User, attributes=['github_user_id', 'github'])
+            for m in users:
                 if len(m.github_id) > 0 and\
                         not team_all.has_member(m.github_id):
                     # The only way for this to be true is if both locally and
@@ -690,8 +727,13 @@ class TeamCommand(Command):
                     self.gh.add_team_member(m.github_username,
                                             team_all.github_team_id)
                     team_all.add_member(m.github_id)
+                    added.append(m.github_id)
 
-            self.facade.store(team_all)
+            if created:
+                self.facade.store(team_all)
+            else:
+                self.facade.update_set(Team, team_all.github_team_id,
+                                       'members', add=added)
         else:
             logging.error(f'Could not create {all_name}. Aborting.')
 
@@ -734,7 +776,8 @@ class TeamCommand(Command):
                     if user.permissions_level < t['permission']:
                         user.permissions_level = t['permission']
                         updated.append(user)
-                        self.facade.store(user)
+                # Last-writer-wins, like every bulk write
+                self.facade.bulk_store(updated)
                 if len(updated) > 0:
                     logging.info(f'updated users {updated}')
                 else:
@@ -5,7 +5,8 @@ import shlex
 from argparse import ArgumentParser, _SubParsersAction, Namespace
 from app.controller import ResponseTuple
 from app.controller.command.commands.base import Command
-from db.facade import DBFacade
+from db.facade import DBFacade, VersionConflict
+from db.utils import update_with_retry
 from interface.github import GithubAPIException, GithubInterface
 from interface.gcp import GCPInterface
 from interface.gcp_utils import sync_user_email_perms
@@ -21,6 +22,7 @@ class UserCommand(Command):
     permission_error = "You do not have the sufficient " \
                        "permission level for this command!"
     lookup_error = "Lookup error! User not found!"
+    conflict_error = "User was changed by someone else, please try again"
     viewinspect_noghid = 'Specified user does not have a Github account'\
         'registered with Rocket.'
     delete_text = "Deleted user with Slack ID: "
@@ -152,9 +154,9 @@ class UserCommand(Command):
                     message if we cannot find the user in question
         """
         if user.github_username:
-            membership = self.facade.query_or(
-                Team, [('members', user.github_id),
-                       ('team_leads', user.github_id)])
+            team_ids = self.facade.get_membership(user.github_id)
+            membership = self.facade.bulk_retrieve(
+                Team, sorted(team_ids.member_of | team_ids.lead_of))
             member_of = ['- ' + t.github_team_name for t in membership]
             lead_of = ['- ' + t.github_team_name for t in membership
                        if t.is_team_lead(user.github_id)]
@@ -193,52 +195,59 @@ class UserCommand(Command):
             or the edit message if user is edited
         """
         is_admin = False
-        edited_user = None
+        edited_id = user_id
         msg = ""
-        if args.username is not None:
-            try:
-                admin_user = self.facade.retrieve(User, user_id)
-                if admin_user.permissions_level != Permissions.admin:
+        try:
+            command_user = self.facade.retrieve(User, user_id)
+            if args.username is not None:
+                if command_user.permissions_level != Permissions.admin:
                     return self.permission_error, 200
-                else:
-                    is_admin = True
-                    edited_id = args.username
-                    edited_user = self.facade.retrieve(User, edited_id)
-            except LookupError:
-                return self.lookup_error, 200
-        else:
-            try:
-                edited_user = self.facade.retrieve(User, user_id)
-            except LookupError:
-                return self.lookup_error, 200
+                is_admin = True
+                edited_id = args.username
+            # Edited on the first attempt below, so that it is only read
+            # again if someone else stores it in the meantime
+            edited_user = command_user if edited_id == user_id else \
+                self.facade.retrieve(User, edited_id)
+        except LookupError:
+            return self.lookup_error, 200
 
-        if args.name:
-            edited_user.name = args.name
-        if args.email:
-            edited_user.email = escape_email(args.email)
-        if args.pos:
-            edited_user.position = args.pos
+        github_id = None
         if args.github:
             try:
                 github_id = self.github.org_add_member(args.github)
-                edited_user.github_username = args.github
-                edited_user.github_id = github_id
             except GithubAPIException:
                 msg = f"\nError adding user {args.github} to " \
                       f"GitHub organization"
                 logging.error(msg)
-        if args.major:
-            edited_user.major = args.major
-        if args.bio:
-            edited_user.biography = args.bio
-        if args.permission and is_admin:
-            edited_user.permissions_level = args.permission
-        elif args.permission and not is_admin:
+        if args.permission and not is_admin:
             msg += "\nCannot change own permission: user isn't admin."
             logging.warning(f"User {user_id} tried to elevate permissions"
                             " level.")
 
-        self.facade.store(edited_user)
+        def edit(edited_user: User):
+            if args.name:
+                edited_user.name = args.name
+            if args.email:
+                edited_user.email = escape_email(args.email)
+            if args.pos:
+                edited_user.position = args.pos
+            if github_id is not None:
+                edited_user.github_username = args.github
+                edited_user.github_id = github_id
+            if args.major:
+                edited_user.major = args.major
+            if args.bio:
+                edited_user.biography = args.bio
+            if args.permission and is_admin:
+                edited_user.permissions_level = args.permission
+
+        try:
+            edited_user = update_with_retry(self.facade, User, edited_id,
+                                            edit, current=edited_user)
+        except LookupError:
+            return self.lookup_error, 200
+        except VersionConflict:
+            return self.conflict_error, 200
 
         # Sync permissions only if email was updated
         if args.email:
@@ -6,6 +6,7 @@ from app.controller.command.commands import UserCommand, TeamCommand,\
 from app.controller.command.commands.base import Command
 from app.controller.command.commands.token import TokenCommandConfig
 from db.facade import DBFacade
+from db.metrics import record_db_calls
 from interface.slack import Bot
 from interface.github import GithubInterface
 from interface.gcp import GCPInterface
@@ -72,25 +73,26 @@ class CommandParser:
         cmd_txt = util.ios_dash(cmd_txt)
         s = cmd_txt.split(' ', 1)
         cmd_name = 'help'
-        if s[0] == 'help' or s[0] is None:
-            logging.info('Help command was called')
-            resp, _ = self.get_help()
-        elif s[0] in self.commands:
-            resp, _ = self.commands[s[0]].handle(cmd_txt, user)
+        with record_db_calls() as db_stats:
+            if s[0] == 'help' or s[0] is None:
+                logging.info('Help command was called')
+                resp, _ = self.get_help()
+            elif s[0] in self.commands:
+                resp, _ = self.commands[s[0]].handle(cmd_txt, user)
 
-            # Hack to only grab first 2 command/subcommand pair
-            s = cmd_txt.split(' ')
-            if len(s) == 2 and s[1].startswith('-'):
-                cmd_name = s[0]
+                # Hack to only grab first 2 command/subcommand pair
+                s = cmd_txt.split(' ')
+                if len(s) == 2 and s[1].startswith('-'):
+                    cmd_name = s[0]
+                else:
+                    cmd_name = ' '.join(s[0:2])
+            elif util.is_slack_id(s[0]):
+                logging.info('mention command activated')
+                resp, _ = self.commands['mention'].handle(cmd_txt, user)
+                cmd_name = 'mention'
             else:
-                cmd_name = ' '.join(s[0:2])
-        elif util.is_slack_id(s[0]):
-            logging.info('mention command activated')
-            resp, _ = self.commands['mention'].handle(cmd_txt, user)
-            cmd_name = 'mention'
-        else:
-            logging.error("app command triggered incorrectly")
-            resp, _ = self.get_help()
+                logging.error("app command triggered incorrectly")
+                resp, _ = self.get_help()
 
         if isinstance(resp, str):
             # Wrap response if response is just some text
@@ -99,6 +101,7 @@ class CommandParser:
         # Submit metrics
         duration_taken_ms = time.time() * 1000 - start_time_ms
         self.__metrics.submit_cmd_mstime(cmd_name, duration_taken_ms)
+        self.__metrics.submit_db_stats(cmd_name, db_stats)
 
         if response_url != "":
             requests.post(url=response_url, json=resp)
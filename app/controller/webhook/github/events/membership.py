@@ -47,7 +47,8 @@ class MembershipEventHandler(GitHubEventHandler):
             slack_id = member_list[0].slack_id
             if selected_team.has_member(github_id):
                 selected_team.discard_member(github_id)
-                self._facade.store(selected_team)
+                self._facade.update_set(Team, selected_team.github_team_id,
+                                        'members', remove=[github_id])
                 logging.info(f"deleted slack user {slack_id} "
                              f"from {team_name}")
                 slack_ids_string += f" {slack_id}"
@@ -76,7 +77,8 @@ class MembershipEventHandler(GitHubEventHandler):
         slack_ids_string = ""
         if len(member_list) > 0:
             selected_team.add_member(github_id)
-            self._facade.store(selected_team)
+            self._facade.update_set(Team, selected_team.github_team_id,
+                                    'members', add=[github_id])
             for member in member_list:
                 slack_id = member.slack_id
                 logging.info(f"user {github_username} added to {team_name}")
@@ -78,8 +78,8 @@ class OrganizationEventHandler(GitHubEventHandler):
             # Try to add the user to the 'all' team if it exists
             team_all = get_team_by_name(self._facade, all_name)
             self._gh.add_team_member(github_username, team_all.github_team_id)
-            team_all.add_member(github_id)
-            self._facade.store(team_all)
+            self._facade.update_set(Team, team_all.github_team_id,
+                                    'members', add=[github_id])
         except LookupError:
             # If that team doesn't exist, make it exist
             t_id = str(self._gh.org_create_team(self._conf.github_team_all))
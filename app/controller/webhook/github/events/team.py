@@ -4,6 +4,8 @@ from app.model import Team
 from app.controller import ResponseTuple
 from typing import Dict, Any
 from app.controller.webhook.github.events.base import GitHubEventHandler
+from db.facade import VersionConflict
+from db.utils import update_with_retry
 
 
 class TeamEventHandler(GitHubEventHandler):
@@ -59,16 +61,21 @@ class TeamEventHandler(GitHubEventHandler):
                      payload: Dict[str, Any]) -> ResponseTuple:
         """Help team function if payload action is created."""
         logging.debug(f"team created event triggered: {str(payload)}")
+
+        def rename(team: Team):
+            team.github_team_name = github_team_name
+
         try:
-            team = self._facade.retrieve(Team, github_id)
+            update_with_retry(self._facade, Team, github_id, rename)
             logging.warning(f"team {github_team_name} with "
                             f"id {github_id} already exists.")
-            team.github_team_name = github_team_name
         except LookupError:
             logging.debug(f"team {github_team_name} with "
                           f"id {github_id} added to organization.")
-            team = Team(github_id, github_team_name, "")
-        self._facade.store(team)
+            self._facade.store(Team(github_id, github_team_name, ""))
+        except VersionConflict:
+            logging.error(f"team with github id {github_id} kept changing.")
+            return f"team with github id {github_id} kept changing", 200
         logging.info(f"team {github_team_name} with "
                      f"id {github_id} added to rocket db.")
         return f"created team with github id {github_id}", 200
@@ -95,18 +102,23 @@ class TeamEventHandler(GitHubEventHandler):
                     payload: Dict[str, Any]) -> ResponseTuple:
         """Help team function if payload action is edited."""
         logging.debug(f"team edited event triggered: {str(payload)}")
-        try:
-            team = self._facade.retrieve(Team, github_id)
+
+        def rename(team: Team):
             team.github_team_name = github_team_name
+
+        try:
+            team = update_with_retry(self._facade, Team, github_id, rename)
             logging.info(f"changed team's name with id {github_id} from "
                          f"{github_team_name} to {team.github_team_name}")
-            self._facade.store(team)
             logging.info(f"updated team with id {github_id} in"
                          " rocket db.")
             return f"updated team with id {github_id}", 200
         except LookupError:
             logging.error(f"team with github id {github_id} not found.")
             return f"team with github id {github_id} not found", 200
+        except VersionConflict:
+            logging.error(f"team with github id {github_id} kept changing.")
+            return f"team with github id {github_id} kept changing", 200
 
     def team_added_to_repository(self,
                                  github_id: str,
@@ -8,6 +8,12 @@ T = TypeVar('T', bound='RocketModel')
 class RocketModel(ABC):
     """Define the properties and methods needed for a data model."""
 
+    # Subclasses list their attributes in ``__slots__``, so that instances
+    # don't need a ``__dict__``. ``from_db`` isn't one of their attributes:
+    # it records whether the object was read from the database, and is
+    # neither printed, pickled nor compared.
+    __slots__ = ('from_db',)
+
     @abstractmethod
     def get_attachment(self) -> Dict[str, Any]:
         """Return slack-formatted attachment (dictionary) for data model."""
@@ -1,13 +1,91 @@
 """Represent a data model for a team."""
-from typing import Set, Dict, Any, TypeVar, Type
+from typing import Set, Dict, Any, Iterable, Optional, Tuple, TypeVar, Type
 from app.model.base import RocketModel
 
 T = TypeVar('T', bound='Team')
 
+# First byte of packed sets of Github IDs, identifying their format
+PACKED_IDS_FORMAT = 1
+
+
+def pack_ids(ids: Iterable[str]) -> Optional[bytes]:
+    """
+    Pack Github IDs into sorted, delta-encoded varints.
+
+    After a byte identifying the format come the smallest ID, then the
+    difference between every ID and the previous one, each as an unsigned
+    LEB128 varint (7 bits per byte, the high bit set on every byte but the
+    last). Members of a team usually differ by a few bytes' worth, so every
+    ID takes 1 to 3 bytes instead of the 7 to 9 of its decimal string.
+
+    :param ids: Github IDs, as decimal strings
+    :return: the packed IDs, or ``None`` if some ID is not a decimal number
+             (with no leading zeros), which packing would not preserve
+    """
+    nums = []
+    for gh_id in ids:
+        if not (gh_id.isascii() and gh_id.isdigit()) or \
+                (gh_id[0] == '0' and len(gh_id) > 1):
+            return None
+        nums.append(int(gh_id))
+    nums.sort()
+
+    packed = bytearray([PACKED_IDS_FORMAT])
+    prev = 0
+    for n in nums:
+        delta = n - prev
+        prev = n
+        while delta >= 0x80:
+            packed.append(delta & 0x7f | 0x80)
+            delta >>= 7
+        packed.append(delta)
+    return bytes(packed)
+
+
+def unpack_ids(packed: bytes) -> Set[str]:
+    """
+    Unpack Github IDs packed by :func:`pack_ids`.
+
+    :param packed: the packed IDs
+    :raises: ValueError if the IDs are not in a known format
+    :return: the Github IDs, as decimal strings
+    """
+    if len(packed) == 0 or packed[0] != PACKED_IDS_FORMAT:
+        raise ValueError('Unknown format of packed Github IDs')
+    ids = set()
+    n = delta = shift = 0
+    for b in memoryview(packed)[1:]:
+        delta |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            n += delta
+            ids.add(str(n))
+            delta = shift = 0
+    return ids
+
+
+def read_ids(stored: Any) -> Set[str]:
+    """
+    Read Github IDs stored either as a set of strings or packed.
+
+    :param stored: a collection of IDs, or bytes-like packed IDs (see
+                   :func:`pack_ids`), possibly wrapped in an object holding
+                   them in ``value`` like boto3's ``Binary``
+    :return: the Github IDs
+    """
+    if isinstance(stored, (set, frozenset, list, tuple)):
+        return set(stored)
+    return unpack_ids(bytes(getattr(stored, 'value', stored)))
+
 
 class Team(RocketModel):
     """Represent a team with related fields and methods."""
 
+    __slots__ = ('github_team_id', 'github_team_name', 'displayname',
+                 'platform', 'team_leads', 'members', 'folder', 'updated_at',
+                 'version')
+
     def __init__(self,
                  github_team_id: str,
                  github_team_name: str,
@@ -24,6 +102,13 @@ class Team(RocketModel):
         self.team_leads: Set[str] = set()
         self.members: Set[str] = set()
         self.folder = ""
+        # Milliseconds since the epoch of the last write, or 0 if never stored
+        self.updated_at = 0
+        # Number of times stored, checked to detect concurrent writes
+        self.version = 0
+        # Whether the team was read from the database, in which case it is
+        # only stored if nobody else stored it since, even at version 0
+        self.from_db = False
 
     def get_attachment(self):
         """Return slack-formatted attachment (dictionary) for team."""
@@ -64,19 +149,24 @@ class Team(RocketModel):
         :param d: the dictionary representing a team
         :return: the converted team model.
         """
-        team = cls(d['github_team_id'],
-                   d['github_team_name'],
-                   d.get('displayname', ''))
-        team.platform = d.get('platform', '')
-        team.folder = d.get('folder', '')
-        team.team_leads = set(d.get('team_leads', []))
-        members = set(d.get('members', []))
-        for member in members:
-            team.add_member(member)
+        # Every attribute is set here, so skip the defaults of __init__
+        team: T = cls.__new__(cls)
+        get = d.get
+        team.github_team_id = d['github_team_id']
+        team.github_team_name = d['github_team_name']
+        team.displayname = get('displayname', '')
+        team.platform = get('platform', '')
+        team.team_leads = read_ids(get('team_leads', ()))
+        team.members = read_ids(get('members', ()))
+        team.folder = get('folder', '')
+        team.updated_at = int(get('updated_at', 0))
+        team.version = int(get('version', 0))
+        team.from_db = True
         return team
 
     @classmethod
-    def to_dict(cls: Type[T], team: T) -> Dict[str, Any]:
+    def to_dict(cls: Type[T], team: T, packed: bool = False) \
+            -> Dict[str, Any]:
         """
         Convert team object to dict object.
 
@@ -84,22 +174,28 @@ class Team(RocketModel):
         compatible with storing into NoSQL databases like DynamoDB.
 
         :param team: the team object
+        :param packed: pack the IDs of members and leads into bytes (see
+                       :func:`pack_ids`), unless some of them aren't numbers
         :return: the dictionary representing the team
         """
-        def place_if_filled(name: str, field: Any):
-            """Populate ``tdict`` if ``field`` isn't empty."""
-            if field:
-                tdict[name] = field
-
-        tdict = {
+        tdict: Dict[str, Any] = {
             'github_team_id': team.github_team_id,
             'github_team_name': team.github_team_name
         }
-        place_if_filled('displayname', team.displayname)
-        place_if_filled('platform', team.platform)
-        place_if_filled('members', team.members)
-        place_if_filled('team_leads', team.team_leads)
-        place_if_filled('folder', team.folder)
+        for name, field in (('displayname', team.displayname),
+                            ('platform', team.platform),
+                            ('members', team.members),
+                            ('team_leads', team.team_leads),
+                            ('folder', team.folder),
+                            ('updated_at', team.updated_at),
+                            ('version', team.version)):
+            if field:
+                tdict[name] = field
+        if packed:
+            for name in ('members', 'team_leads'):
+                ids = pack_ids(tdict[name]) if name in tdict else None
+                if ids is not None:
+                    tdict[name] = ids
 
         return tdict
 
@@ -119,8 +215,13 @@ class Team(RocketModel):
             len(team.github_team_id) > 0
 
     def __eq__(self, other: object) -> bool:
-        """Return true if this team has the same attributes as the other."""
-        return isinstance(other, Team) and str(self) == str(other)
+        """
+        Return true if this team has the same attributes as the other.
+
+        ``updated_at``, ``version`` and ``from_db`` are ignored, since they
+        only record the history of the team in the database.
+        """
+        return isinstance(other, Team) and self.__attrs() == other.__attrs()
 
     def __ne__(self, other: object) -> bool:
         """Return the opposite of what is returned in self.__eq__(other)."""
@@ -156,8 +257,29 @@ class Team(RocketModel):
 
     def __str__(self) -> str:
         """Print information on the team class."""
-        return str(self.__dict__)
+        return str({k: getattr(self, k) for k in self.__slots__})
 
     def __hash__(self) -> int:
-        """Hash the team class using a dictionary."""
-        return self.__str__().__hash__()
+        """Hash the team class using the attributes compared by __eq__."""
+        return hash(self.__attrs())
+
+    def __attrs(self) -> Tuple[Any, ...]:
+        """Return the attributes compared by ``__eq__``."""
+        return (self.github_team_id, self.github_team_name, self.displayname,
+                self.platform, frozenset(self.team_leads),
+                frozenset(self.members), self.folder)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Return the attributes to pickle."""
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        """
+        Restore the attributes of a pickled team.
+
+        Teams pickled before an attribute was added keep its default.
+        """
+        Team.__init__(self, state['github_team_id'],
+                      state['github_team_name'], state['displayname'])
+        for k, v in state.items():
+            setattr(self, k, v)
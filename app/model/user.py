@@ -1,5 +1,5 @@
 """Data model to represent an individual user."""
-from typing import Dict, Any, TypeVar, Type
+from typing import Dict, Any, Tuple, TypeVar, Type
 from app.model.permissions import Permissions
 from app.model.base import RocketModel
 
@@ -9,6 +9,10 @@ T = TypeVar('T', bound='User')
 class User(RocketModel):
     """Represent a user with related fields and methods."""
 
+    __slots__ = ('slack_id', 'name', 'email', 'github_username', 'github_id',
+                 'major', 'position', 'biography', 'image_url',
+                 'permissions_level', 'karma', 'updated_at', 'version')
+
     def __init__(self, slack_id: str):
         """Initialize the user with a given Slack ID."""
         self.slack_id = slack_id
@@ -22,6 +26,13 @@ class User(RocketModel):
         self.image_url = ""
         self.permissions_level = Permissions.member
         self.karma = 1
+        # Milliseconds since the epoch of the last write, or 0 if never stored
+        self.updated_at = 0
+        # Number of times stored, checked to detect concurrent writes
+        self.version = 0
+        # Whether the user was read from the database, in which case it is
+        # only stored if nobody else stored it since, even at version 0
+        self.from_db = False
 
     def get_attachment(self) -> Dict[str, Any]:
         """Return slack-formatted attachment (dictionary) for user."""
@@ -57,24 +68,23 @@ class User(RocketModel):
         :param user: the user object
         :return: the dictionary representing the user
         """
-        def place_if_filled(name: str, field: Any):
-            """Populate ``udict`` if ``field`` isn't empty."""
-            if field:
-                udict[name] = field
-
-        udict = {
+        udict: Dict[str, Any] = {
             'slack_id': user.slack_id,
             'permission_level': user.permissions_level.name
         }
-        place_if_filled('email', user.email)
-        place_if_filled('name', user.name)
-        place_if_filled('github', user.github_username)
-        place_if_filled('github_user_id', user.github_id)
-        place_if_filled('major', user.major)
-        place_if_filled('position', user.position)
-        place_if_filled('bio', user.biography)
-        place_if_filled('image_url', user.image_url)
-        place_if_filled('karma', user.karma)
+        for name, field in (('email', user.email),
+                            ('name', user.name),
+                            ('github', user.github_username),
+                            ('github_user_id', user.github_id),
+                            ('major', user.major),
+                            ('position', user.position),
+                            ('bio', user.biography),
+                            ('image_url', user.image_url),
+                            ('karma', user.karma),
+                            ('updated_at', user.updated_at),
+                            ('version', user.version)):
+            if field:
+                udict[name] = field
 
         return udict
 
@@ -86,18 +96,24 @@ class User(RocketModel):
         :param d: the dictionary representing a user
         :return: the converted user model.
         """
-        user = cls(d['slack_id'])
-        user.email = d.get('email', '')
-        user.name = d.get('name', '')
-        user.github_username = d.get('github', '')
-        user.github_id = d.get('github_user_id', '')
-        user.major = d.get('major', '')
-        user.position = d.get('position', '')
-        user.biography = d.get('bio', '')
-        user.image_url = d.get('image_url', '')
-        user.permissions_level =\
-            Permissions[d.get('permission_level', 'member')]
-        user.karma = int(d.get('karma', 1))
+        # Every attribute is set here, so skip the defaults of __init__
+        user: T = cls.__new__(cls)
+        get = d.get
+        user.slack_id = d['slack_id']
+        user.name = get('name', '')
+        user.email = get('email', '')
+        user.github_username = get('github', '')
+        user.github_id = get('github_user_id', '')
+        user.major = get('major', '')
+        user.position = get('position', '')
+        user.biography = get('bio', '')
+        user.image_url = get('image_url', '')
+        user.permissions_level = Permissions[get('permission_level',
+                                                 'member')]
+        user.karma = int(get('karma', 1))
+        user.updated_at = int(get('updated_at', 0))
+        user.version = int(get('version', 0))
+        user.from_db = True
         return user
 
     @classmethod
@@ -115,9 +131,13 @@ class User(RocketModel):
         return len(user.slack_id) > 0
 
     def __eq__(self, other: object) -> bool:
-        """Return true if this user has the same attributes as the other."""
-        return isinstance(other, User) and\
-            str(self.__dict__) == str(other.__dict__)
+        """
+        Return true if this user has the same attributes as the other.
+
+        ``updated_at``, ``version`` and ``from_db`` are ignored, since they
+        only record the history of the user in the database.
+        """
+        return isinstance(other, User) and self.__attrs() == other.__attrs()
 
     def __ne__(self, other: object) -> bool:
         """Return the opposite of what is returned in self.__eq__(other)."""
@@ -125,8 +145,28 @@ class User(RocketModel):
 
     def __str__(self) -> str:
         """Print information on the user class."""
-        return str(self.__dict__)
+        return str({k: getattr(self, k) for k in self.__slots__})
 
     def __hash__(self) -> int:
-        """Hash the user class using a dictionary."""
-        return self.__str__().__hash__()
+        """Hash the user class using the attributes compared by __eq__."""
+        return hash(self.__attrs())
+
+    def __attrs(self) -> Tuple[Any, ...]:
+        """Return the attributes compared by ``__eq__``."""
+        return (self.slack_id, self.name, self.email, self.github_username,
+                self.github_id, self.major, self.position, self.biography,
+                self.image_url, self.permissions_level, self.karma)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Return the attributes to pickle."""
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        """
+        Restore the attributes of a pickled user.
+
+        Users pickled before an attribute was added keep its default.
+        """
+        User.__init__(self, state['slack_id'])
+        for k, v in state.items():
+            setattr(self, k, v)
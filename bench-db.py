@@ -0,0 +1,269 @@
+"""
+Benchmarks the database facade on a synthetic organization.
+
+Seeds users and teams with skewed team sizes and memberships, times the
+most common reads and writes, as well as converting and deduplicating whole
+tables of models, and writes the latency percentiles (and consumed capacity,
+with DynamoDB) of every operation to a JSON file that can be compared across
+commits.
+
+Run with pipenv run python bench-db.py --backend memory
+"""
+from app.model import Team, User
+from collections import defaultdict
+from config import Config
+from db import DBFacade, DynamoDB, IndexedMemoryDB
+from db.metrics import record_db_calls
+from db.utils import get_team_by_name, get_team_members
+from factory import make_dbfacade
+from tests.memorydb import MemoryDB
+from typing import Any, Callable, Dict, List, Tuple
+import argparse
+import json
+import random
+import subprocess
+import time
+import tracemalloc
+
+# Prefixes of the IDs of seeded objects, to clean them up afterwards
+USER_PREFIX = 'Ubench'
+TEAM_PREFIX = 'bench'
+
+
+def make_org(n_users: int, n_teams: int, rng: random.Random) \
+        -> Tuple[List[User], List[Team]]:
+    """
+    Make users and teams with realistic skew.
+
+    Team sizes follow a power law, so a few teams have most of the members,
+    and some users are much more likely to be in teams than others.
+    """
+    users = []
+    for i in range(n_users):
+        u = User(f'{USER_PREFIX}{i}')
+        u.name = f'Bench User {i}'
+        u.email = f'bench{i}@ubc.ca'
+        u.github_username = f'bench-user-{i}'
+        u.github_id = str(10_000_000 + i)
+        u.major = rng.choice(['Computer Science', 'Physics', 'Math'])
+        u.karma = rng.randint(1, 100)
+        users.append(u)
+
+    gh_ids = [u.github_id for u in users]
+    weights = [1 / (i + 1) for i in range(n_users)]
+    max_size = max(1, n_users // 20)
+    teams = []
+    for i in range(n_teams):
+        t = Team(f'{TEAM_PREFIX}{i}', f'bench-team-{i}', f'Bench Team {i}')
+        t.platform = rng.choice(['web', 'iOS', 'Android'])
+        size = max(1, int(max_size / (i + 1) ** 0.8))
+        t.members = set(rng.choices(gh_ids, weights=weights, k=size))
+        t.team_leads = set(rng.sample(sorted(t.members),
+                                      min(2, len(t.members))))
+        teams.append(t)
+    return users, teams
+
+
+def percentile(sorted_ms: List[float], p: float) -> float:
+    """Return the nearest-rank percentile of sorted latencies."""
+    rank = max(0, int(round(p / 100 * len(sorted_ms))) - 1)
+    return sorted_ms[min(rank, len(sorted_ms) - 1)]
+
+
+def measure(op: Callable[[], Any], n: int,
+            capacity: bool = False) -> Dict[str, float]:
+    """
+    Run an operation ``n`` times, and summarize its latencies, and the
+    capacity units its facade calls consumed if ``capacity`` is true.
+    """
+    latencies = []
+    with record_db_calls() as stats:
+        for _ in range(n):
+            start = time.perf_counter()
+            op()
+            latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    result = {
+        'count': n,
+        'mean_ms': sum(latencies) / n,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+    }
+    if capacity:
+        units = sum(s.capacity_units for s in stats.ops.values())
+        result['capacity_units_per_op'] = units / n
+    return result
+
+
+def model_ops(users: List[User], teams: List[Team],
+              rng: random.Random) -> Dict[str, Callable[[], Any]]:
+    """
+    Return operations on whole tables of models.
+
+    Commands like ``/team refresh`` and ``/iquit`` deserialize every team or
+    user, and deduplicate lists of them with sets, which hashes and compares
+    every model. Half of the deduplicated models are distinct copies of
+    others, so that they are compared too.
+    """
+    user_dicts = [User.to_dict(u) for u in users]
+    team_dicts = [Team.to_dict(t) for t in teams]
+    dup_users = users + [User.from_dict(d) for d in
+                         rng.sample(user_dicts, len(user_dicts) // 2)]
+    dup_teams = teams + [Team.from_dict(d) for d in
+                         rng.sample(team_dicts, len(team_dicts) // 2)]
+    return {
+        'users_from_dict': lambda: [User.from_dict(d) for d in user_dicts],
+        'teams_from_dict': lambda: [Team.from_dict(d) for d in team_dicts],
+        'users_to_dict': lambda: [User.to_dict(u) for u in users],
+        'teams_to_dict': lambda: [Team.to_dict(t) for t in teams],
+        'dedupe_users': lambda: set(dup_users),
+        'dedupe_teams': lambda: set(dup_teams),
+    }
+
+
+def model_bytes(model: Any, dicts: List[Dict[str, Any]]) -> float:
+    """Return the memory allocated per model deserialized from ``dicts``."""
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        models = [model.from_dict(d) for d in dicts]
+        size = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    return size / max(1, len(models))
+
+
+def make_facade(backend: str) -> DBFacade:
+    """Create the facade to benchmark."""
+    if backend == 'memory':
+        return IndexedMemoryDB()
+    elif backend == 'test':
+        return MemoryDB()
+
+    config = Config()
+    if config.db_backend == 'dynamodb' and not config.aws_local:
+        raise RuntimeError('Refusing to benchmark a remote DynamoDB; '
+                           'set AWS_LOCAL=True to use DynamoDB Local')
+    return make_dbfacade(config)
+
+
+def git_commit() -> str:
+    """Return the current commit, if there is one."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """Seed the database, run every benchmark and return the results."""
+    rng = random.Random(args.seed)
+    db = make_facade(args.backend)
+    # Only DynamoDB reports the capacity its requests consume
+    capacity = isinstance(db, DynamoDB)
+
+    users, teams = make_org(args.users, args.teams, rng)
+    start = time.perf_counter()
+    db.bulk_store(users)
+    db.bulk_store(teams)
+    seed_secs = time.perf_counter() - start
+
+    def some_users(k: int) -> List[User]:
+        return [users[rng.randrange(len(users))] for _ in range(k)]
+
+    def random_team() -> Team:
+        return teams[rng.randrange(len(teams))]
+
+    def store_user():
+        u = some_users(1)[0]
+        u.karma += 1
+        db.store(u)
+
+    ops: Dict[str, Callable[[], Any]] = {
+        'retrieve': lambda: db.retrieve(User, some_users(1)[0].slack_id),
+        'bulk_retrieve': lambda: db.bulk_retrieve(
+            User, [u.slack_id for u in some_users(50)]),
+        'query': lambda: db.query(
+            User, [('github_user_id', some_users(1)[0].github_id)]),
+        'query_or': lambda: db.query_or(
+            User, [('github_user_id', u.github_id) for u in some_users(20)]),
+        'get_team_by_name': lambda: get_team_by_name(
+            db, random_team().github_team_name),
+        'get_team_members': lambda: get_team_members(db, random_team()),
+        'store': store_user,
+    }
+    table_ops = model_ops(users, teams, rng)
+    only = set(args.only or [*ops, *table_ops])
+    results = {name: measure(op, args.ops, capacity)
+               for name, op in ops.items() if name in only}
+    results.update({name: measure(op, args.table_ops)
+                    for name, op in table_ops.items() if name in only})
+
+    if args.backend == 'config':
+        db.bulk_delete(User, [u.slack_id for u in users])
+        db.bulk_delete(Team, [t.github_team_id for t in teams])
+
+    return {
+        'commit': git_commit(),
+        'backend': args.backend,
+        'users': args.users,
+        'teams': args.teams,
+        'seed': args.seed,
+        'seed_secs': seed_secs,
+        'results': results,
+        'model_bytes': {
+            'User': model_bytes(User, [User.to_dict(u) for u in users]),
+            'Team': model_bytes(Team, [Team.to_dict(t) for t in teams]),
+        },
+    }
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]):
+    """Print how the latencies changed between two runs."""
+    print(f"{'operation':<20}{'p50 before':>12}{'p50 after':>12}"
+          f"{'p99 before':>12}{'p99 after':>12}")
+    for name, r in new['results'].items():
+        o = old['results'].get(name, defaultdict(float))
+        print(f"{name:<20}{o['p50_ms']:>12.3f}{r['p50_ms']:>12.3f}"
+              f"{o['p99_ms']:>12.3f}{r['p99_ms']:>12.3f}")
+    for model, size in new['model_bytes'].items():
+        before = old.get('model_bytes', {}).get(model, 0.0)
+        print(f"{model} bytes{'':<14}{before:>12.0f}{size:>12.0f}")
+
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+parser.add_argument('--backend', choices=['memory', 'test', 'config'],
+                    default='memory',
+                    help='indexed in-memory database, the MemoryDB used in '
+                         'tests, or the database in the environment '
+                         '(DynamoDB Local or SQLite)')
+parser.add_argument('--users', type=int, default=10_000)
+parser.add_argument('--teams', type=int, default=800)
+parser.add_argument('--ops', type=int, default=200,
+                    help='number of times each operation is timed')
+parser.add_argument('--table-ops', type=int, default=20,
+                    help='number of times each operation on whole tables '
+                         'of models is timed')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--only', nargs='*', help='operations to time')
+parser.add_argument('--output', default='bench-db.json')
+parser.add_argument('--compare', help='previous results to compare with')
+args = parser.parse_args()
+
+report = run(args)
+with open(args.output, 'w') as f:
+    json.dump(report, f, indent=2)
+
+if args.compare:
+    with open(args.compare) as f:
+        compare(json.load(f), report)
+else:
+    for name, r in report['results'].items():
+        print(f"{name:<20} p50 {r['p50_ms']:.3f}ms  p95 {r['p95_ms']:.3f}ms"
+              f"  p99 {r['p99_ms']:.3f}ms")
+    for model, size in report['model_bytes'].items():
+        print(f"{model:<20} {size:.0f} bytes")
+print(f"Results written to `{args.output}`")
@@ -31,14 +31,43 @@ class Config:
         'AWS_SECRET_KEY': 'aws_secret_key',
         'AWS_USERS_TABLE': 'aws_users_tablename',
         'AWS_TEAMS_TABLE': 'aws_teams_tablename',
+        'AWS_MEMBERSHIPS_TABLE': 'aws_memberships_tablename',
+        'AWS_DELETIONS_TABLE': 'aws_deletions_tablename',
         'AWS_REGION': 'aws_region',
         'AWS_LOCAL': 'aws_local',
 
+        'DB_CACHE_SIZE': 'db_cache_size',
+        'DB_CACHE_TTL': 'db_cache_ttl',
+        'DB_SCAN_SEGMENTS': 'db_scan_segments',
+        'DB_MAX_CONNECTIONS': 'db_max_connections',
+        'DB_MAX_RETRIES': 'db_max_retries',
+        'DB_BILLING_MODE': 'db_billing_mode',
+        'DB_READ_CAPACITY': 'db_read_capacity',
+        'DB_WRITE_CAPACITY': 'db_write_capacity',
+        'DB_PACK_MEMBERS': 'db_pack_members',
+        'DB_BACKEND': 'db_backend',
+        'SQLITE_PATH': 'sqlite_path',
+        'MEMORY_SNAPSHOT_PATH': 'memory_snapshot_path',
+
         'GCP_SERVICE_ACCOUNT_CREDENTIALS': 'gcp_service_account_credentials',
         'GCP_SERVICE_ACCOUNT_SUBJECT': 'gcp_service_account_subject'
     }
     OPTIONALS = {
         'AWS_LOCAL': 'False',
+        'AWS_MEMBERSHIPS_TABLE': '',
+        'AWS_DELETIONS_TABLE': '',
+        'DB_CACHE_SIZE': '0',
+        'DB_CACHE_TTL': '60',
+        'DB_SCAN_SEGMENTS': '0',
+        'DB_MAX_CONNECTIONS': '50',
+        'DB_MAX_RETRIES': '5',
+        'DB_BILLING_MODE': '',
+        'DB_READ_CAPACITY': '1',
+        'DB_WRITE_CAPACITY': '1',
+        'DB_PACK_MEMBERS': 'False',
+        'DB_BACKEND': 'dynamodb',
+        'SQLITE_PATH': 'rocket2.db',
+        'MEMORY_SNAPSHOT_PATH': '',
         'GITHUB_DEFAULT_TEAM_NAME': 'all',
         'GITHUB_ADMIN_TEAM_NAME': '',
         'GITHUB_LEADS_TEAM_NAME': '',
@@ -76,6 +105,14 @@ class Config:
             raise MissingConfigError(missing_config_fields)
 
         self.aws_local = self.aws_local == 'True'
+        self.db_cache_size = int(self.db_cache_size)
+        self.db_cache_ttl = float(self.db_cache_ttl)
+        self.db_scan_segments = int(self.db_scan_segments)
+        self.db_max_connections = int(self.db_max_connections)
+        self.db_max_retries = int(self.db_max_retries)
+        self.db_read_capacity = int(self.db_read_capacity)
+        self.db_write_capacity = int(self.db_write_capacity)
+        self.db_pack_members = self.db_pack_members == 'True'
         self.github_key = self.github_key\
             .replace('\\n', '\n')\
             .replace('\\-', '-')
@@ -102,9 +139,24 @@ class Config:
         self.aws_secret_key = ''
         self.aws_users_tablename = ''
         self.aws_teams_tablename = ''
+        self.aws_memberships_tablename = ''
+        self.aws_deletions_tablename = ''
         self.aws_region = ''
         self.aws_local: bool = False
 
+        self.db_cache_size: int = 0
+        self.db_cache_ttl: float = 60
+        self.db_scan_segments: int = 0
+        self.db_max_connections: int = 50
+        self.db_max_retries: int = 5
+        self.db_billing_mode = ''
+        self.db_read_capacity: int = 1
+        self.db_write_capacity: int = 1
+        self.db_pack_members: bool = False
+        self.db_backend = ''
+        self.sqlite_path = ''
+        self.memory_snapshot_path = ''
+
         self.gcp_service_account_credentials = ''
         self.gcp_service_account_subject = ''
 
@@ -1,7 +1,14 @@
 """Pack the modules contained in the db directory."""
 import db.dynamodb as ddb
 import db.facade as dbf
+import db.cache as dbc
+import db.sqlite as dbs
+import db.memory as dbm
 
 
 DynamoDB = ddb.DynamoDB
 DBFacade = dbf.DBFacade
+VersionConflict = dbf.VersionConflict
+CachingDBFacade = dbc.CachingDBFacade
+SQLiteDB = dbs.SQLiteDB
+IndexedMemoryDB = dbm.IndexedMemoryDB
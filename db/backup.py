@@ -0,0 +1,236 @@
+"""Stream users and teams to and from backup files."""
+import gzip
+import json
+import logging
+
+from app.model import User, Team
+from itertools import islice
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, List, \
+    NamedTuple, Optional, Tuple, TypeVar, Union, cast
+from db.facade import DBFacade
+
+T = TypeVar('T', User, Team)
+
+# Models that are backed up, by the name used in backup files
+MODELS: Dict[str, Any] = {
+    'User': User,
+    'Team': Team
+}
+# Number of objects stored at once when restoring, and between progress
+# reports
+CHUNK_SIZE = 1000
+
+# Called with the number of objects dumped or restored so far
+Progress = Callable[[int], None]
+
+
+class Deletion(NamedTuple):
+    """A user or team deleted since an earlier dump."""
+
+    Model: Any
+    key: str
+
+
+# What a line of a backup file holds
+Entry = Union[User, Team, Deletion]
+
+
+def open_backup(filename: str, mode: str) -> IO[str]:
+    """
+    Open a backup file for reading or writing text.
+
+    Files ending in ``.gz`` are compressed with gzip.
+
+    :param filename: name of the file
+    :param mode: either ``'r'`` or ``'w'``
+    :return: the open file
+    """
+    if filename.endswith('.gz'):
+        return cast(IO[str],
+                    gzip.open(filename, mode + 't', encoding='utf-8'))
+    return open(filename, mode, encoding='utf-8')
+
+
+def encode(obj: T) -> str:
+    """
+    Encode an object as a single line of JSON.
+
+    The line holds the name of the model and the object as returned by
+    ``to_dict``, with sets written as sorted lists.
+
+    :param obj: the user or team to encode
+    :return: the line, without a trailing newline
+    """
+    Model = obj.__class__
+    d = {k: sorted(v) if isinstance(v, set) else v
+         for k, v in Model.to_dict(obj).items()}
+    return json.dumps({'type': Model.__name__, 'item': d},
+                      separators=(',', ':'), sort_keys=True)
+
+
+def encode_deletion(deletion: Deletion) -> str:
+    """
+    Encode a deletion as a single line of JSON.
+
+    :param deletion: the deletion to encode
+    :return: the line, without a trailing newline
+    """
+    return json.dumps({'type': deletion.Model.__name__,
+                       'deleted': deletion.key},
+                      separators=(',', ':'), sort_keys=True)
+
+
+def decode(line: str) -> Entry:
+    """
+    Decode a line written by :func:`encode` or :func:`encode_deletion`.
+
+    :param line: the line to decode
+    :raises: LookupError if the line is for an unknown model
+    :return: the decoded user, team or deletion
+    """
+    record = json.loads(line)
+    if record['type'] not in MODELS:
+        raise LookupError(f"Unknown model {record['type']}")
+    Model = MODELS[record['type']]
+    if 'deleted' in record:
+        return Deletion(Model, record['deleted'])
+    return Model.from_dict(record['item'])  # type: ignore
+
+
+def dump(dbf: DBFacade,
+         f: IO[str],
+         progress: Optional[Progress] = None,
+         since: int = 0) -> Dict[str, int]:
+    """
+    Write every team and user to a file, one JSON object per line.
+
+    Objects are read page by page and written as they arrive, so the whole
+    database is never held in memory.
+
+    With ``since``, only the objects stored at or after that time are
+    written, making a delta on top of an earlier dump. They are found with
+    :meth:`db.facade.DBFacade.iter_changes`, so the delta costs about as
+    much as the objects it holds. The objects deleted since are written
+    before them, so that restoring the delta deletes them again.
+
+    :param dbf: database to dump
+    :param f: file to write to
+    :param progress: called with the number of objects dumped so far, every
+                     ``CHUNK_SIZE`` objects and once done
+    :param since: time of the earlier dump in milliseconds since the epoch
+                  (see :func:`db.utils.now_ms`), or ``0`` to dump everything
+    :raises: RuntimeError if ``since`` is given and deletions are not
+             recorded
+    :return: the number of objects dumped, by model name
+    """
+    counts = {}
+    total = 0
+    for name, Model in MODELS.items():
+        counts[name] = 0
+        objs: Iterator[Any] = dbf.iter_query(Model)
+        if since:
+            deleted = 0
+            for k in dbf.iter_deletions(Model, since):
+                f.write(encode_deletion(Deletion(Model, k)) + '\n')
+                deleted += 1
+            logging.info(f"Dumped {deleted} deleted {name}s")
+            objs = dbf.iter_changes(Model, since)
+        for obj in objs:
+            f.write(encode(obj) + '\n')
+            counts[name] += 1
+            total += 1
+            if progress is not None and total % CHUNK_SIZE == 0:
+                progress(total)
+    if progress is not None:
+        progress(total)
+    return counts
+
+
+def read(f: IO[str]) -> Iterator[Entry]:
+    """Decode the entries of a backup file, skipping blank lines."""
+    for line in f:
+        if line.strip():
+            yield decode(line)
+
+
+def restore(dbf: DBFacade,
+            entries: Iterable[Entry],
+            progress: Optional[Progress] = None) -> Tuple[int, int]:
+    """
+    Store objects and apply deletions in chunks of ``CHUNK_SIZE``.
+
+    Objects are written with :meth:`db.facade.DBFacade.bulk_store`, which
+    batches and parallelizes writes, and retries throttled ones. They keep
+    the ``updated_at`` and ``version`` they were dumped with. Deletions are
+    applied in file order, after storing the objects read before them.
+
+    :param dbf: database to restore into
+    :param entries: objects and deletions, e.g. from :func:`read`
+    :param progress: called with the number of entries read so far, after
+                     every chunk
+    :return: the number of objects stored or deleted, and the number of
+             entries read
+    """
+    it = iter(entries)
+    stored = 0
+    total = 0
+    while True:
+        chunk = list(islice(it, CHUNK_SIZE))
+        if len(chunk) == 0:
+            return stored, total
+        total += len(chunk)
+        objs: List[Union[User, Team]] = []
+        deletions: List[Deletion] = []
+        for entry in chunk:
+            if isinstance(entry, Deletion):
+                stored += store_all(dbf, objs)
+                deletions.append(entry)
+            else:
+                stored += delete_all(dbf, deletions)
+                objs.append(entry)
+        stored += store_all(dbf, objs) + delete_all(dbf, deletions)
+        logging.info(f"Restored {stored}/{total} entries")
+        if progress is not None:
+            progress(total)
+
+
+def store_all(dbf: DBFacade, objs: List[Union[User, Team]]) -> int:
+    """Store objects as they were dumped, emptying ``objs``."""
+    if len(objs) == 0:
+        return 0
+    stored = dbf.bulk_store(objs, keep_stamps=True)  # type: ignore
+    objs.clear()
+    return stored
+
+
+def delete_all(dbf: DBFacade, deletions: List[Deletion]) -> int:
+    """Apply deletions, in bulk by model, emptying ``deletions``."""
+    for Model in dict.fromkeys(d.Model for d in deletions):
+        dbf.bulk_delete(Model, [d.key for d in deletions if d.Model is Model])
+    deleted = len(deletions)
+    deletions.clear()
+    return deleted
+
+
+def read_checkpoint(filename: str) -> int:
+    """
+    Return the time of the last dump, as written by
+    :func:`write_checkpoint`.
+
+    :param filename: name of the checkpoint file
+    :raises: FileNotFoundError if there is no checkpoint yet
+    :return: milliseconds since the epoch
+    """
+    with open(filename) as f:
+        return int(json.load(f)['updated_at'])
+
+
+def write_checkpoint(filename: str, updated_at: int):
+    """
+    Record the time a dump started, so that the next one can be a delta.
+
+    :param filename: name of the checkpoint file
+    :param updated_at: milliseconds since the epoch
+    """
+    with open(filename, 'w') as f:
+        json.dump({'updated_at': updated_at}, f)
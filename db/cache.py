@@ -0,0 +1,407 @@
+"""Read-through caching for any database facade."""
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from app.model import User, Team
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, \
+    List, Optional, Tuple, Type, TypeVar
+from db.facade import DBFacade, VersionConflict
+from db.membership import Membership
+from db.utils import get_projection, project_dict
+
+T = TypeVar('T', User, Team)
+
+# Kinds of cached queries, used to check if a write could change their results
+QUERY_AND = 'and'
+QUERY_OR = 'or'
+QUERY_IN = 'in'
+
+QueryKey = Tuple[str, FrozenSet[Tuple[str, str]], Optional[Tuple[str, ...]]]
+
+# Names of the primary keys of models, as returned by their ``to_dict``
+KEY_FIELDS = {
+    User: 'slack_id',
+    Team: 'github_team_id'
+}
+
+
+class LRUCache:
+    """
+    A thread-safe least-recently-used cache whose entries expire.
+
+    Entries are evicted once the cache holds more than ``maxsize`` entries, or
+    once they are older than ``ttl`` seconds.
+    """
+
+    def __init__(self,
+                 maxsize: int,
+                 ttl: float,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize an empty cache.
+
+        :param maxsize: maximum number of entries to keep
+        :param ttl: number of seconds entries stay valid for
+        :param clock: function returning the current time in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.__entries: 'OrderedDict[Any, Tuple[float, Any]]' = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: Any) -> Optional[Any]:
+        """
+        Return the value of an entry, or ``None`` if it is missing or expired.
+
+        :param key: key of the entry
+        :return: value of the entry if found
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None or entry[0] < self.clock():
+                if entry is not None:
+                    del self.__entries[key]
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Any, value: Any):
+        """
+        Add or replace an entry, evicting the least recently used if full.
+
+        :param key: key of the entry
+        :param value: value of the entry (must not be ``None``)
+        """
+        with self.__lock:
+            self.__entries[key] = (self.clock() + self.ttl, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def pop(self, key: Any):
+        """Remove an entry if it exists."""
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def pop_if(self, pred: Callable[[Any, Any], bool]):
+        """
+        Remove every entry for which ``pred(key, value)`` is true.
+
+        :param pred: predicate taking the key and value of an entry
+        """
+        with self.__lock:
+            for key in [k for k, (_, v) in self.__entries.items()
+                        if pred(k, v)]:
+                del self.__entries[key]
+
+    def clear(self):
+        """Remove every entry."""
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self) -> int:
+        """Return the number of entries, including expired ones."""
+        return len(self.__entries)
+
+
+def matches(d: Dict[str, Any], kind: str, params: Iterable[Tuple[str, str]]):
+    """
+    Check if an item would be in the results of a query.
+
+    :param d: the item, as returned by a model's ``to_dict``
+    :param kind: one of ``QUERY_AND``, ``QUERY_OR`` or ``QUERY_IN``
+    :param params: parameters of the query
+    :return: true if the item fits the parameters of the query
+    """
+    def match(param: Tuple[str, str]) -> bool:
+        field, v = param
+        if field not in d:
+            return False
+        elif isinstance(d[field], (set, frozenset, list)):
+            return v in d[field]
+        return str(d[field]) == v
+
+    params = list(params)
+    if kind == QUERY_AND:
+        return all(map(match, params))
+    elif kind == QUERY_OR and len(params) == 0:
+        # An OR query without parameters returns everything
+        return True
+    return any(map(match, params))
+
+
+class CachingDBFacade(DBFacade):
+    """
+    A database facade that caches reads from another facade.
+
+    Every model has its own caches: one for :meth:`retrieve` (also used by
+    :meth:`bulk_retrieve`) and one for query results, keyed by their
+    normalized parameters. Writes made through this facade invalidate the
+    entries they could have changed:
+
+    - the cached object with the same key, and
+    - every cached query whose results contain the object, or that the
+      object would now be part of.
+
+    Writes made elsewhere (e.g. by another process) are only picked up when
+    entries expire, so keep ``ttl`` short.
+
+    :meth:`iter_query` and :meth:`iter_query_or` are served from the cache
+    when the query has already been cached, but are otherwise passed through
+    without being cached, so that large tables can still be streamed.
+
+    Objects are cached as dictionaries, and callers always receive fresh
+    copies that they are free to modify.
+    """
+
+    def __init__(self, dbf: DBFacade, maxsize: int = 1024, ttl: float = 60):
+        """
+        Initialize the cache around another facade.
+
+        :param dbf: facade to read from and write to
+        :param maxsize: maximum number of entries in each cache
+        :param ttl: number of seconds entries stay valid for
+        """
+        logging.info(f"Caching database reads (size={maxsize}, ttl={ttl}s)")
+        self.dbf = dbf
+        self.objs = {
+            User: LRUCache(maxsize, ttl),
+            Team: LRUCache(maxsize, ttl)
+        }
+        self.queries = {
+            User: LRUCache(maxsize, ttl),
+            Team: LRUCache(maxsize, ttl)
+        }
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Return the number of cache hits and misses for every model.
+
+        :return: map of model names to their hit and miss counts
+        """
+        return {
+            Model.__name__: {
+                'hits': self.objs[Model].hits + self.queries[Model].hits,
+                'misses': self.objs[Model].misses + self.queries[Model].misses
+            }
+            for Model in [User, Team]
+        }
+
+    def __key(self, obj: T) -> str:
+        """Return the primary key of an object."""
+        return str(getattr(obj, KEY_FIELDS[obj.__class__]))
+
+    def __invalidate(self, Model: Type[T], k: str,
+                     d: Optional[Dict[str, Any]] = None,
+                     changed_field: Optional[str] = None):
+        """
+        Remove cache entries that a write to an object could have changed.
+
+        :param Model: type of the written object
+        :param k: key of the written object
+        :param d: the object as it was written, or ``None`` if it was deleted
+                  or only partially written
+        :param changed_field: the only attribute that was written, if the
+                              object was partially written
+        """
+        self.objs[Model].pop(k)
+        key_field = KEY_FIELDS[Model]
+
+        def affected(key: QueryKey, ds: List[Dict[str, Any]]) -> bool:
+            kind, params, _ = key
+            return any(x[key_field] == k for x in ds) or \
+                (d is not None and matches(d, kind, params)) or \
+                any(field == changed_field for field, _ in params)
+        self.queries[Model].pop_if(affected)
+
+    def __invalidate_all(self, Model: Type[T], ks: Iterable[str]):
+        """Remove cached objects ``ks`` and every cached query of ``Model``."""
+        for k in ks:
+            self.objs[Model].pop(k)
+        self.queries[Model].clear()
+
+    def __cached_query(self,
+                       Model: Type[T],
+                       key: QueryKey,
+                       query: Callable[[], List[T]]) -> List[T]:
+        """
+        Return the results of a query from the cache, or run and cache it.
+
+        :param Model: type of the query results
+        :param key: normalized kind and parameters of the query
+        :param query: function running the query on the wrapped facade
+        :return: results of the query
+        """
+        ds = self.queries[Model].get(key)
+        if ds is None:
+            ds = list(map(Model.to_dict, query()))
+            self.queries[Model].put(key, ds)
+        return list(map(Model.from_dict, ds))
+
+    def store(self, obj: T) -> bool:
+        Model = obj.__class__
+        try:
+            stored = self.dbf.store(obj)
+        except VersionConflict:
+            # The cached copy is probably stale too, so that retries read the
+            # object from the database
+            self.__invalidate(Model, self.__key(obj))
+            raise
+        if stored:
+            self.__invalidate(Model, self.__key(obj), Model.to_dict(obj))
+        return stored
+
+    def bulk_store(self, objs: Iterable[T], keep_stamps: bool = False) -> int:
+        written: Dict[Any, List[str]] = {User: [], Team: []}
+
+        def record(objs: Iterable[T]) -> Iterator[T]:
+            for obj in objs:
+                if obj.__class__ in written:
+                    written[obj.__class__].append(self.__key(obj))
+                yield obj
+
+        try:
+            return self.dbf.bulk_store(record(objs), keep_stamps)
+        finally:
+            for Model, ks in written.items():
+                if ks:
+                    self.__invalidate_all(Model, ks)
+
+    def retrieve(self,
+                 Model: Type[T],
+                 k: str,
+                 attributes: Optional[List[str]] = None) -> T:
+        d = self.objs[Model].get(k)
+        if d is None:
+            if attributes is not None:
+                # Partial objects are not cached, only full ones
+                return self.dbf.retrieve(Model, k, attributes)
+            obj = self.dbf.retrieve(Model, k)
+            d = Model.to_dict(obj)
+            self.objs[Model].put(k, d)
+        return Model.from_dict(project_dict(d, Model, attributes))
+
+    def bulk_retrieve(self, Model: Type[T], ks: List[str]) -> List[T]:
+        found: Dict[str, Dict[str, Any]] = {}
+        missing = []
+        for k in dict.fromkeys(ks):
+            d = self.objs[Model].get(k)
+            if d is None:
+                missing.append(k)
+            else:
+                found[k] = d
+
+        if missing:
+            for obj in self.dbf.bulk_retrieve(Model, missing):
+                d = Model.to_dict(obj)
+                found[self.__key(obj)] = d
+                self.objs[Model].put(self.__key(obj), d)
+        return [Model.from_dict(found[k]) for k in dict.fromkeys(ks)
+                if k in found]
+
+    def __query_key(self,
+                    Model: Type[T],
+                    kind: str,
+                    params: Iterable[Tuple[str, str]],
+                    attributes: Optional[List[str]]) -> QueryKey:
+        """Return the normalized key of a query in the cache."""
+        projection = get_projection(Model, attributes)
+        return (kind,
+                frozenset(params),
+                None if projection is None else tuple(sorted(projection)))
+
+    def query(self,
+              Model: Type[T],
+              params: List[Tuple[str, str]] = [],
+              attributes: Optional[List[str]] = None) -> List[T]:
+        return self.__cached_query(
+            Model,
+            self.__query_key(Model, QUERY_AND, params, attributes),
+            lambda: self.dbf.query(Model, params, attributes))
+
+    def query_or(self,
+                 Model: Type[T],
+                 params: List[Tuple[str, str]] = [],
+                 attributes: Optional[List[str]] = None) -> List[T]:
+        return self.__cached_query(
+            Model,
+            self.__query_key(Model, QUERY_OR, params, attributes),
+            lambda: self.dbf.query_or(Model, params, attributes))
+
+    def query_in(self,
+                 Model: Type[T],
+                 field: str,
+                 values: List[str]) -> List[T]:
+        params = [(field, v) for v in values]
+        return self.__cached_query(
+            Model,
+            self.__query_key(Model, QUERY_IN, params, None),
+            lambda: self.dbf.query_in(Model, field, values))
+
+    def iter_query(self,
+                   Model: Type[T],
+                   params: List[Tuple[str, str]] = [],
+                   page_size: Optional[int] = None,
+                   attributes: Optional[List[str]] = None) -> Iterator[T]:
+        key = self.__query_key(Model, QUERY_AND, params, attributes)
+        ds = self.queries[Model].get(key)
+        if ds is None:
+            return self.dbf.iter_query(Model, params, page_size, attributes)
+        return map(Model.from_dict, ds)
+
+    def iter_query_or(self,
+                      Model: Type[T],
+                      params: List[Tuple[str, str]] = [],
+                      page_size: Optional[int] = None,
+                      attributes: Optional[List[str]] = None) \
+            -> Iterator[T]:
+        key = self.__query_key(Model, QUERY_OR, params, attributes)
+        ds = self.queries[Model].get(key)
+        if ds is None:
+            return self.dbf.iter_query_or(Model, params, page_size,
+                                          attributes)
+        return map(Model.from_dict, ds)
+
+    def iter_changes(self, Model: Type[T], since: int) -> Iterator[T]:
+        return self.dbf.iter_changes(Model, since)
+
+    def increment(self,
+                  Model: Type[T],
+                  k: str,
+                  field: str,
+                  delta: int = 1) -> T:
+        obj = self.dbf.increment(Model, k, field, delta)
+        self.__invalidate(Model, k, Model.to_dict(obj))
+        return obj
+
+    def update_set(self,
+                   Model: Type[T],
+                   k: str,
+                   field: str,
+                   add: Iterable[str] = (),
+                   remove: Iterable[str] = ()):
+        self.dbf.update_set(Model, k, field, add, remove)
+        self.__invalidate(Model, k, changed_field=field)
+
+    def get_membership(self, github_id: str) -> Membership:
+        return self.dbf.get_membership(github_id)
+
+    def delete(self, Model: Type[T], k: str):
+        self.dbf.delete(Model, k)
+        self.__invalidate(Model, k)
+
+    def bulk_delete(self, Model: Type[T], ks: List[str]):
+        try:
+            self.dbf.bulk_delete(Model, ks)
+        finally:
+            self.__invalidate_all(Model, ks)
+
+    def iter_deletions(self, Model: Type[T], since: int) -> Iterator[str]:
+        return self.dbf.iter_deletions(Model, since)
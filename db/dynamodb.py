@@ -1,30 +1,104 @@
 import boto3
+import json
 import logging
+import math
+import queue
+import threading
+import time
 
-from boto3.dynamodb.conditions import Attr
-from functools import reduce, wraps
+from datetime import datetime, timedelta, timezone
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from itertools import islice
 from app.model import User, Team
-from typing import Tuple, List, Type, TypeVar
+from app.model.team import read_ids
+from typing import Any, Callable, Dict, Iterable, Iterator, Tuple, List, \
+    Optional, Set, Type, TypeVar, cast
 from config import Config
-from db.facade import DBFacade
+from db.facade import DBFacade, VersionConflict
+from db.membership import Membership, MembershipIndex
+from db.metrics import add_capacity, add_throttles, in_context, instrument
+from db.planner import QueryPlanner, Step, KEYS, INDEX
+from db.throttle import AdaptiveRateLimiter
+from db.utils import backoff_delay, get_projection, now_ms, project_dict, \
+    stamp, update_with_retry
 
 T = TypeVar('T', User, Team)
 
+# Error codes of requests rejected for going over the capacity of a table
+THROTTLE_CODES = {
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded'
+}
 
-def fragment(items_per_call=100):
-    def decor_fragment(func):
-        @wraps(func)
-        def wrapper_fragment(*args, **kwargs):
-            results = []
-            for i in range(0, len(args[2]), items_per_call):
-                results.extend(
-                    func(args[0],
-                         args[1],
-                         args[2][i: i + items_per_call])
-                )
-            return results
-        return wrapper_fragment
-    return decor_fragment
+
+def error_code(e: ClientError) -> str:
+    """Return the code of an error returned by DynamoDB."""
+    code: str = e.response.get('Error', {}).get('Code', '')
+    return code
+
+
+def request_capacity(params: Dict[str, Any], model: Any, **kwargs):
+    """Ask DynamoDB to return the capacity consumed by a request."""
+    if 'ReturnConsumedCapacity' in model.input_shape.members:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+
+def record_capacity(parsed: Dict[str, Any], **kwargs):
+    """Attribute the capacity consumed by a request to its facade call."""
+    consumed = parsed.get('ConsumedCapacity', [])
+    # Batch requests return the capacity consumed in every table
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    add_capacity(sum(c.get('CapacityUnits', 0) for c in consumed))
+
+
+def request_tables(request_dict: Dict[str, Any]) -> List[str]:
+    """Return the names of the tables used by a serialized request."""
+    try:
+        params = json.loads(request_dict.get('body') or '{}')
+    except ValueError:
+        return []
+    if 'TableName' in params:
+        return [params['TableName']]
+    return list(params.get('RequestItems', {}))
+
+
+def table_of(ddb: 'DynamoDB', x: Any = None, *args: Any, **kwargs: Any) \
+        -> str:
+    """Return the table used by a facade call, from its first argument."""
+    Model = x if isinstance(x, type) else x.__class__
+    if Model in [User, Team]:
+        return ddb.CONST.get_table_name(Model)
+    return ''
+
+
+def one_item(*args: Any, **kwargs: Any) -> int:
+    """Count a single item written by a facade call."""
+    return 1
+
+
+def updated_day(updated_at: int) -> str:
+    """Return the UTC day, as ``YYYY-MM-DD``, of an ``updated_at`` stamp."""
+    return datetime.fromtimestamp(updated_at / 1000, timezone.utc) \
+        .strftime('%Y-%m-%d')
+
+
+def pending_attrs(attr: str) -> Tuple[str, str]:
+    """
+    Return the attributes holding the IDs added to and removed from a packed
+    set attribute since it was last written.
+    """
+    return f'{attr}_added', f'{attr}_removed'
+
+
+def key_count(ddb: 'DynamoDB', Model: Type[T], ks: List[str]) -> int:
+    """Count the items written by a facade call on a list of keys."""
+    return len(ks)
 
 
 class DynamoDB(DBFacade):
@@ -36,6 +110,46 @@ class DynamoDB(DBFacade):
     facade class.
     """
 
+    # Maximum number of parameters to put in a single filter expression
+    MAX_FILTER_PARAMS = 100
+    # Maximum number of requests to have in flight at once for a single call
+    MAX_WORKERS = 8
+    # Maximum number of keys DynamoDB accepts in a single batch_get_item
+    MAX_BATCH_GET = 100
+    # Maximum number of items DynamoDB accepts in a single batch_write_item
+    MAX_BATCH_WRITE = 25
+    # Maximum number of times to retry unprocessed items of a batch request
+    MAX_BATCH_RETRIES = 10
+    # Seconds to wait before checking on an index that is still being built
+    INDEX_RECHECK_SECS = 60
+    # Table size to give each segment of a parallel scan when choosing the
+    # number of segments automatically (a single scan page is at most 1MB)
+    SCAN_SEGMENT_BYTES = 4 * 1024 * 1024
+    # Maximum number of segments to choose automatically
+    MAX_SCAN_SEGMENTS = 8
+    # Seconds to wait before checking on the size of a table again (DynamoDB
+    # itself only updates it about every six hours)
+    TABLE_SIZE_RECHECK_SECS = 60 * 60
+    # Seconds after which the team membership index is rebuilt, to pick up
+    # team writes made by other processes. Rebuilding only reads the members
+    # and leads of every team, so this is kept short.
+    MEMBERSHIP_INDEX_SECS = 60
+    # Maximum number of IDs added to or removed from the packed members or
+    # leads of a team before they are packed again
+    MAX_PENDING_IDS = 100
+    # Key of the item of the memberships table recording that the members
+    # and leads of every team were moved to it. Github IDs are numbers, so it
+    # can't be the key of a user in a team.
+    MIGRATED_KEY = {'team_id': 'migrated', 'github_id': 'migrated'}
+    # Values DB_BILLING_MODE can be set to
+    BILLING_MODES = ['PROVISIONED', 'PAY_PER_REQUEST']
+    # Maximum number of days to read from the updated_day index when looking
+    # for changes; changes over longer periods are found by scanning
+    MAX_CHANGE_DAYS = 90
+    # Days after which DynamoDB deletes recorded deletions, which is as far
+    # back as incremental dumps can go
+    DELETIONS_TTL_DAYS = 400
+
     class Const:
         """
         A bunch of static constants and functions.
@@ -48,6 +162,20 @@ class DynamoDB(DBFacade):
             """Initialize the constants."""
             self.users_table: str = config.aws_users_tablename
             self.teams_table: str = config.aws_teams_tablename
+            # Empty unless team members and leads have their own table
+            self.memberships_table: str = config.aws_memberships_tablename
+            # Empty unless deleted users and teams are recorded
+            self.deletions_table: str = config.aws_deletions_tablename
+
+        def is_memberships_table(self, table_name: str) -> bool:
+            """Return true if ``table_name`` is the memberships table."""
+            return bool(self.memberships_table) and \
+                table_name == self.memberships_table
+
+        def is_deletions_table(self, table_name: str) -> bool:
+            """Return true if ``table_name`` is the deletions table."""
+            return bool(self.deletions_table) and \
+                table_name == self.deletions_table
 
         def get_table_name(self, cls: Type[T]) -> str:
             """
@@ -76,6 +204,27 @@ class DynamoDB(DBFacade):
                 return 'slack_id'
             elif table_name == self.teams_table:
                 return 'github_team_id'
+            elif self.is_memberships_table(table_name):
+                return 'team_id'
+            elif self.is_deletions_table(table_name):
+                return 'model'
+            else:
+                raise TypeError('Table name does not correspond to anything')
+
+        def get_sort_key(self, table_name: str) -> Optional[str]:
+            """
+            Get sort key of the table name.
+
+            :param table_name: the name of the table
+            :raises: TypeError if table does not exist
+            :return: sort key of the table, or ``None`` if it has none
+            """
+            if table_name in [self.users_table, self.teams_table]:
+                return None
+            elif self.is_memberships_table(table_name):
+                return 'github_id'
+            elif self.is_deletions_table(table_name):
+                return 'key'
             else:
                 raise TypeError('Table name does not correspond to anything')
 
@@ -91,6 +240,47 @@ class DynamoDB(DBFacade):
                 return []
             elif table_name == self.teams_table:
                 return ['team_leads', 'members']
+            elif self.is_memberships_table(table_name) or \
+                    self.is_deletions_table(table_name):
+                return []
+            else:
+                raise TypeError('Table name does not correspond to anything')
+
+        def get_indexes(self, table_name: str) -> Dict[str, str]:
+            """
+            Get global secondary indexes of the table.
+
+            :param table_name: the table name
+            :raises: TypeError if table does not exist
+            :return: map of indexed attribute names to index names
+            """
+            if table_name == self.users_table:
+                return {'github_user_id': 'github_user_id-index',
+                        'updated_day': 'updated_day-index'}
+            elif table_name == self.teams_table:
+                return {'github_team_name': 'github_team_name-index',
+                        'updated_day': 'updated_day-index'}
+            elif self.is_memberships_table(table_name):
+                return {'github_id': 'github_id-index'}
+            elif self.is_deletions_table(table_name):
+                return {}
+            else:
+                raise TypeError('Table name does not correspond to anything')
+
+        def get_local_indexes(self, table_name: str) -> Dict[str, str]:
+            """
+            Get local secondary indexes of the table, whose sort keys are
+            numbers.
+
+            :param table_name: the table name
+            :raises: TypeError if table does not exist
+            :return: map of indexed attribute names to index names
+            """
+            if self.is_deletions_table(table_name):
+                return {'deleted_at': 'deleted_at-index'}
+            elif table_name in [self.users_table, self.teams_table] or \
+                    self.is_memberships_table(table_name):
+                return {}
             else:
                 raise TypeError('Table name does not correspond to anything')
 
@@ -111,34 +301,222 @@ class DynamoDB(DBFacade):
                 pass
 
         :param config: configuration used to initialize
+        :raises: ValueError if the billing mode is set to an unknown value
         """
         logging.info("Initializing DynamoDb")
+        if config.db_billing_mode and \
+                config.db_billing_mode not in self.BILLING_MODES:
+            raise ValueError(f"Unknown billing mode "
+                             f"'{config.db_billing_mode}', expected one of "
+                             f"{', '.join(self.BILLING_MODES)}")
+        self.config = config
         self.users_table = config.aws_users_tablename
         self.teams_table = config.aws_teams_tablename
+        self.memberships_table = config.aws_memberships_tablename
+        self.deletions_table = config.aws_deletions_tablename
+        # Whether the member and lead IDs of teams are stored packed
+        self.pack_members: bool = config.db_pack_members and \
+            not self.memberships_table
         self.CONST = DynamoDB.Const(config)
+        self.active_indexes: Set[str] = set()
+        self.described_at: Dict[str, float] = {}
+        self.tables: Dict[str, Dict[str, Any]] = {}
+        self.scan_segments: int = config.db_scan_segments
+        self.planner = QueryPlanner()
+        self.membership = MembershipIndex(self.MEMBERSHIP_INDEX_SECS)
+        self.limiter = AdaptiveRateLimiter()
+        self.table_sizes: Dict[str, int] = {}
+        self.__resource: Any = None
+        self.__client: Any = None
+        self.__local = threading.local()
+        self.__ready = False
+        self.__connect_lock = threading.RLock()
+
+    @property
+    def ddb(self) -> Any:
+        """
+        The boto3 DynamoDB resource of the current thread.
+
+        The connection is only made the first time this is used, at which
+        point missing tables and indexes are also created. Every thread
+        waits until that is done.
+
+        boto3 resources are not thread-safe, but clients are, so every
+        thread gets its own resource around a single shared client, and
+        all threads share the client's pool of connections.
+        """
+        if not self.__ready:
+            with self.__connect_lock:
+                # Table checks use this property too, and get the resource
+                # straight away since they run with the lock held
+                if self.__resource is None:
+                    self.__resource = self.__connect()
+                    self.__client = self.__resource.meta.client
+                    events = self.__client.meta.events
+                    events.register('before-parameter-build.dynamodb',
+                                    request_capacity)
+                    events.register('after-call.dynamodb', record_capacity)
+                    events.register('needs-retry.dynamodb',
+                                    self.record_throttle)
+                    try:
+                        self.__check_tables()
+                    except Exception:
+                        self.__resource = None
+                        self.__client = None
+                        raise
+                    self.__ready = True
+        if self.__client is None:
+            # The resource was replaced, and is used as is
+            return self.__resource
 
+        resource = getattr(self.__local, 'resource', None)
+        if resource is None:
+            resource = self.__resource.__class__(client=self.__client)
+            self.__local.resource = resource
+        return resource
+
+    @ddb.setter
+    def ddb(self, resource: Any):
+        """
+        Replace the boto3 DynamoDB resource, skipping table checks.
+
+        The resource is shared by every thread.
+        """
+        self.__resource = resource
+        self.__client = None
+        self.__ready = True
+
+    def record_throttle(self,
+                        response: Any,
+                        request_dict: Dict[str, Any],
+                        **kwargs: Any):
+        """
+        Report every throttled attempt at a request.
+
+        This is called by botocore after every attempt, before it decides
+        whether to retry, so that throttles are seen even when a retry
+        succeeds. Throttles slow down the bulk work on the table (see
+        :attr:`limiter`), and are counted in the metrics of the facade call.
+        """
+        if response is None or response[1].get('Error', {}).get('Code') \
+                not in THROTTLE_CODES:
+            return
+        add_throttles()
+        for table_name in request_tables(request_dict):
+            logging.debug(f"Request to {table_name} throttled")
+            self.limiter.throttled(table_name)
+
+    def __connect(self) -> Any:
+        """Create a boto3 DynamoDB resource from the configuration."""
+        config = self.config
+        # Clients are shared by every thread, so they need as many
+        # connections as there can be requests in flight
+        boto_config = BotoConfig(
+            max_pool_connections=config.db_max_connections,
+            retries={'max_attempts': config.db_max_retries,
+                     'mode': 'standard'})
+        # The default session isn't thread-safe, so use a new one
+        session = boto3.session.Session()
         if config.aws_local:
             logging.info("Connecting to local DynamoDb")
-            self.ddb = boto3.resource(service_name="dynamodb",
-                                      region_name="",
-                                      aws_access_key_id="",
-                                      aws_secret_access_key="",
-                                      endpoint_url="http://localhost:8000")
+            return session.resource(service_name="dynamodb",
+                                    region_name="",
+                                    aws_access_key_id="",
+                                    aws_secret_access_key="",
+                                    endpoint_url="http://localhost:8000",
+                                    config=boto_config)
         else:
             logging.info("Connecting to remote DynamoDb")
             region_name = config.aws_region
             access_key_id = config.aws_access_keyid
             secret_access_key = config.aws_secret_key
-            self.ddb = boto3.resource(service_name='dynamodb',
-                                      region_name=region_name,
-                                      aws_access_key_id=access_key_id,
-                                      aws_secret_access_key=secret_access_key)
+            return session.resource(service_name='dynamodb',
+                                    region_name=region_name,
+                                    aws_access_key_id=access_key_id,
+                                    aws_secret_access_key=secret_access_key,
+                                    config=boto_config)
+
+    def __check_tables(self):
+        """
+        Create missing tables, and indexes missing from existing tables.
+
+        If a billing mode is configured, existing tables are also switched
+        to it, unless an index is being added to them: DynamoDB only allows
+        one update of a table at a time.
+
+        Recorded deletions are set to expire (see ``DELETIONS_TTL_DAYS``).
+
+        Then, if the members and leads of teams are stored in the memberships
+        table, the ones still in team items are moved to it, unless that was
+        already done.
+        """
+        table_names = [self.users_table, self.teams_table]
+        if self.memberships_table:
+            table_names.append(self.memberships_table)
+        if self.deletions_table:
+            table_names.append(self.deletions_table)
+        for table_name in table_names:
+            if not self.check_valid_table(table_name):
+                self.__create_table(table_name)
+            elif not self.__create_missing_indexes(table_name):
+                self.__update_billing_mode(table_name)
+        if self.deletions_table:
+            self.__expire_deletions()
+        if self.memberships_table:
+            self.__migrate_memberships()
+
+    def __throughput(self) -> Dict[str, int]:
+        """Return the provisioned throughput of new tables and indexes."""
+        return {
+            'ReadCapacityUnits': self.config.db_read_capacity,
+            'WriteCapacityUnits': self.config.db_write_capacity
+        }
+
+    def __is_provisioned(self) -> bool:
+        """
+        Return true if new tables get provisioned capacity, which is also
+        DynamoDB's default when no billing mode is configured.
+        """
+        mode: str = self.config.db_billing_mode
+        return mode != 'PAY_PER_REQUEST'
+
+    def __update_billing_mode(self, table_name: str):
+        """
+        Switch an existing table to the configured billing mode, if any.
+
+        DynamoDB only allows switching once every 24 hours, so failures are
+        logged instead of raised.
 
-        # Check for missing tables
-        if not self.check_valid_table(self.users_table):
-            self.__create_table(self.users_table)
-        if not self.check_valid_table(self.teams_table):
-            self.__create_table(self.teams_table)
+        :param table_name: name of the table to update
+        """
+        if not self.config.db_billing_mode:
+            return
+        desc = self.tables[table_name]
+        mode = desc.get('BillingModeSummary', {}) \
+            .get('BillingMode', 'PROVISIONED')
+        wanted = 'PROVISIONED' if self.__is_provisioned() \
+            else 'PAY_PER_REQUEST'
+        if mode == wanted:
+            return
+
+        logging.info(f"Switching '{table_name}' to {wanted} billing")
+        update_args: Dict[str, Any] = {'BillingMode': wanted}
+        if wanted == 'PROVISIONED':
+            update_args['ProvisionedThroughput'] = self.__throughput()
+            indexes = desc.get('GlobalSecondaryIndexes', [])
+            if indexes:
+                update_args['GlobalSecondaryIndexUpdates'] = [
+                    {'Update': {'IndexName': index['IndexName'],
+                                'ProvisionedThroughput': self.__throughput()}}
+                    for index in indexes
+                ]
+        try:
+            resp = self.ddb.meta.client.update_table(TableName=table_name,
+                                                     **update_args)
+            self.__record_description(table_name, resp['TableDescription'])
+        except ClientError as e:
+            logging.error(f"Could not switch '{table_name}' to {wanted} "
+                          f"billing: {e}")
 
     def __create_table(self, table_name: str, key_type: str = 'S'):
         """
@@ -153,37 +531,205 @@ class DynamoDB(DBFacade):
         """
         logging.info(f"Creating table '{table_name}'")
         primary_key = self.CONST.get_key(table_name)
-        self.ddb.create_table(
-            TableName=table_name,
-            AttributeDefinitions=[
+        sort_key = self.CONST.get_sort_key(table_name)
+        indexes = self.CONST.get_indexes(table_name)
+        attr_defs = [
+            {
+                'AttributeName': primary_key,
+                'AttributeType': key_type
+            },
+        ]
+        key_schema = [
+            {
+                'AttributeName': primary_key,
+                'KeyType': 'HASH'
+            },
+        ]
+        if sort_key is not None:
+            attr_defs.append(self.__index_attr_def(sort_key))
+            key_schema.append({'AttributeName': sort_key, 'KeyType': 'RANGE'})
+        attr_defs.extend(self.__index_attr_def(attr) for attr in indexes
+                         if attr != sort_key)
+        local_indexes = self.CONST.get_local_indexes(table_name)
+        attr_defs.extend({'AttributeName': attr, 'AttributeType': 'N'}
+                         for attr in local_indexes)
+        extra_args: Dict[str, Any] = {}
+        if self.__is_provisioned():
+            extra_args['BillingMode'] = 'PROVISIONED'
+            extra_args['ProvisionedThroughput'] = self.__throughput()
+        else:
+            extra_args['BillingMode'] = 'PAY_PER_REQUEST'
+        if indexes:
+            extra_args['GlobalSecondaryIndexes'] = [
+                self.__index_def(attr, index_name)
+                for attr, index_name in indexes.items()
+            ]
+        if local_indexes:
+            # Local indexes can only be created along with their table
+            extra_args['LocalSecondaryIndexes'] = [
                 {
-                    'AttributeName': primary_key,
-                    'AttributeType': key_type
-                },
-            ],
-            KeySchema=[
+                    'IndexName': index_name,
+                    'KeySchema': [
+                        {'AttributeName': primary_key, 'KeyType': 'HASH'},
+                        {'AttributeName': attr, 'KeyType': 'RANGE'}
+                    ],
+                    'Projection': {'ProjectionType': 'KEYS_ONLY'}
+                }
+                for attr, index_name in local_indexes.items()
+            ]
+        resp = self.ddb.meta.client.create_table(
+            TableName=table_name,
+            AttributeDefinitions=attr_defs,
+            KeySchema=key_schema,
+            **extra_args
+        )
+        self.__record_description(table_name, resp['TableDescription'])
+
+    def __create_missing_indexes(self, table_name: str):
+        """
+        Create the global secondary indexes a table is missing.
+
+        This is the migration path for tables that were created before an
+        index was added to :meth:`Const.get_indexes`. DynamoDB backfills new
+        indexes in the background; until an index is active, queries on its
+        attribute fall back to scanning the table.
+
+        **Note**: This function should **not** be called externally, and should
+        only be called on initialization.
+
+        :param table_name: name of the table to check
+        :return: true if an index was created
+        """
+        existing = {index['IndexName'] for index in
+                    self.tables[table_name].get('GlobalSecondaryIndexes', [])}
+        created = False
+        for attr, index_name in self.CONST.get_indexes(table_name).items():
+            if index_name in existing:
+                continue
+            created = True
+            logging.info(f"Creating index '{index_name}' on '{table_name}'")
+            # DynamoDB only allows one index to be created per update
+            self.ddb.meta.client.update_table(
+                TableName=table_name,
+                AttributeDefinitions=[self.__index_attr_def(attr)],
+                GlobalSecondaryIndexUpdates=[
+                    {'Create': self.__index_def(attr, index_name)}
+                ]
+            )
+        return created
+
+    def __index_attr_def(self, attr: str) -> Dict[str, str]:
+        """Return the attribute definition of an indexed attribute."""
+        return {'AttributeName': attr, 'AttributeType': 'S'}
+
+    def __index_def(self, attr: str, index_name: str) -> Dict[str, Any]:
+        """Return the definition of a global secondary index on ``attr``."""
+        index_def: Dict[str, Any] = {
+            'IndexName': index_name,
+            'KeySchema': [
                 {
-                    'AttributeName': primary_key,
+                    'AttributeName': attr,
                     'KeyType': 'HASH'
                 },
             ],
-            ProvisionedThroughput={
-                'ReadCapacityUnits': 1,
-                'WriteCapacityUnits': 1
+            'Projection': {
+                'ProjectionType': 'ALL'
             }
-        )
+        }
+        if self.__is_provisioned():
+            index_def['ProvisionedThroughput'] = self.__throughput()
+        return index_def
+
+    def __describe_table(self, table_name: str) -> Optional[Dict[str, Any]]:
+        """
+        Describe a table, recording its size and which of its global
+        secondary indexes are active.
+
+        :param table_name: name of the table to describe
+        :return: the description of the table, or ``None`` if it does not
+                 exist
+        """
+        try:
+            resp = self.ddb.meta.client.describe_table(TableName=table_name)
+        except ClientError as e:
+            if error_code(e) == 'ResourceNotFoundException':
+                return None
+            raise
+        table: Dict[str, Any] = resp['Table']
+        self.__record_description(table_name, table)
+        return table
+
+    def __record_description(self, table_name: str, desc: Dict[str, Any]):
+        """Cache the description of a table (see :meth:`__describe_table`)."""
+        self.tables[table_name] = desc
+        self.table_sizes[table_name] = desc.get('TableSizeBytes', 0)
+        for index in desc.get('GlobalSecondaryIndexes', []):
+            if index.get('IndexStatus', 'ACTIVE') == 'ACTIVE':
+                self.active_indexes.add(index['IndexName'])
+        for index in desc.get('LocalSecondaryIndexes', []):
+            self.active_indexes.add(index['IndexName'])
+        self.described_at[table_name] = time.time()
+
+    def get_index_name(self, table_name: str, attr: str) -> Optional[str]:
+        """
+        Return the name of the usable index on ``attr``, if there is one.
+
+        Indexes that are still being built are not usable, nor are local
+        indexes missing from tables created before they were added. Their
+        status is checked again at most every ``INDEX_RECHECK_SECS`` seconds.
+
+        :param table_name: name of the table
+        :param attr: attribute to look for an index on
+        :return: name of the index, or ``None`` if it does not exist or isn't
+                 active yet
+        """
+        index_name = self.CONST.get_indexes(table_name).get(attr) or \
+            self.CONST.get_local_indexes(table_name).get(attr)
+        if index_name is None or index_name in self.active_indexes:
+            return index_name
+
+        last_checked = self.described_at.get(table_name, 0.0)
+        if time.time() - last_checked > self.INDEX_RECHECK_SECS:
+            self.__describe_table(table_name)
+        return index_name if index_name in self.active_indexes else None
+
+    def get_scan_segments(self, table_name: str) -> int:
+        """
+        Return the number of segments to split scans of a table into.
+
+        Uses ``config.db_scan_segments`` if it is set. Otherwise, a segment is
+        used for every ``SCAN_SEGMENT_BYTES`` of the table, up to
+        ``MAX_SCAN_SEGMENTS``. The size of the table is checked again at most
+        every ``TABLE_SIZE_RECHECK_SECS`` seconds.
+
+        :param table_name: name of the table to scan
+        :return: number of segments, 1 meaning a regular sequential scan
+        """
+        if self.scan_segments > 0:
+            return self.scan_segments
+
+        last_checked = self.described_at.get(table_name, 0.0)
+        if time.time() - last_checked > self.TABLE_SIZE_RECHECK_SECS:
+            self.__describe_table(table_name)
+        size = self.table_sizes.get(table_name, 0)
+        segments = math.ceil(size / self.SCAN_SEGMENT_BYTES)
+        return max(1, min(self.MAX_SCAN_SEGMENTS, segments))
 
     def check_valid_table(self, table_name: str) -> bool:
         """
         Check if table with ``table_name`` exists.
 
+        Tables are described at most once to find out, since tables are never
+        deleted while Rocket is running.
+
         :param table_name: table identifier
         :return: boolean value, true if table exists, false otherwise
         """
-        existing_tables = self.ddb.tables.all()
-        return any(map(lambda t: bool(t.name == table_name),
-                       existing_tables))
+        if table_name in self.tables:
+            return True
+        return self.__describe_table(table_name) is not None
 
+    @instrument(table_of)
     def store(self, obj: T) -> bool:
         Model = obj.__class__
         if Model not in [User, Team]:
@@ -194,89 +740,1150 @@ class DynamoDB(DBFacade):
         if Model.is_valid(obj):
             table_name = self.CONST.get_table_name(Model)
             table = self.ddb.Table(table_name)
-            d = Model.to_dict(obj)
+            version = obj.version
+            d = self.__to_dict(Model, stamp(obj))
+            # Objects read from the database are only stored if nobody else
+            # wrote them since, including ones read from items written
+            # before versions were recorded
+            cond: Dict[str, Any] = {}
+            if version > 0:
+                cond['ConditionExpression'] = Attr('version').eq(version)
+            elif obj.from_db:
+                cond['ConditionExpression'] = \
+                    Attr('version').not_exists() | Attr('version').eq(0)
 
             logging.info(f"Storing obj {obj} in table {table_name}")
-            table.put_item(Item=d)
+            try:
+                table.put_item(Item=self.__item_of(Model, d), **cond)
+            except ClientError as e:
+                obj.version = version
+                if error_code(e) != 'ConditionalCheckFailedException':
+                    raise
+                k = d[self.CONST.get_key(table_name)]
+                raise VersionConflict(f'{Model.__name__}(id={k}) was changed '
+                                      f'since version {version}')
+            if Model is Team:
+                if self.memberships_table:
+                    self.__store_roles([d])
+                self.membership.set_team(cast(Team, obj))
             return True
         return False
 
-    def retrieve(self, Model: Type[T], k: str) -> T:
+    @instrument(table_of)
+    def retrieve(self,
+                 Model: Type[T],
+                 k: str,
+                 attributes: Optional[List[str]] = None) -> T:
         table_name = self.CONST.get_table_name(Model)
         table = self.ddb.Table(table_name)
         resp = table.get_item(
             TableName=table_name,
             Key={
                 self.CONST.get_key(table_name): k
-            }
+            },
+            **self.__projection_args(Model, attributes)
         )
 
         if 'Item' in resp.keys():
-            return Model.from_dict(resp['Item'])
+            item, = self.__with_roles(Model, [resp['Item']], attributes)
+            return Model.from_dict(item)
         else:
             err_msg = f'{Model.__name__}(id={k}) not found'
             logging.info(err_msg)
             raise LookupError(err_msg)
 
+    @instrument(table_of)
     def bulk_retrieve(self, Model: Type[T], ks: List[str]) -> List[T]:
         table_name = self.CONST.get_table_name(Model)
-        resp = self.ddb.batch_get_item(
-            RequestItems={
-                table_name: {
-                    'Keys': [{self.CONST.get_key(table_name): k} for k in ks]
-                }
-            }
-        )
+        ks = list(dict.fromkeys(ks))
+        found = self.__get_items(table_name, ks)
+        items = [found[k] for k in ks if k in found]
+        return [Model.from_dict(item)
+                for item in self.__with_roles(Model, items, None)]
 
-        if 'Responses' not in resp:
-            return []
+    def __get_items(self,
+                    table_name: str,
+                    ks: List[str],
+                    **req_args) -> Dict[str, Dict[str, Any]]:
+        """
+        Get items by key, in batches spread across a thread pool.
+
+        :param table_name: name of the table to read from
+        :param ks: keys of the items to get, without duplicates
+        :param req_args: extra arguments for every batch, e.g. a projection
+        :return: map of the keys found to their items
+        """
+        key = self.CONST.get_key(table_name)
+        batches = [ks[i: i + self.MAX_BATCH_GET]
+                   for i in range(0, len(ks), self.MAX_BATCH_GET)]
+        if len(batches) == 0:
+            return {}
 
-        resp_models = resp['Responses'].get(table_name, [])
-        return list(map(Model.from_dict, resp_models))
+        def get_batch(batch: List[str]) -> List[Dict[str, Any]]:
+            return self.__batch_get(table_name, key, batch, **req_args)
 
+        found: Dict[str, Dict[str, Any]] = {}
+        workers = min(self.MAX_WORKERS, len(batches))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for items in executor.map(in_context(get_batch), batches):
+                found.update((item[key], item) for item in items)
+        return found
+
+    def __batch_get(self,
+                    table_name: str,
+                    key: str,
+                    ks: List[str],
+                    **req_args) -> List[Dict[str, Any]]:
+        """
+        Get a batch of items, retrying keys that DynamoDB did not process.
+
+        :param table_name: name of the table to read from
+        :param key: name of the table's primary key
+        :param ks: keys of the items to get (at most ``MAX_BATCH_GET``)
+        :param req_args: extra arguments for the batch, e.g. a projection
+        :return: the items that were found, in no particular order
+        """
+        request = {table_name: {'Keys': [{key: k} for k in ks], **req_args}}
+        return [item
+                for resp in self.__batch_request('batch_get_item', request)
+                for item in resp.get('Responses', {}).get(table_name, [])]
+
+    def __batch_write(self, writes: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Send write requests in batches, spread across a thread pool.
+
+        :param writes: map of table names to maps of item keys to
+                       ``PutRequest`` or ``DeleteRequest`` objects
+        :return: number of write requests sent
+        """
+        batches = []
+        for table_name, table_writes in writes.items():
+            reqs = list(table_writes.values())
+            for i in range(0, len(reqs), self.MAX_BATCH_WRITE):
+                batches.append({table_name: reqs[i: i + self.MAX_BATCH_WRITE]})
+        if len(batches) == 0:
+            return 0
+
+        def write_batch(request: Dict[str, Any]):
+            for _ in self.__batch_request('batch_write_item', request):
+                pass
+
+        workers = min(self.MAX_WORKERS, len(batches))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Consume the results so that exceptions are raised here
+            list(executor.map(in_context(write_batch), batches))
+        return sum(len(table_writes) for table_writes in writes.values())
+
+    def __batch_request(self,
+                        op: str,
+                        request: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Make a batch request, retrying whatever DynamoDB did not process.
+
+        DynamoDB returns part of a batch request as unprocessed when it is
+        throttled, or when the response gets too large. Those parts are
+        retried with backoff, and reported as throttles.
+
+        :param op: either ``'batch_get_item'`` or ``'batch_write_item'``
+        :param request: the ``RequestItems`` of the request
+        :raises: RuntimeError if parts of the request are still unprocessed
+                 after ``MAX_BATCH_RETRIES`` retries
+        :return: a generator of the responses to every attempt
+        """
+        if op == 'batch_get_item':
+            unprocessed_field = 'UnprocessedKeys'
+        else:
+            unprocessed_field = 'UnprocessedItems'
+
+        attempt = 0
+        while True:
+            def send() -> Dict[str, Any]:
+                sent: Dict[str, Any] = getattr(self.ddb, op)(
+                    RequestItems=request)
+                return sent
+
+            resp = self.__bulk_request(list(request), send)
+            yield resp
+            request = resp.get(unprocessed_field, {})
+            if not request:
+                return
+
+            add_throttles(len(request))
+            for table_name in request:
+                self.limiter.throttled(table_name)
+
+            attempt += 1
+            if attempt > self.MAX_BATCH_RETRIES:
+                msg = f'Could not finish {op} on tables {list(request)}'
+                logging.error(msg)
+                raise RuntimeError(msg)
+            time.sleep(backoff_delay(attempt))
+
+    def __bulk_request(self,
+                       table_names: List[str],
+                       request: Callable[[], Dict[str, Any]]) \
+            -> Dict[str, Any]:
+        """
+        Make a request that is part of bulk work on some tables.
+
+        The request waits for the rate limit of its tables. If botocore
+        gives up retrying it because it keeps getting throttled, it is
+        retried with backoff, so that bulk work slows down instead of
+        failing partway through.
+
+        :param table_names: names of the tables used by the request
+        :param request: function making the request
+        :raises: ClientError if the request is still throttled after
+                 ``MAX_BATCH_RETRIES`` retries
+        :return: the response to the request
+        """
+        attempt = 0
+        while True:
+            for table_name in table_names:
+                self.limiter.acquire(table_name)
+            try:
+                resp = request()
+            except ClientError as e:
+                attempt += 1
+                if error_code(e) not in THROTTLE_CODES or \
+                        attempt > self.MAX_BATCH_RETRIES:
+                    raise
+                logging.warning(f"Requests to {table_names} throttled, "
+                                f"retrying (attempt {attempt})")
+                time.sleep(backoff_delay(attempt))
+                continue
+            for table_name in table_names:
+                self.limiter.succeeded(table_name)
+            return resp
+
+    @instrument(table_of)
+    def bulk_store(self, objs: Iterable[T], keep_stamps: bool = False) -> int:
+        stored = 0
+        objs = iter(objs)
+        window_size = self.MAX_WORKERS * self.MAX_BATCH_WRITE
+        while True:
+            window = list(islice(objs, window_size))
+            if len(window) == 0:
+                return stored
+
+            # DynamoDB rejects batches that write the same key twice, so only
+            # the last write to any key is kept
+            writes: Dict[str, Dict[str, Any]] = {}
+            teams: List[Team] = []
+            team_dicts: List[Dict[str, Any]] = []
+            for obj in window:
+                Model = obj.__class__
+                if Model not in [User, Team]:
+                    logging.error(f"Cannot store object {str(obj)}")
+                    raise RuntimeError(f'Cannot store object{str(obj)}')
+                if not Model.is_valid(obj):
+                    continue
+
+                table_name = self.CONST.get_table_name(Model)
+                d = self.__to_dict(Model, obj if keep_stamps else stamp(obj))
+                k = d[self.CONST.get_key(table_name)]
+                writes.setdefault(table_name, {})[k] = \
+                    {'PutRequest': {'Item': self.__item_of(Model, d)}}
+                if Model is Team:
+                    teams.append(cast(Team, obj))
+                    team_dicts.append(d)
+
+            logging.info(f"Storing {len(window)} objs in bulk")
+            stored += self.__batch_write(writes)
+            if self.memberships_table:
+                self.__store_roles(team_dicts)
+            for team in teams:
+                self.membership.set_team(team)
+
+    @instrument(table_of)
     def query(self,
               Model: Type[T],
-              params: List[Tuple[str, str]] = []) -> List[T]:
+              params: List[Tuple[str, str]] = [],
+              attributes: Optional[List[str]] = None) -> List[T]:
+        return list(self.iter_query(Model, params, attributes=attributes))
 
+    @instrument(table_of)
+    def query_or(self,
+                 Model: Type[T],
+                 params: List[Tuple[str, str]] = [],
+                 attributes: Optional[List[str]] = None) -> List[T]:
+        return list(self.iter_query_or(Model, params, attributes=attributes))
+
+    @instrument(table_of)
+    def iter_query(self,
+                   Model: Type[T],
+                   params: List[Tuple[str, str]] = [],
+                   page_size: Optional[int] = None,
+                   attributes: Optional[List[str]] = None) -> Iterator[T]:
         table_name = self.CONST.get_table_name(Model)
-        table = self.ddb.Table(table_name)
+        cond = self.__param_cond(table_name)
         set_attrs = self.CONST.get_set_attrs(table_name)
-        if len(params) > 0:
-            def f(x):
-                if x[0] in set_attrs:
-                    return Attr(x[0]).contains(x[1])
-                else:
-                    return Attr(x[0]).eq(x[1])
+        items: Iterable[Dict[str, Any]]
 
-            filter_expr = reduce(lambda a, x: a & x, map(f, params))
-            resp = table.scan(FilterExpression=filter_expr)
+        if Model is Team and self.memberships_table and \
+                any(attr in set_attrs for attr, _ in params):
+            items = self.__teams_with_roles(params, attributes)
         else:
-            resp = table.scan()
+            # Prefer reading from an index over scanning the whole table
+            op = 'scan'
+            packed = Model is Team and self.pack_members and \
+                any(attr in set_attrs for attr, _ in params)
+            # Items are matched against packed IDs with every attribute
+            req_args = {} if packed else \
+                self.__projection_args(Model, attributes)
+            filter_params = params
+            for i, (attr, val) in enumerate(params):
+                index_name = self.get_index_name(table_name, attr)
+                if index_name is not None and attr not in set_attrs:
+                    op = 'query'
+                    req_args['IndexName'] = index_name
+                    req_args['KeyConditionExpression'] = Key(attr).eq(val)
+                    filter_params = params[:i] + params[i + 1:]
+                    break
 
-        return list(map(Model.from_dict, resp['Items']))
+            packed_params = []
+            if packed:
+                packed_params = [p for p in filter_params
+                                 if p[0] in set_attrs]
+                filter_params = [p for p in filter_params
+                                 if p[0] not in set_attrs]
+            if len(filter_params) > 0:
+                req_args['FilterExpression'] = \
+                    reduce(lambda a, x: a & x, map(cond, filter_params))
 
-    @fragment(100)
-    def query_or(self,
-                 Model: Type[T],
-                 params: List[Tuple[str, str]] = []) -> List[T]:
+            if op == 'scan':
+                items = self.__scan(table_name, page_size, **req_args)
+            else:
+                items = self.__paginate(op, table_name, page_size,
+                                        **req_args)
+            if packed_params:
+                items = self.__match_packed(items, packed_params, attributes,
+                                            match_all=True)
+        for item in self.__with_roles(Model, items, attributes,
+                                      every_team=len(params) == 0):
+            yield Model.from_dict(item)
 
+    @instrument(table_of)
+    def iter_query_or(self,
+                      Model: Type[T],
+                      params: List[Tuple[str, str]] = [],
+                      page_size: Optional[int] = None,
+                      attributes: Optional[List[str]] = None) \
+            -> Iterator[T]:
         table_name = self.CONST.get_table_name(Model)
-        table = self.ddb.Table(table_name)
+        if len(params) == 0:
+            yield from self.iter_query(Model, page_size=page_size,
+                                       attributes=attributes)
+            return
+
+        key = self.CONST.get_key(table_name)
         set_attrs = self.CONST.get_set_attrs(table_name)
-        if len(params) > 0:
-            def f(x):
-                if x[0] in set_attrs:
-                    return Attr(x[0]).contains(x[1])
-                else:
-                    return Attr(x[0]).eq(x[1])
+        proj_args = self.__projection_args(Model, attributes)
+        steps: List[Iterable[Dict[str, Any]]] = []
+        if Model is Team and self.memberships_table:
+            # Members and leads aren't in the items of teams, so the teams
+            # matching them are found in the memberships table
+            lookups = list(dict.fromkeys((v, attr) for attr, v in params
+                                         if attr in set_attrs))
+            team_ids: Set[str] = set()
+            for ids in self.__map(lambda x: self.__teams_of(*x),
+                                  lookups):
+                team_ids |= ids
+            params = [p for p in params if p[0] not in set_attrs]
+            if team_ids:
+                steps.append(self.__get_items(table_name, sorted(team_ids),
+                                              **proj_args).values())
+        elif Model is Team and self.pack_members:
+            packed_params = [p for p in params if p[0] in set_attrs]
+            params = [p for p in params if p[0] not in set_attrs]
+            if packed_params:
+                steps.append(self.__match_packed(
+                    self.__scan(table_name, page_size), packed_params,
+                    attributes, match_all=False))
+
+        indexes = {}
+        for attr, _ in params:
+            index_name = self.get_index_name(table_name, attr)
+            if index_name is not None and attr not in set_attrs:
+                indexes[attr] = index_name
+        if params:
+            plan = self.planner.plan_or(table_name, params, key, indexes)
+            steps.extend(self.__run_step(table_name, step, page_size,
+                                         **proj_args)
+                         for step in plan)
+
+        def found() -> Iterator[Dict[str, Any]]:
+            # Items can be found by more than one step, so skip keys we've
+            # seen
+            seen: Set[str] = set()
+            for step_items in steps:
+                for item in step_items:
+                    if len(steps) > 1:
+                        if item[key] in seen:
+                            continue
+                        seen.add(item[key])
+                    yield item
+
+        for item in self.__with_roles(Model, found(), attributes):
+            yield Model.from_dict(item)
+
+    def __run_step(self,
+                   table_name: str,
+                   step: Step,
+                   page_size: Optional[int] = None,
+                   **req_args) -> Iterator[Dict[str, Any]]:
+        """
+        Read the items matching any of the parameters of a query plan step.
+
+        :param table_name: name of the table to read from
+        :param step: the step to run
+        :param page_size: maximum number of items evaluated per scan or query
+                          request
+        :param req_args: extra arguments for every request, e.g. a projection
+        :return: a generator of raw items
+        """
+        values = [v for _, v in step.params]
+        if step.strategy == KEYS:
+            yield from self.__get_items(table_name, values,
+                                        **req_args).values()
+        elif step.strategy == INDEX:
+            field = step.params[0][0]
+
+            def query_one(v: str) -> List[Dict[str, Any]]:
+                return list(self.__paginate(
+                    'query', table_name, page_size,
+                    IndexName=step.index_name,
+                    KeyConditionExpression=Key(field).eq(v),
+                    **req_args))
+
+            workers = min(self.MAX_WORKERS, len(values))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for items in executor.map(in_context(query_one), values):
+                    yield from items
+        elif len(step.params) <= self.MAX_FILTER_PARAMS:
+            conds = map(self.__param_cond(table_name), step.params)
+            filter_expr = reduce(lambda a, x: a | x, conds)
+            yield from self.__scan(table_name, page_size,
+                                   FilterExpression=filter_expr, **req_args)
+        else:
+            # Too many parameters for a single filter expression, so the
+            # items are filtered as they arrive instead
+            match = self.__matches_any(table_name, step.params)
+            yield from filter(match, self.__scan(table_name, page_size,
+                                                 **req_args))
+
+    def __matches_any(self,
+                      table_name: str,
+                      params: List[Tuple[str, str]]) \
+            -> Callable[[Dict[str, Any]], bool]:
+        """
+        Return a function checking if an item matches any of ``params``.
+
+        :param table_name: name of the table the items are from
+        :param params: parameters to match items against
+        :return: function taking a raw item and returning whether it matches
+        """
+        set_attrs = self.CONST.get_set_attrs(table_name)
+        wanted: Dict[str, Set[str]] = {}
+        for attr, v in params:
+            wanted.setdefault(attr, set()).add(v)
+
+        def f(item: Dict[str, Any]) -> bool:
+            for attr, vs in wanted.items():
+                if attr not in item:
+                    continue
+                elif attr in set_attrs:
+                    if not vs.isdisjoint(read_ids(item[attr])):
+                        return True
+                elif str(item[attr]) in vs:
+                    return True
+            return False
+        return f
+
+    def __projection_args(self,
+                          Model: Type[T],
+                          attributes: Optional[List[str]]) -> Dict[str, Any]:
+        """
+        Return the request arguments to only read some attributes of items.
+
+        Attribute names are always passed through placeholders, so that they
+        can't collide with DynamoDB's reserved words (e.g. ``name``).
+
+        :param Model: type of the items to read
+        :param attributes: attributes to read, or ``None`` for all of them
+        :return: extra arguments for ``get_item``, ``scan`` or ``query``
+        """
+        projection = get_projection(Model, attributes)
+        if projection is None:
+            return {}
+        if Model is Team and not self.memberships_table:
+            set_attrs = self.CONST.get_set_attrs(self.teams_table)
+            projection += [a for attr in projection if attr in set_attrs
+                           for a in pending_attrs(attr)]
+        names = {f'#p{i}': attr for i, attr in enumerate(projection)}
+        return {
+            'ProjectionExpression': ', '.join(names.keys()),
+            'ExpressionAttributeNames': names
+        }
+
+    def __param_cond(self, table_name: str):
+        """
+        Return a function converting a query parameter into a condition.
+
+        Attributes that are sets are checked for membership, and everything
+        else is checked for equality.
+
+        :param table_name: name of the table the parameters are for
+        :return: function taking a parameter tuple and returning a condition
+        """
+        set_attrs = self.CONST.get_set_attrs(table_name)
+
+        def f(x):
+            if x[0] in set_attrs:
+                return Attr(x[0]).contains(x[1])
+            else:
+                return Attr(x[0]).eq(x[1])
+        return f
+
+    def __paginate(self,
+                   op: str,
+                   table_name: str,
+                   page_size: Optional[int] = None,
+                   **req_args) -> Iterator[Dict[str, Any]]:
+        """
+        Scan or query a table, following ``LastEvaluatedKey`` to the end.
+
+        Pages are only requested once the previous page has been consumed.
+
+        :param op: either ``'scan'`` or ``'query'``
+        :param table_name: name of the table to read from
+        :param page_size: maximum number of items evaluated per request
+        :param req_args: extra arguments passed to ``Table.scan`` or
+                         ``Table.query``
+        :return: a generator of raw items
+        """
+        for items in self.__pages(op, table_name, page_size, **req_args):
+            yield from items
+
+    def __pages(self,
+                op: str,
+                table_name: str,
+                page_size: Optional[int] = None,
+                **req_args) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Scan or query a table, yielding every page of items.
+
+        See :meth:`__paginate` for the parameters.
+        """
+        table = self.ddb.Table(table_name)
+        read = getattr(table, op)
+        if page_size is not None:
+            req_args['Limit'] = page_size
+        while True:
+            args = dict(req_args)
+            if 'ExpressionAttributeNames' in args:
+                # boto3 adds the placeholders of conditions to this in place
+                args['ExpressionAttributeNames'] = \
+                    dict(args['ExpressionAttributeNames'])
+
+            def read_page() -> Dict[str, Any]:
+                page: Dict[str, Any] = read(**args)
+                return page
+
+            resp = self.__bulk_request([table_name], read_page)
+            yield resp['Items']
+            if 'LastEvaluatedKey' not in resp:
+                return
+            req_args['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+    def __scan(self,
+               table_name: str,
+               page_size: Optional[int] = None,
+               **req_args) -> Iterator[Dict[str, Any]]:
+        """
+        Scan a whole table, in parallel segments if it is large enough.
+
+        Every segment is scanned by its own thread, and items are yielded as
+        their pages arrive, so their order is not deterministic. At most two
+        pages per segment are buffered; segments wait for the caller to catch
+        up beyond that. Closing the generator early stops the remaining
+        segments after their current request.
+
+        :param table_name: name of the table to scan
+        :param page_size: maximum number of items evaluated per request
+        :param req_args: extra arguments passed to ``Table.scan``
+        :return: a generator of raw items
+        """
+        segments = self.get_scan_segments(table_name)
+        if segments <= 1:
+            yield from self.__paginate('scan', table_name, page_size,
+                                       **req_args)
+            return
+
+        logging.debug(f"Scanning {table_name} in {segments} segments")
+        pages: queue.Queue = queue.Queue(maxsize=2 * segments)
+        stop = threading.Event()
+
+        def put(x: Any) -> bool:
+            while not stop.is_set():
+                try:
+                    pages.put(x, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def scan_segment(segment: int):
+            try:
+                for items in self.__pages('scan', table_name, page_size,
+                                          Segment=segment,
+                                          TotalSegments=segments,
+                                          **req_args):
+                    if not put(items):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(None)
+
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            for segment in range(segments):
+                executor.submit(in_context(scan_segment), segment)
+            try:
+                remaining = segments
+                while remaining > 0:
+                    page = pages.get()
+                    if page is None:
+                        remaining -= 1
+                    elif isinstance(page, Exception):
+                        raise page
+                    else:
+                        yield from page
+            finally:
+                stop.set()
+
+    @instrument(table_of)
+    def query_in(self,
+                 Model: Type[T],
+                 field: str,
+                 values: List[str]) -> List[T]:
+        if len(values) == 0:
+            return []
+        return self.query_or(Model, [(field, v) for v in values])
+
+    @instrument(table_of)
+    def increment(self,
+                  Model: Type[T],
+                  k: str,
+                  field: str,
+                  delta: int = 1) -> T:
+        resp = self.__update_item(Model, k,
+                                  UpdateExpression='ADD #field :delta',
+                                  ExpressionAttributeNames={'#field': field},
+                                  ExpressionAttributeValues={':delta': delta},
+                                  ReturnValues='ALL_NEW')
+        item, = self.__with_roles(Model, [resp['Attributes']], None)
+        return Model.from_dict(item)
+
+    @instrument(table_of, one_item)
+    def update_set(self,
+                   Model: Type[T],
+                   k: str,
+                   field: str,
+                   add: Iterable[str] = (),
+                   remove: Iterable[str] = ()):
+        add, remove = set(add), set(remove)
+        if Model is Team and self.memberships_table and \
+                field in self.CONST.get_set_attrs(self.teams_table):
+            self.__update_roles(k, field, add - remove, remove)
+        elif Model is Team and self.pack_members and \
+                field in self.CONST.get_set_attrs(self.teams_table):
+            self.__update_pending(k, field, add, remove)
+        else:
+            # DynamoDB doesn't allow two actions on the same attribute in a
+            # single update expression, so adding and removing takes two
+            # updates
+            for action, values in [('ADD', add), ('DELETE', remove)]:
+                if len(values) == 0:
+                    continue
+                self.__update_item(
+                    Model, k,
+                    UpdateExpression=f'{action} #field :values',
+                    ExpressionAttributeNames={'#field': field},
+                    ExpressionAttributeValues={':values': values})
+        if Model is Team:
+            self.membership.update_team(k, field, add, remove)
+
+    def __update_pending(self,
+                         team_id: str,
+                         field: str,
+                         add: Set[str],
+                         remove: Set[str]):
+        """
+        Add IDs to or remove IDs from the packed members or leads of a team.
+
+        DynamoDB can't add to or remove from packed IDs, so the changes are
+        kept in two string sets next to them (see :func:`pending_attrs`),
+        which reads fold in. Once they hold more than ``MAX_PENDING_IDS``
+        IDs, the team is stored again, which packs them.
+
+        :param team_id: Github ID of the team
+        :param field: either ``members`` or ``team_leads``
+        :param add: IDs to add
+        :param remove: IDs to remove, even if they are also in ``add``
+        """
+        added, removed = pending_attrs(field)
+        pending = 0
+        # Like with unpacked sets, adding and removing takes two updates
+        for ids, into, out_of in [(add - remove, added, removed),
+                                  (remove, removed, added)]:
+            if len(ids) == 0:
+                continue
+            resp = self.__update_item(
+                Team, team_id,
+                UpdateExpression='ADD #into :ids DELETE #out_of :ids',
+                ExpressionAttributeNames={'#into': into, '#out_of': out_of},
+                ExpressionAttributeValues={':ids': ids},
+                ReturnValues='ALL_NEW')
+            item = resp.get('Attributes', {})
+            pending = len(item.get(added, ())) + len(item.get(removed, ()))
+        if pending > self.MAX_PENDING_IDS:
+            def repack(team: Team):
+                pass
+
+            logging.info(f"Packing the {field} of Team(id={team_id})")
+            update_with_retry(self, Team, team_id, repack)
+
+    def __fold_pending(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Apply the IDs added to and removed from the packed members and leads
+        of a team item (see :meth:`__update_pending`) to them.
+
+        :param item: raw team item, changed in place
+        :return: ``item``, without the attributes of :func:`pending_attrs`
+        """
+        for attr in self.CONST.get_set_attrs(self.teams_table):
+            added, removed = (item.pop(a, None) for a in pending_attrs(attr))
+            if added or removed:
+                item[attr] = (read_ids(item.get(attr, ())) |
+                              set(added or ())) - set(removed or ())
+        return item
+
+    @instrument(table_of)
+    def get_membership(self, github_id: str) -> Membership:
+        if self.memberships_table:
+            return Membership(self.__teams_of(github_id, 'members'),
+                              self.__teams_of(github_id, 'team_leads'))
+
+        def read_teams() -> Iterable[Team]:
+            logging.info("Rebuilding team membership index")
+            return self.iter_query(Team, attributes=['members', 'team_leads'])
+
+        self.membership.refresh(read_teams)
+        return self.membership.get(github_id)
+
+    def __to_dict(self, Model: Type[T], obj: T) -> Dict[str, Any]:
+        """Convert an object to a dict, packing the member and lead IDs of
+        teams if configured to."""
+        if Model is Team:
+            return Team.to_dict(cast(Team, obj), packed=self.pack_members)
+        return Model.to_dict(obj)
+
+    def __match_packed(self,
+                       items: Iterable[Dict[str, Any]],
+                       params: List[Tuple[str, str]],
+                       attributes: Optional[List[str]],
+                       match_all: bool) -> Iterator[Dict[str, Any]]:
+        """
+        Keep the team items whose members or leads match parameters.
+
+        DynamoDB can't look inside packed IDs, so items are matched once
+        read. They must be read with every attribute, and are projected on
+        ``attributes`` afterwards.
+
+        :param items: raw team items, with every attribute
+        :param params: parameters on ``members`` or ``team_leads``
+        :param attributes: attributes requested by the caller, or ``None``
+                           for all of them
+        :param match_all: keep items matching all of ``params`` instead of
+                          any of them
+        :return: a generator of the matching items
+        """
+        check = all if match_all else any
+        for item in map(self.__fold_pending, items):
+            if check(v in read_ids(item.get(attr, ())) for attr, v in params):
+                yield project_dict(item, Team, attributes)
+
+    def __item_of(self, Model: Type[T], d: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Return the item to store for an object.
 
-            filter_expr = reduce(lambda a, x: a | x, map(f, params))
-            resp = table.scan(FilterExpression=filter_expr)
+        The day of ``updated_at`` is added as ``updated_day``, which
+        :meth:`iter_changes` reads from an index.
+
+        :param Model: type of the object
+        :param d: the object, as returned by ``Model.to_dict``
+        :return: ``d``, without the members and leads of teams if they are
+                 stored in the memberships table
+        """
+        item = {**d, 'updated_day': updated_day(d['updated_at'])}
+        if Model is not Team or not self.memberships_table:
+            return item
+        set_attrs = self.CONST.get_set_attrs(self.teams_table)
+        return {k: v for k, v in item.items() if k not in set_attrs}
+
+    def __roles_by_user(self, d: Dict[str, Any]) -> Dict[str, Set[str]]:
+        """
+        Return the roles of every user in a team.
+
+        :param d: the team, as returned by ``Team.to_dict``
+        :return: map of Github IDs to the attributes of the team they are in,
+                 ``members`` and/or ``team_leads``
+        """
+        roles: Dict[str, Set[str]] = {}
+        for role in self.CONST.get_set_attrs(self.teams_table):
+            for gh_id in read_ids(d.get(role, ())):
+                roles.setdefault(gh_id, set()).add(role)
+        return roles
+
+    def __team_roles(self, team_id: str) -> Dict[str, Set[str]]:
+        """
+        Read the roles of every user in a team from the memberships table.
+
+        :param team_id: Github ID of the team
+        :return: map of Github IDs to their roles (see
+                 :meth:`__roles_by_user`)
+        """
+        items = self.__paginate('query', self.memberships_table,
+                                KeyConditionExpression=Key('team_id')
+                                .eq(team_id),
+                                ConsistentRead=True)
+        return {item['github_id']: set(item['roles'])
+                for item in items if item.get('roles')}
+
+    def __teams_roles(self, team_ids: List[str]) -> List[Dict[str, Set[str]]]:
+        """Read the roles of every user in many teams, in parallel."""
+        return self.__map(self.__team_roles, team_ids)
+
+    def __map(self, f: Callable[[Any], Any], xs: List[Any]) -> List[Any]:
+        """Call ``f`` on every element of ``xs``, in parallel if there are
+        several."""
+        if len(xs) <= 1:
+            return [f(x) for x in xs]
+        workers = min(self.MAX_WORKERS, len(xs))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(in_context(f), xs))
+
+    def __teams_of(self, github_id: str, role: str) -> Set[str]:
+        """
+        Find the teams a user has a role in, in the memberships table.
+
+        :param github_id: Github ID of the user
+        :param role: either ``members`` or ``team_leads``
+        :return: Github IDs of the teams
+        """
+        index_name = self.get_index_name(self.memberships_table,
+                                         'github_id')
+        if index_name is None:
+            items = self.__scan(self.memberships_table,
+                                FilterExpression=Attr('github_id')
+                                .eq(github_id))
         else:
-            resp = table.scan()
+            items = self.__paginate('query', self.memberships_table,
+                                    IndexName=index_name,
+                                    KeyConditionExpression=Key('github_id')
+                                    .eq(github_id))
+        return {item['team_id'] for item in items
+                if role in item.get('roles', ())}
+
+    def __with_roles(self,
+                     Model: Type[T],
+                     items: Iterable[Dict[str, Any]],
+                     attributes: Optional[List[str]],
+                     every_team: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Add the members and leads of teams to their items, from the
+        memberships table.
+
+        Items of users are returned as they are. Without a memberships table,
+        team items only get their pending changes folded in (see
+        :meth:`__fold_pending`).
+
+        :param Model: type of the items
+        :param items: raw items
+        :param attributes: attributes requested by the caller, or ``None``
+                           for all of them
+        :param every_team: true if ``items`` are every team, in which case
+                           the memberships table is scanned once instead of
+                           queried for every team
+        :return: a generator of the items
+        """
+        wanted = [role for role in self.CONST.get_set_attrs(self.teams_table)
+                  if attributes is None or role in attributes]
+        if Model is Team and not self.memberships_table:
+            yield from map(self.__fold_pending, items)
+            return
+        if Model is not Team or not wanted:
+            yield from items
+            return
+
+        def set_roles(item: Dict[str, Any],
+                      roles: Dict[str, Set[str]]) -> Dict[str, Any]:
+            for role in wanted:
+                item[role] = {gh_id for gh_id, rs in roles.items()
+                              if role in rs}
+            return item
+
+        if every_team:
+            all_roles: Dict[str, Dict[str, Set[str]]] = {}
+            for m in self.__scan(self.memberships_table):
+                if m.get('roles'):
+                    all_roles.setdefault(m['team_id'], {})[m['github_id']] = \
+                        set(m['roles'])
+            for item in items:
+                yield set_roles(item, all_roles.get(item['github_team_id'],
+                                                    {}))
+            return
+
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, self.MAX_BATCH_GET))
+            if len(chunk) == 0:
+                return
+            found = self.__teams_roles([item['github_team_id']
+                                        for item in chunk])
+            for item, roles in zip(chunk, found):
+                yield set_roles(item, roles)
+
+    def __teams_with_roles(self,
+                           params: List[Tuple[str, str]],
+                           attributes: Optional[List[str]]) \
+            -> Iterator[Dict[str, Any]]:
+        """
+        Read the teams matching all of ``params``, some of which are on
+        members or leads, using the memberships table.
+
+        :param params: parameters to match teams against
+        :param attributes: attributes requested by the caller, or ``None``
+                           for all of them
+        :return: a generator of raw items, without members and leads
+        """
+        set_attrs = self.CONST.get_set_attrs(self.teams_table)
+        team_ids: Optional[Set[str]] = None
+        for attr, v in params:
+            if attr in set_attrs:
+                found = self.__teams_of(v, attr)
+                team_ids = found if team_ids is None else team_ids & found
+        others = [(attr, v) for attr, v in params if attr not in set_attrs]
+        items = self.__get_items(self.teams_table, sorted(team_ids or ()))
+        for item in items.values():
+            if all(attr in item and str(item[attr]) == v
+                   for attr, v in others):
+                yield project_dict(item, Team, attributes)
+
+    def __store_roles(self, teams: List[Dict[str, Any]]):
+        """
+        Replace the members and leads of teams in the memberships table.
+
+        Only the users whose roles changed are written.
+
+        :param teams: the teams, as returned by ``Team.to_dict``
+        """
+        olds = self.__teams_roles([d['github_team_id'] for d in teams])
+        writes: Dict[str, Dict[str, Any]] = {}
+        for d, old in zip(teams, olds):
+            team_id = d['github_team_id']
+            new = self.__roles_by_user(d)
+            for gh_id in old.keys() | new.keys():
+                roles = new.get(gh_id)
+                if roles == old.get(gh_id):
+                    continue
+                key = {'team_id': team_id, 'github_id': gh_id}
+                if roles:
+                    req = {'PutRequest': {'Item': {**key, 'roles': roles}}}
+                else:
+                    req = {'DeleteRequest': {'Key': key}}
+                writes[f'{team_id}/{gh_id}'] = req
+        self.__batch_write({self.memberships_table: writes})
+
+    def __delete_roles(self, team_ids: List[str]):
+        """Delete every user of teams from the memberships table."""
+        writes = {
+            f'{team_id}/{gh_id}': {
+                'DeleteRequest': {
+                    'Key': {'team_id': team_id, 'github_id': gh_id}
+                }
+            }
+            for team_id, roles in zip(team_ids, self.__teams_roles(team_ids))
+            for gh_id in roles
+        }
+        self.__batch_write({self.memberships_table: writes})
+
+    def __update_roles(self,
+                       team_id: str,
+                       role: str,
+                       add: Set[str],
+                       remove: Set[str]):
+        """
+        Add and remove a role of users in a team, in the memberships table.
+
+        Only the items of those users are written, along with the
+        ``updated_at`` and ``version`` of the team.
 
-        return list(map(Model.from_dict, resp['Items']))
+        :param team_id: Github ID of the team
+        :param role: either ``members`` or ``team_leads``
+        :param add: Github IDs of the users to give the role
+        :param remove: Github IDs of the users to take the role from
+        :raises: LookupError if the team does not exist
+        """
+        changes = [(gh_id, 'ADD') for gh_id in add] + \
+            [(gh_id, 'DELETE') for gh_id in remove]
+        if len(changes) == 0:
+            return
+        self.__update_item(Team, team_id, UpdateExpression='')
+        self.__map(lambda c: self.__update_role(team_id, role, *c), changes)
+
+    def __update_role(self,
+                      team_id: str,
+                      role: str,
+                      github_id: str,
+                      action: str):
+        """
+        Add or remove a role of a user in a team.
+
+        Users left without any role are deleted from the memberships table,
+        unless they were given a role again in the meantime.
+
+        :param action: either ``'ADD'`` or ``'DELETE'``
+        """
+        table = self.ddb.Table(self.memberships_table)
+        key = {'team_id': team_id, 'github_id': github_id}
+        resp = table.update_item(
+            Key=key,
+            UpdateExpression=f'{action} #roles :roles',
+            ExpressionAttributeNames={'#roles': 'roles'},
+            ExpressionAttributeValues={':roles': {role}},
+            ReturnValues='ALL_NEW')
+        if resp.get('Attributes', {}).get('roles'):
+            return
+        try:
+            table.delete_item(Key=key,
+                              ConditionExpression=Attr('roles').not_exists())
+        except ClientError as e:
+            if error_code(e) != 'ConditionalCheckFailedException':
+                raise
+
+    def __migrate_memberships(self):
+        """
+        Move the members and leads of existing teams to the memberships
+        table, unless its ``MIGRATED_KEY`` item records that it was done.
+
+        Every process checks that item on startup, and finishes the move
+        before reading teams if it is missing, so that the members and leads
+        of teams aren't read from the memberships table before they are all
+        in it. Moving them again is harmless, so processes that start at the
+        same time, or after one crashed halfway, all make sure they're moved.
+        The members and leads of a team are only removed from its item once
+        they were written to the memberships table.
+
+        **Note**: This function should **not** be called externally, and should
+        only be called on initialization. Other threads wait for it, so every
+        request is made from the current thread.
+        """
+        self.ddb.meta.client.get_waiter('table_exists') \
+            .wait(TableName=self.memberships_table)
+        memberships = self.ddb.Table(self.memberships_table)
+        if 'Item' in memberships.get_item(Key=self.MIGRATED_KEY,
+                                          ConsistentRead=True):
+            return
+
+        set_attrs = self.CONST.get_set_attrs(self.teams_table)
+        set_attrs += [a for attr in set_attrs for a in pending_attrs(attr)]
+        team_ids = []
+        with memberships.batch_writer() as batch:
+            for d in self.__paginate('scan', self.teams_table,
+                                     FilterExpression=reduce(
+                                         lambda a, x: a | x,
+                                         (Attr(a).exists()
+                                          for a in set_attrs))):
+                d = self.__fold_pending(d)
+                team_ids.append(d['github_team_id'])
+                for gh_id, roles in self.__roles_by_user(d).items():
+                    batch.put_item(Item={'team_id': d['github_team_id'],
+                                         'github_id': gh_id,
+                                         'roles': roles})
+
+        names = {f'#s{i}': a for i, a in enumerate(set_attrs)}
+        table = self.ddb.Table(self.teams_table)
+        for team_id in team_ids:
+            try:
+                table.update_item(Key={'github_team_id': team_id},
+                                  UpdateExpression='REMOVE ' +
+                                  ', '.join(names),
+                                  ExpressionAttributeNames=names,
+                                  ConditionExpression=Attr('github_team_id')
+                                  .exists())
+            except ClientError as e:
+                # Deleted since, in which case it must not be created again
+                if error_code(e) != 'ConditionalCheckFailedException':
+                    raise
+        memberships.put_item(Item={**self.MIGRATED_KEY,
+                                   'migrated_at': now_ms()})
+        logging.info(f"Moved the members and leads of {len(team_ids)} teams "
+                     f"to '{self.memberships_table}'")
+
+    def __update_item(self,
+                      Model: Type[T],
+                      k: str,
+                      **update_args) -> Dict[str, Any]:
+        """
+        Update an existing item, without creating it if it does not exist.
+
+        The ``updated_at``, ``updated_day`` and ``version`` attributes of the
+        item are set as well.
+
+        :param Model: type of the item to update
+        :param k: key of the item to update
+        :param update_args: extra arguments passed to ``Table.update_item``
+        :raises: LookupError if the item does not exist
+        :return: the response of ``update_item``
+        """
+        table_name = self.CONST.get_table_name(Model)
+        key = self.CONST.get_key(table_name)
+        table = self.ddb.Table(table_name)
+        updated_at = now_ms()
+        update_args['UpdateExpression'] = ' '.join([
+            update_args['UpdateExpression'],
+            'SET #updated_at = :updated_at, #updated_day = :updated_day, '
+            '#version = if_not_exists(#version, :zero) + :one'
+        ]).strip()
+        update_args['ExpressionAttributeNames'] = {
+            **update_args.get('ExpressionAttributeNames', {}),
+            '#updated_at': 'updated_at',
+            '#updated_day': 'updated_day',
+            '#version': 'version'
+        }
+        update_args['ExpressionAttributeValues'] = {
+            **update_args.get('ExpressionAttributeValues', {}),
+            ':updated_at': updated_at,
+            ':updated_day': updated_day(updated_at),
+            ':zero': 0,
+            ':one': 1
+        }
+        try:
+            resp: Dict[str, Any] = table.update_item(
+                Key={key: k},
+                ConditionExpression=Attr(key).exists(),
+                **update_args)
+            return resp
+        except ClientError as e:
+            if error_code(e) != 'ConditionalCheckFailedException':
+                raise
+            err_msg = f'{Model.__name__}(id={k}) not found'
+            logging.info(err_msg)
+            raise LookupError(err_msg)
 
+    @instrument(table_of, one_item)
     def delete(self, Model: Type[T], k: str):
         logging.info(f"Deleting {Model.__name__}(id={k})")
         table_name = self.CONST.get_table_name(Model)
@@ -286,3 +1893,111 @@ class DynamoDB(DBFacade):
                 self.CONST.get_key(table_name): k
             }
         )
+        self.__record_deletions(Model, [k])
+        if Model is Team:
+            if self.memberships_table:
+                self.__delete_roles([k])
+            self.membership.remove_team(k)
+
+    @instrument(table_of, key_count)
+    def bulk_delete(self, Model: Type[T], ks: List[str]):
+        logging.info(f"Deleting {len(ks)} {Model.__name__}s in bulk")
+        table_name = self.CONST.get_table_name(Model)
+        key = self.CONST.get_key(table_name)
+        self.__batch_write({
+            table_name: {
+                k: {'DeleteRequest': {'Key': {key: k}}} for k in ks
+            }
+        })
+        self.__record_deletions(Model, ks)
+        if Model is Team:
+            if self.memberships_table:
+                self.__delete_roles(ks)
+            for k in ks:
+                self.membership.remove_team(k)
+
+    def __record_deletions(self, Model: Type[T], ks: List[str]):
+        """
+        Record the deletion of objects in the deletions table, if there is one.
+
+        :param Model: type of the deleted objects
+        :param ks: keys of the deleted objects
+        """
+        if not self.deletions_table:
+            return
+        deleted_at = now_ms()
+        expires_at = deleted_at // 1000 + \
+            self.DELETIONS_TTL_DAYS * 24 * 60 * 60
+        self.__batch_write({
+            self.deletions_table: {
+                k: {'PutRequest': {'Item': {'model': Model.__name__,
+                                            'key': k,
+                                            'deleted_at': deleted_at,
+                                            'expires_at': expires_at}}}
+                for k in ks
+            }
+        })
+
+    def __expire_deletions(self):
+        """
+        Have DynamoDB delete recorded deletions once their ``expires_at`` is
+        past, if it doesn't already.
+
+        Failures are logged instead of raised, since deletions are still
+        recorded without expiring.
+        """
+        client = self.ddb.meta.client
+        client.get_waiter('table_exists').wait(TableName=self.deletions_table)
+        try:
+            desc = client.describe_time_to_live(
+                TableName=self.deletions_table)['TimeToLiveDescription']
+            if desc.get('TimeToLiveStatus') in ['ENABLED', 'ENABLING']:
+                return
+            logging.info(f"Expiring items of '{self.deletions_table}'")
+            client.update_time_to_live(
+                TableName=self.deletions_table,
+                TimeToLiveSpecification={'Enabled': True,
+                                         'AttributeName': 'expires_at'})
+        except ClientError as e:
+            logging.error(f"Could not expire items of "
+                          f"'{self.deletions_table}': {e}")
+
+    @instrument(table_of)
+    def iter_changes(self, Model: Type[T], since: int) -> Iterator[T]:
+        start = datetime.fromtimestamp(since / 1000, timezone.utc).date()
+        # Include tomorrow, in case the clock of another writer is ahead
+        end = datetime.now(timezone.utc).date() + timedelta(days=1)
+        days = (end - start).days + 1
+        index_name = self.get_index_name(self.CONST.get_table_name(Model),
+                                         'updated_day')
+        if days > self.MAX_CHANGE_DAYS or index_name is None:
+            # A single scan is cheaper than scanning once for every day
+            changed: Iterable[T] = self.iter_query(Model)
+        else:
+            changed = (obj for i in range(days) for obj in self.iter_query(
+                Model, [('updated_day', str(start + timedelta(days=i)))]))
+        for obj in changed:
+            if obj.updated_at >= since:
+                yield obj
+
+    @instrument(table_of)
+    def iter_deletions(self, Model: Type[T], since: int) -> Iterator[str]:
+        if not self.deletions_table:
+            raise RuntimeError('Deletions are not recorded: set '
+                               'AWS_DELETIONS_TABLE')
+        cond = Key('model').eq(Model.__name__)
+        index_name = self.get_index_name(self.deletions_table, 'deleted_at')
+        if index_name is None:
+            # Older deletions tables don't have the index, and every
+            # deletion ever recorded is read
+            items = self.__paginate('query', self.deletions_table,
+                                    KeyConditionExpression=cond,
+                                    FilterExpression=Attr('deleted_at')
+                                    .gte(since))
+        else:
+            items = self.__paginate('query', self.deletions_table,
+                                    IndexName=index_name,
+                                    KeyConditionExpression=cond &
+                                    Key('deleted_at').gte(since))
+        for item in items:
+            yield item['key']
@@ -1,11 +1,17 @@
 """Database Facade."""
 from app.model import User, Team
-from typing import List, Tuple, TypeVar, Type
+from db.membership import Membership
+from typing import Iterable, Iterator, List, Optional, Tuple, TypeVar, \
+    Type
 from abc import ABC, abstractmethod
 
 T = TypeVar('T', User, Team)
 
 
+class VersionConflict(RuntimeError):
+    """Raised when storing an object that was changed since it was read."""
+
+
 class DBFacade(ABC):
     """
     A database facade that gives an overall API for any databases.
@@ -24,18 +30,68 @@ class DBFacade(ABC):
         Object can be of type :class:`app.model.User` or
         :class:`app.model.Team`.
 
+        Every write increments the ``version`` attribute of the object. If
+        the object was read from the database (i.e. its ``version`` is not
+        0), it is only stored if nobody else wrote it in the meantime, so
+        that concurrent read-modify-write cycles don't lose updates. Use
+        :func:`db.utils.update_with_retry` to retry such cycles
+        automatically.
+
         :param obj: Object to store in database
+        :raises: VersionConflict if the object was written since it was read
         :return: True if object was stored, and false otherwise
         """
         raise NotImplementedError
 
     @abstractmethod
-    def retrieve(self, Model: Type[T], k: str) -> T:
+    def bulk_store(self, objs: Iterable[T], keep_stamps: bool = False) -> int:
+        """
+        Store a collection of objects into their correct tables.
+
+        Objects can be any mix of :class:`app.model.User` and
+        :class:`app.model.Team`. Invalid objects are skipped. Should be at
+        least as fast as multiple calls to ``.store``. Objects are consumed
+        lazily, so a generator can be passed in to store large amounts of
+        objects without holding all of them in memory.::
+
+            ddb.bulk_store(ddb.iter_query(User))
+
+        Objects are not necessarily stored in order, so if the same object
+        appears more than once, any of its versions may end up stored.
+        Unlike ``.store``, versions are not checked, so objects are always
+        overwritten: concurrent bulk writes are last-writer-wins.
+
+        Restores pass ``keep_stamps`` to store objects exactly as they were
+        backed up, instead of stamping them with a new ``updated_at`` and
+        ``version``.
+
+        :param objs: objects to store in database
+        :param keep_stamps: whether to keep the ``updated_at`` and ``version``
+                            of the objects
+        :return: number of objects stored
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def retrieve(self,
+                 Model: Type[T],
+                 k: str,
+                 attributes: Optional[List[str]] = None) -> T:
         """
         Retrieve a model from the database.
 
+        If ``attributes`` is given, only those attributes are read from the
+        database, and a partial model is returned with every other attribute
+        left at its default value. The attributes needed to build the model
+        (e.g. its key) are always read. Partial models must not be stored
+        back, as they would overwrite the attributes that were left out.::
+
+            user = ddb.retrieve(User, 'U12345', attributes=['email'])
+
         :param Model: the actual class you want to retrieve
         :param k: retrieve based on this key (or ID)
+        :param attributes: database attributes to read, or ``None`` for all of
+                           them
         :raises: LookupError if key is not found
         :return: a model ``Model`` if key is found
         """
@@ -46,8 +102,9 @@ class DBFacade(ABC):
         """
         Retrieve a list of models from the database.
 
-        Keys not found in the database will be skipped. Should be at least as
-        fast as multiple calls to ``.retrieve``.
+        Keys not found in the database will be skipped, and the models found
+        are returned in the same order as their keys in ``ks``. Should be at
+        least as fast as multiple calls to ``.retrieve``.
 
         :param Model: the actual class you want to retrieve
         :param ks: retrieve based on this key (or ID)
@@ -58,7 +115,8 @@ class DBFacade(ABC):
     @abstractmethod
     def query(self,
               Model: Type[T],
-              params: List[Tuple[str, str]] = []) -> List[T]:
+              params: List[Tuple[str, str]] = [],
+              attributes: Optional[List[str]] = None) -> List[T]:
         """
         Query a table using a list of parameters.
 
@@ -84,16 +142,51 @@ class DBFacade(ABC):
             teams = ddb.query(Team, [('members', 'abc123'),
                                      ('members', '231abc')])
 
+        Like with :meth:`retrieve`, ``attributes`` can be used to only read
+        some of the attributes of every result, returning partial models.::
+
+            users = ddb.query(User, attributes=['slack_id', 'email'])
+
         :param Model: type of list elements you'd want
         :param params: list of tuples to match
+        :param attributes: database attributes to read, or ``None`` for all of
+                           them
         :return: a list of ``Model`` that fit the query parameters
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def iter_query(self,
+                   Model: Type[T],
+                   params: List[Tuple[str, str]] = [],
+                   page_size: Optional[int] = None,
+                   attributes: Optional[List[str]] = None) -> Iterator[T]:
+        """
+        Lazily query a table using a list of parameters.
+
+        Behaves exactly like :meth:`query`, but returns a generator that
+        fetches results from the database one page at a time, as they are
+        consumed. Use this when walking through large tables so that only a
+        single page of results is ever held in memory.::
+
+            for user in ddb.iter_query(User, page_size=100):
+                print(user.slack_id)
+
+        :param Model: type of list elements you'd want
+        :param params: list of tuples to match
+        :param page_size: maximum number of items to evaluate per request to
+                          the database; ``None`` lets the database decide
+        :param attributes: database attributes to read, or ``None`` for all of
+                           them
+        :return: a generator of ``Model`` that fit the query parameters
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def query_or(self,
                  Model: Type[T],
-                 params: List[Tuple[str, str]] = []) -> List[T]:
+                 params: List[Tuple[str, str]] = [],
+                 attributes: Optional[List[str]] = None) -> List[T]:
         """
         Query a table using a list of parameters.
 
@@ -125,10 +218,155 @@ class DBFacade(ABC):
 
         :param Model: type of list elements you'd want
         :param params: list of tuples to match
+        :param attributes: database attributes to read (see :meth:`query`), or
+                           ``None`` for all of them
         :return: a list of ``Model`` that fit the query parameters
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def iter_query_or(self,
+                      Model: Type[T],
+                      params: List[Tuple[str, str]] = [],
+                      page_size: Optional[int] = None,
+                      attributes: Optional[List[str]] = None) \
+            -> Iterator[T]:
+        """
+        Lazily query a table using a list of parameters.
+
+        Behaves exactly like :meth:`query_or`, but returns a generator that
+        fetches results from the database one page at a time, as they are
+        consumed.
+
+        :param Model: type of list elements you'd want
+        :param params: list of tuples to match
+        :param page_size: maximum number of items to evaluate per request to
+                          the database; ``None`` lets the database decide
+        :param attributes: database attributes to read, or ``None`` for all of
+                           them
+        :return: a generator of ``Model`` that fit the query parameters
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_changes(self, Model: Type[T], since: int) -> Iterator[T]:
+        """
+        Lazily find the objects stored since a given time.
+
+        Incremental backups use this, so it should only read about as many
+        objects as it returns, instead of going through the whole table.::
+
+            for user in ddb.iter_changes(User, read_checkpoint(filename)):
+                print(user.slack_id)
+
+        :param Model: type of the objects to find
+        :param since: milliseconds since the epoch (see
+                      :func:`db.utils.now_ms`)
+        :return: a generator of the objects whose ``updated_at`` is at or
+                 after ``since``
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def query_in(self,
+                 Model: Type[T],
+                 field: str,
+                 values: List[str]) -> List[T]:
+        """
+        Query a table for models whose ``field`` is one of ``values``.
+
+        This is equivalent to calling :meth:`query_or` with a parameter for
+        every value, but databases are free to answer it more efficiently,
+        e.g. by looking up every value in an index instead of scanning.::
+
+            users = ddb.query_in(User, 'github_user_id', ['1234', '5678'])
+
+        Unlike :meth:`query_or`, an empty list of values matches nothing.
+
+        :param Model: type of list elements you'd want
+        :param field: attribute to match (must not be a set attribute)
+        :param values: values the attribute can take
+        :return: a list of ``Model`` whose ``field`` is one of ``values``
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def increment(self,
+                  Model: Type[T],
+                  k: str,
+                  field: str,
+                  delta: int = 1) -> T:
+        """
+        Atomically add ``delta`` to a numeric attribute of an object.
+
+        The object does not need to be retrieved first, and concurrent
+        increments of the same attribute are never lost. A missing attribute
+        is treated as ``0``. The ``version`` of the object is incremented
+        too, like with ``.store``.::
+
+            user = ddb.increment(User, 'U12345', 'karma', 1)
+            print(user.karma)
+
+        :param Model: type of the object to update
+        :param k: ID or key of the object to update
+        :param field: name of the attribute to update, as stored in the
+                      database (e.g. ``karma``)
+        :param delta: amount to add, which can be negative
+        :raises: LookupError if the object does not exist
+        :return: the object, with the new value of the attribute
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_set(self,
+                   Model: Type[T],
+                   k: str,
+                   field: str,
+                   add: Iterable[str] = (),
+                   remove: Iterable[str] = ()):
+        """
+        Add elements to and remove elements from a set attribute of an object.
+
+        Only the changed elements are sent to the database, so this costs
+        the same no matter how large the set is, and concurrent changes to
+        other elements of the set are never lost. Elements to add that are
+        already in the set, and elements to remove that aren't, are ignored.
+        The ``version`` of the object is incremented too, like with
+        ``.store``.::
+
+            ddb.update_set(Team, '12345', 'members', add=['abc123'])
+            ddb.update_set(Team, '12345', 'team_leads', remove=['abc123'])
+
+        :param Model: type of the object to update
+        :param k: ID or key of the object to update
+        :param field: name of the set attribute to update, as stored in the
+                      database (e.g. ``members``)
+        :param add: elements to add to the set
+        :param remove: elements to remove from the set
+        :raises: LookupError if the object does not exist
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_membership(self, github_id: str) -> Membership:
+        """
+        Find the teams a Github user is a member of or leads.
+
+        This is answered from an index mapping users to their teams, instead
+        of looking through every team. The index may lag behind writes made
+        by other processes (e.g. other gunicorn workers) by up to a minute,
+        so anything deciding permissions should check the teams it reads
+        (e.g. with :meth:`app.model.Team.has_member`) instead of relying on
+        the index alone.::
+
+            membership = ddb.get_membership('abc123')
+            teams = ddb.bulk_retrieve(Team, list(membership.member_of))
+
+        :param github_id: Github ID of the user
+        :return: the Github IDs of the teams the user is part of
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def delete(self, Model: Type[T], k: str):
         """
@@ -138,3 +376,33 @@ class DBFacade(ABC):
         :param k: ID or key of the object to remove (must be primary key)
         """
         raise NotImplementedError
+
+    @abstractmethod
+    def bulk_delete(self, Model: Type[T], ks: List[str]):
+        """
+        Remove a list of objects from a table.
+
+        Keys not found in the database are ignored. Should be at least as fast
+        as multiple calls to ``.delete``.
+
+        :param Model: table type to remove the objects from
+        :param ks: IDs or keys of the objects to remove (must be primary keys)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_deletions(self, Model: Type[T], since: int) -> Iterator[str]:
+        """
+        Lazily find the objects deleted since a given time.
+
+        Every deletion is recorded with its time, so that incremental backups
+        can delete the objects again when they are restored.
+
+        :param Model: type of the deleted objects
+        :param since: milliseconds since the epoch (see
+                      :func:`db.utils.now_ms`)
+        :raises: RuntimeError if deletions are not being recorded
+        :return: a generator of the IDs or keys of the objects deleted at or
+                 after ``since``
+        """
+        raise NotImplementedError
@@ -0,0 +1,222 @@
+"""Reverse index from Github users to the teams they are part of."""
+import threading
+import time
+
+from app.model import Team
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, \
+    Set, Tuple
+
+
+class Membership(NamedTuple):
+    """
+    The teams a Github user is part of.
+
+    :param member_of: Github IDs of the teams the user is a member of
+    :param lead_of: Github IDs of the teams the user leads
+    """
+
+    member_of: Set[str]
+    lead_of: Set[str]
+
+
+class MembershipIndex:
+    """
+    A thread-safe map of Github user IDs to the teams they are part of.
+
+    The index is built from every team at once with :meth:`rebuild`, and is
+    then kept up to date by reporting every write to a team. Writes reported
+    while a rebuild reads the teams are replayed on top of the rebuilt index,
+    so they aren't lost if the teams were read before them. Writes made by
+    other processes can't be reported, so the index is considered stale
+    ``ttl`` seconds after it was last built, and should be rebuilt then,
+    with :meth:`refresh`.
+    """
+
+    def __init__(self,
+                 ttl: float = 60,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize an empty index that needs to be built.
+
+        :param ttl: number of seconds the index stays fresh after being built
+        :param clock: function returning the current time in seconds
+        """
+        self.ttl = ttl
+        self.clock = clock
+        self.built_at: Optional[float] = None
+        self.__members: Dict[str, Set[str]] = {}
+        self.__leads: Dict[str, Set[str]] = {}
+        self.__teams: Dict[str, Tuple[Set[str], Set[str]]] = {}
+        self.__lock = threading.Lock()
+        # Writes reported since the oldest rebuild in progress started, as
+        # functions applying them again
+        self.__journal: List[Callable[[], None]] = []
+        self.__rebuilds = 0
+        # Held by the thread rebuilding a stale index in refresh
+        self.__refresh_lock = threading.Lock()
+
+    def is_stale(self) -> bool:
+        """Return true if the index was never built, or was built too long
+        ago."""
+        return self.built_at is None or \
+            self.clock() - self.built_at > self.ttl
+
+    def refresh(self, read_teams: Callable[[], Iterable[Team]]):
+        """
+        Rebuild the index if it is stale, from a single thread at a time.
+
+        Rebuilding reads every team, so while a thread does, other threads
+        keep using the stale index instead of reading every team as well.
+        Only if the index was never built do they wait for the rebuild.
+
+        :param read_teams: function returning every team, with at least
+                           their members and leads
+        """
+        if not self.is_stale():
+            return
+        if not self.__refresh_lock.acquire(blocking=self.built_at is None):
+            return
+        try:
+            # Another thread may have rebuilt it while this one waited
+            if self.is_stale():
+                self.rebuild(read_teams())
+        finally:
+            self.__refresh_lock.release()
+
+    def rebuild(self, teams: Iterable[Team]):
+        """
+        Replace the contents of the index.
+
+        :param teams: every team, with at least their members and leads
+        """
+        with self.__lock:
+            self.__rebuilds += 1
+            start = len(self.__journal)
+        try:
+            self.__rebuild(teams, start)
+        finally:
+            with self.__lock:
+                self.__rebuilds -= 1
+                if self.__rebuilds == 0:
+                    self.__journal = []
+
+    def __rebuild(self, teams: Iterable[Team], start: int):
+        """Build a new index and swap it in, replaying the writes reported
+        from ``start`` in the journal."""
+        members: Dict[str, Set[str]] = {}
+        leads: Dict[str, Set[str]] = {}
+        all_teams: Dict[str, Tuple[Set[str], Set[str]]] = {}
+        for team in teams:
+            t_id = team.github_team_id
+            all_teams[t_id] = (set(team.members), set(team.team_leads))
+            for gh_id in team.members:
+                members.setdefault(gh_id, set()).add(t_id)
+            for gh_id in team.team_leads:
+                leads.setdefault(gh_id, set()).add(t_id)
+
+        with self.__lock:
+            self.__members = members
+            self.__leads = leads
+            self.__teams = all_teams
+            self.built_at = self.clock()
+            for replay in self.__journal[start:]:
+                replay()
+
+    def get(self, github_id: str) -> Membership:
+        """
+        Look up the teams a Github user is part of.
+
+        :param github_id: Github ID of the user
+        :return: copies of the sets of teams the user is part of
+        """
+        with self.__lock:
+            return Membership(set(self.__members.get(github_id, ())),
+                              set(self.__leads.get(github_id, ())))
+
+    def set_team(self, team: Team):
+        """Record that a team was stored, replacing its members and leads."""
+        t_id = team.github_team_id
+        members, leads = set(team.members), set(team.team_leads)
+        with self.__lock:
+            self.__record(lambda: self.__set_team(t_id, members, leads))
+            self.__set_team(t_id, members, leads)
+
+    def __set_team(self, team_id: str, members: Set[str], leads: Set[str]):
+        """Replace the members and leads of a team; needs the lock."""
+        old_members, old_leads = self.__teams.get(team_id, (set(), set()))
+        self.__update(team_id, self.__members,
+                      members - old_members, old_members - members)
+        self.__update(team_id, self.__leads,
+                      leads - old_leads, old_leads - leads)
+        self.__teams[team_id] = (set(members), set(leads))
+
+    def remove_team(self, team_id: str):
+        """Record that a team was deleted."""
+        with self.__lock:
+            self.__record(lambda: self.__remove_team(team_id))
+            self.__remove_team(team_id)
+
+    def __remove_team(self, team_id: str):
+        """Remove a team; needs the lock."""
+        members, leads = self.__teams.pop(team_id, (set(), set()))
+        self.__update(team_id, self.__members, (), members)
+        self.__update(team_id, self.__leads, (), leads)
+
+    def update_team(self,
+                    team_id: str,
+                    field: str,
+                    add: Iterable[str] = (),
+                    remove: Iterable[str] = ()):
+        """
+        Record that members or leads were added to or removed from a team.
+
+        :param team_id: Github ID of the team
+        :param field: either ``members`` or ``team_leads``
+        :param add: Github IDs of the users added
+        :param remove: Github IDs of the users removed
+        """
+        added, removed = set(add), set(remove)
+        with self.__lock:
+            self.__record(
+                lambda: self.__update_team(team_id, field, added, removed))
+            self.__update_team(team_id, field, added, removed)
+
+    def __update_team(self,
+                      team_id: str,
+                      field: str,
+                      add: Set[str],
+                      remove: Set[str]):
+        """Add and remove members or leads of a team; needs the lock."""
+        if team_id not in self.__teams:
+            # The update would have failed if the team didn't exist, so the
+            # index is missing a team that was stored elsewhere
+            self.built_at = None
+            return
+        members, leads = self.__teams[team_id]
+        if field == 'members':
+            self.__update(team_id, self.__members, add, remove)
+            members |= add
+            members -= remove
+        elif field == 'team_leads':
+            self.__update(team_id, self.__leads, add, remove)
+            leads |= add
+            leads -= remove
+
+    def __record(self, replay: Callable[[], None]):
+        """Journal a write if a rebuild is in progress; needs the lock."""
+        if self.__rebuilds > 0:
+            self.__journal.append(replay)
+
+    def __update(self,
+                 team_id: str,
+                 index: Dict[str, Set[str]],
+                 add: Iterable[str],
+                 remove: Iterable[str]):
+        """Add and remove a team from the entries of Github users."""
+        for gh_id in add:
+            index.setdefault(gh_id, set()).add(team_id)
+        for gh_id in remove:
+            team_ids = index.get(gh_id, set())
+            team_ids.discard(team_id)
+            if len(team_ids) == 0:
+                index.pop(gh_id, None)
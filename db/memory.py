@@ -0,0 +1,348 @@
+"""In-memory implementation of the database facade."""
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from app.model import User, Team
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, \
+    Tuple, Type, TypeVar
+from db.facade import DBFacade
+from db.membership import Membership
+from db.utils import check_version, now_ms, project_dict, stamp
+
+T = TypeVar('T', User, Team)
+
+# An object as returned by ``to_dict``, with its sets frozen
+Record = Dict[str, Any]
+
+
+class IndexedMemoryDB(DBFacade):
+    """
+    A database facade keeping every object in memory.
+
+    Unlike :class:`tests.memorydb.MemoryDB`, this is meant to serve real
+    traffic, e.g. as a fast local backend for load testing. Every attribute
+    is indexed by value, and the sets of team members and team leads are
+    indexed by element, so queries only read the objects they return.
+
+    Objects are stored as records in the form returned by ``to_dict``.
+    Records are never modified once stored: every write replaces them with
+    new records, and every read builds new objects from them. Stored objects
+    therefore can't be changed through outside references, and reads never
+    see half-done writes. Writes are serialized by a lock, which reads only
+    hold while looking records up.
+
+    If a snapshot path is given, the database is loaded from it on startup,
+    and :meth:`save_snapshot` writes every record back to it. Deletions are
+    recorded for incremental backups, but are not part of snapshots.
+    """
+
+    KEYS = {
+        User: 'slack_id',
+        Team: 'github_team_id'
+    }
+    # Set attributes, whose elements are indexed instead of their values
+    SET_FIELDS: Dict[type, List[str]] = {
+        User: [],
+        Team: ['members', 'team_leads']
+    }
+
+    def __init__(self, snapshot_path: str = ''):
+        """
+        Initialize the database, loading it from a snapshot if there is one.
+
+        :param snapshot_path: path of the snapshot file, or ``''`` to keep
+                              everything in memory only
+        """
+        self.snapshot_path = snapshot_path
+        self.__lock = threading.RLock()
+        self.__records: Dict[type, Dict[str, Record]] = {}
+        self.__indexes: Dict[type, Dict[str, Dict[Any, Set[str]]]] = {}
+        # Times at which objects were deleted, by key
+        self.__deletions: Dict[type, Dict[str, int]] = {}
+        for Model in self.KEYS:
+            self.__records[Model] = {}
+            self.__indexes[Model] = {}
+            self.__deletions[Model] = {}
+
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load_snapshot()
+
+    def __check_model(self, obj: Any):
+        """Raise a ``RuntimeError`` if ``obj`` can't be stored."""
+        if obj.__class__ not in self.KEYS:
+            logging.error(f"Cannot store object {str(obj)}")
+            raise RuntimeError(f'Cannot store object{str(obj)}')
+
+    def __index_values(self, Model: Type[T], field: str, v: Any) \
+            -> Iterable[Any]:
+        """Return the values of an attribute that are indexed."""
+        if field in self.SET_FIELDS[Model]:
+            values: Iterable[Any] = v
+            return values
+        return [v]
+
+    def __put(self, Model: Type[T], record: Record):
+        """Replace a record and update the indexes; needs the lock."""
+        k = record[self.KEYS[Model]]
+        self.__remove(Model, k)
+        self.__records[Model][k] = record
+        indexes = self.__indexes[Model]
+        for field, v in record.items():
+            index = indexes.setdefault(field, {})
+            for value in self.__index_values(Model, field, v):
+                index.setdefault(value, set()).add(k)
+
+    def __remove(self, Model: Type[T], k: str):
+        """Remove a record and update the indexes; needs the lock."""
+        record = self.__records[Model].pop(k, None)
+        if record is None:
+            return
+        indexes = self.__indexes[Model]
+        for field, v in record.items():
+            index = indexes[field]
+            for value in self.__index_values(Model, field, v):
+                ks = index[value]
+                ks.discard(k)
+                if len(ks) == 0:
+                    del index[value]
+
+    def __to_record(self, obj: T) -> Record:
+        """Convert an object into a record that is never modified."""
+        Model = obj.__class__
+        record = Model.to_dict(obj)
+        for field in self.SET_FIELDS[Model]:
+            if field in record:
+                record[field] = frozenset(record[field])
+        return record
+
+    def __to_objs(self,
+                  Model: Type[T],
+                  records: Iterable[Record],
+                  attributes: Optional[List[str]] = None) -> List[T]:
+        """Build new objects out of records."""
+        return [Model.from_dict(project_dict(r, Model, attributes))
+                for r in records]
+
+    def __lookup(self, Model: Type[T], field: str, v: Any) -> Set[str]:
+        """Return the keys of the records matching a parameter; needs the
+        lock."""
+        return self.__indexes[Model].get(field, {}).get(v, set())
+
+    def store(self, obj: T) -> bool:
+        self.__check_model(obj)
+        Model = obj.__class__
+        if not Model.is_valid(obj):
+            return False
+
+        logging.info(f"Storing obj {obj}")
+        k = getattr(obj, self.KEYS[Model])
+        with self.__lock:
+            current = self.__records[Model].get(k, {})
+            check_version(obj, current.get('version', 0))
+            self.__put(Model, self.__to_record(stamp(obj)))
+        return True
+
+    def bulk_store(self, objs: Iterable[T], keep_stamps: bool = False) -> int:
+        stored = 0
+        for obj in objs:
+            self.__check_model(obj)
+            Model = obj.__class__
+            if Model.is_valid(obj):
+                if not keep_stamps:
+                    stamp(obj)
+                with self.__lock:
+                    self.__put(Model, self.__to_record(obj))
+                stored += 1
+        return stored
+
+    def retrieve(self,
+                 Model: Type[T],
+                 k: str,
+                 attributes: Optional[List[str]] = None) -> T:
+        with self.__lock:
+            record = self.__get_record(Model, k)
+        return self.__to_objs(Model, [record], attributes)[0]
+
+    def bulk_retrieve(self, Model: Type[T], ks: List[str]) -> List[T]:
+        with self.__lock:
+            records = [self.__records[Model][k] for k in dict.fromkeys(ks)
+                       if k in self.__records[Model]]
+        return self.__to_objs(Model, records)
+
+    def query(self,
+              Model: Type[T],
+              params: List[Tuple[str, str]] = [],
+              attributes: Optional[List[str]] = None) -> List[T]:
+        with self.__lock:
+            if len(params) == 0:
+                records = list(self.__records[Model].values())
+            else:
+                # Intersect starting from the most selective parameter
+                matches = sorted((self.__lookup(Model, field, v)
+                                  for field, v in params), key=len)
+                ks = set(matches[0])
+                for other in matches[1:]:
+                    ks &= other
+                records = [self.__records[Model][k] for k in ks]
+        return self.__to_objs(Model, records, attributes)
+
+    def query_or(self,
+                 Model: Type[T],
+                 params: List[Tuple[str, str]] = [],
+                 attributes: Optional[List[str]] = None) -> List[T]:
+        if len(params) == 0:
+            return self.query(Model, attributes=attributes)
+
+        with self.__lock:
+            ks: Set[str] = set()
+            for field, v in params:
+                ks |= self.__lookup(Model, field, v)
+            records = [self.__records[Model][k] for k in ks]
+        return self.__to_objs(Model, records, attributes)
+
+    def iter_query(self,
+                   Model: Type[T],
+                   params: List[Tuple[str, str]] = [],
+                   page_size: Optional[int] = None,
+                   attributes: Optional[List[str]] = None) -> Iterator[T]:
+        return iter(self.query(Model, params, attributes))
+
+    def iter_query_or(self,
+                      Model: Type[T],
+                      params: List[Tuple[str, str]] = [],
+                      page_size: Optional[int] = None,
+                      attributes: Optional[List[str]] = None) \
+            -> Iterator[T]:
+        return iter(self.query_or(Model, params, attributes))
+
+    def iter_changes(self, Model: Type[T], since: int) -> Iterator[T]:
+        with self.__lock:
+            records = [r for r in self.__records[Model].values()
+                       if r.get('updated_at', 0) >= since]
+        return iter(self.__to_objs(Model, records))
+
+    def query_in(self,
+                 Model: Type[T],
+                 field: str,
+                 values: List[str]) -> List[T]:
+        if len(values) == 0:
+            return []
+        return self.query_or(Model, [(field, v) for v in values])
+
+    def __get_record(self, Model: Type[T], k: str) -> Record:
+        """Return a copy of a record; needs the lock."""
+        record = self.__records[Model].get(k)
+        if record is None:
+            err_msg = f'{Model.__name__}(id={k}) not found'
+            logging.info(err_msg)
+            raise LookupError(err_msg)
+        return dict(record)
+
+    def __stamp(self, record: Record):
+        """Set the ``updated_at`` and ``version`` of a changed record."""
+        record['updated_at'] = now_ms()
+        record['version'] = record.get('version', 0) + 1
+
+    def increment(self,
+                  Model: Type[T],
+                  k: str,
+                  field: str,
+                  delta: int = 1) -> T:
+        with self.__lock:
+            record = self.__get_record(Model, k)
+            record[field] = record.get(field, 0) + delta
+            self.__stamp(record)
+            self.__put(Model, record)
+        return self.__to_objs(Model, [record])[0]
+
+    def update_set(self,
+                   Model: Type[T],
+                   k: str,
+                   field: str,
+                   add: Iterable[str] = (),
+                   remove: Iterable[str] = ()):
+        add, remove = set(add), set(remove)
+        with self.__lock:
+            record = self.__get_record(Model, k)
+            s = (set(record.get(field, ())) | add) - remove
+            if len(s) > 0:
+                record[field] = frozenset(s)
+            else:
+                # Like DynamoDB, empty sets aren't stored
+                record.pop(field, None)
+            self.__stamp(record)
+            self.__put(Model, record)
+
+    def get_membership(self, github_id: str) -> Membership:
+        with self.__lock:
+            return Membership(
+                set(self.__lookup(Team, 'members', github_id)),
+                set(self.__lookup(Team, 'team_leads', github_id)))
+
+    def delete(self, Model: Type[T], k: str):
+        logging.info(f"Deleting {Model.__name__}(id={k})")
+        with self.__lock:
+            self.__remove(Model, k)
+            self.__deletions[Model][k] = now_ms()
+
+    def bulk_delete(self, Model: Type[T], ks: List[str]):
+        logging.info(f"Deleting {len(ks)} {Model.__name__}s in bulk")
+        deleted_at = now_ms()
+        with self.__lock:
+            for k in ks:
+                self.__remove(Model, k)
+                self.__deletions[Model][k] = deleted_at
+
+    def iter_deletions(self, Model: Type[T], since: int) -> Iterator[str]:
+        with self.__lock:
+            ks = [k for k, deleted_at in self.__deletions[Model].items()
+                  if deleted_at >= since]
+        return iter(ks)
+
+    def save_snapshot(self):
+        """
+        Write every record to the snapshot file.
+
+        The snapshot is written to a temporary file first, then moved over
+        the previous one, so a crash never leaves a partial snapshot behind.
+        """
+        with self.__lock:
+            snapshot = {
+                Model.__name__: [self.__to_json(r) for r in records.values()]
+                for Model, records in self.__records.items()
+            }
+
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        logging.info(f"Saved snapshot to {self.snapshot_path}")
+
+    def load_snapshot(self):
+        """Replace every record with the ones in the snapshot file."""
+        with open(self.snapshot_path) as f:
+            snapshot = json.load(f)
+
+        with self.__lock:
+            for Model in self.KEYS:
+                self.__records[Model] = {}
+                self.__indexes[Model] = {}
+                for d in snapshot.get(Model.__name__, []):
+                    for field in self.SET_FIELDS[Model]:
+                        if field in d:
+                            d[field] = frozenset(d[field])
+                    self.__put(Model, d)
+        logging.info(f"Loaded snapshot from {self.snapshot_path}")
+
+    def __to_json(self, record: Record) -> Dict[str, Any]:
+        """Convert the sets of a record into sorted lists."""
+        return {field: sorted(v) if isinstance(v, frozenset) else v
+                for field, v in record.items()}
@@ -0,0 +1,234 @@
+"""Record the database calls made while handling a command."""
+import contextvars
+import functools
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, NamedTuple, Optional, \
+    Tuple, TypeVar, cast
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+class DBCall:
+    """
+    A call to a database facade method.
+
+    :param operation: name of the facade method
+    :param table: name of the table read or written, or ``''`` if unknown
+    """
+
+    def __init__(self, operation: str, table: str):
+        """Start a call that read or wrote nothing yet."""
+        self.operation = operation
+        self.table = table
+        self.latency_ms = 0.0
+        self.items = 0
+        self.capacity_units = 0.0
+        self.throttles = 0
+        self.__lock = threading.Lock()
+
+    def add_capacity(self, units: float):
+        """Add capacity units consumed by one of the requests of the call."""
+        # Requests of a single call can be made by several threads
+        with self.__lock:
+            self.capacity_units += units
+
+    def add_throttles(self, n: int):
+        """Add requests of the call that the database throttled."""
+        with self.__lock:
+            self.throttles += n
+
+
+class OpStats(NamedTuple):
+    """
+    Totals of the calls to one facade method on one table.
+
+    :param calls: number of calls
+    :param latency_ms: total time spent in the calls
+    :param items: total number of items read or written
+    :param capacity_units: total capacity units consumed, if the database
+                           reports them
+    :param throttles: total number of requests that were throttled, and
+                      had to be retried
+    """
+
+    calls: int = 0
+    latency_ms: float = 0.0
+    items: int = 0
+    capacity_units: float = 0.0
+    throttles: int = 0
+
+
+class DBStats:
+    """Totals of the database calls made while handling a command."""
+
+    def __init__(self):
+        """Start with no calls made."""
+        self.ops: Dict[Tuple[str, str], OpStats] = {}
+        self.__lock = threading.Lock()
+
+    def add(self, call: DBCall):
+        """Add a finished call to the totals of its method and table."""
+        with self.__lock:
+            s = self.ops.get((call.operation, call.table), OpStats())
+            self.ops[(call.operation, call.table)] = OpStats(
+                s.calls + 1,
+                s.latency_ms + call.latency_ms,
+                s.items + call.items,
+                s.capacity_units + call.capacity_units,
+                s.throttles + call.throttles)
+
+
+# Statistics of the command being handled, and the facade call being made
+_stats: 'contextvars.ContextVar[Optional[DBStats]]' = \
+    contextvars.ContextVar('db_stats', default=None)
+_call: 'contextvars.ContextVar[Optional[DBCall]]' = \
+    contextvars.ContextVar('db_call', default=None)
+
+
+@contextmanager
+def record_db_calls() -> Iterator[DBStats]:
+    """
+    Record the database calls made in the block.
+
+    Calls made by the threads that the facade starts are recorded too, as
+    long as they are started with :func:`in_context`.::
+
+        with record_db_calls() as stats:
+            handle(command)
+        metrics.submit_db_stats('team view', stats)
+    """
+    stats = DBStats()
+    token = _stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _stats.reset(token)
+
+
+def add_capacity(units: float):
+    """Add consumed capacity units to the facade call being made, if any."""
+    call = _call.get()
+    if call is not None:
+        call.add_capacity(units)
+
+
+def add_throttles(n: int = 1):
+    """Add throttled requests to the facade call being made, if any."""
+    call = _call.get()
+    if call is not None:
+        call.add_throttles(n)
+
+
+def in_context(f: Callable) -> Callable:
+    """
+    Make ``f`` run with the context of the current thread, in any thread.
+
+    This lets requests made from worker threads be attributed to the facade
+    call that started them.
+    """
+    ctx = contextvars.copy_context()
+
+    @functools.wraps(f)
+    def run(*args: Any, **kwargs: Any) -> Any:
+        # A context can only be entered by one thread at a time
+        return ctx.copy().run(f, *args, **kwargs)
+    return run
+
+
+def count_items(result: Any) -> int:
+    """Return the number of items read or written by a facade call."""
+    if isinstance(result, (bool, int)):
+        return int(result)
+    elif isinstance(result, list):
+        return len(result)
+    elif result is None:
+        return 0
+    return 1
+
+
+def instrument(table: Callable[..., str],
+               count: Optional[Callable[..., int]] = None) \
+        -> Callable[[F], F]:
+    """
+    Record every call to a facade method.
+
+    The latency, number of items, consumed capacity and throttled requests
+    of every call are logged at debug level, and added to the statistics of
+    the command being handled, if any. Calls made by other facade methods
+    are counted as part of the outer call. Methods returning iterators are
+    only timed while producing items, and their items are counted as they
+    are consumed.
+
+    :param table: function of the method's arguments returning the name of
+                  the table used
+    :param count: function of the method's arguments returning the number of
+                  items written, for methods whose result doesn't say
+    """
+    def decorator(f: F) -> F:
+        @functools.wraps(f)
+        def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+            outer = _call.get()
+            if outer is not None:
+                if outer.table == '':
+                    outer.table = table(self, *args, **kwargs)
+                return f(self, *args, **kwargs)
+
+            call = DBCall(f.__name__, table(self, *args, **kwargs))
+            with _measure(call):
+                result = f(self, *args, **kwargs)
+            if isinstance(result, Iterator):
+                return _iterate(call, result)
+            call.items = count(self, *args, **kwargs) if count \
+                else count_items(result)
+            _finish(call)
+            return result
+        return cast(F, wrapper)
+    return decorator
+
+
+@contextmanager
+def _measure(call: DBCall):
+    """Time the block, and attribute its consumed capacity to ``call``."""
+    token = _call.set(call)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        call.latency_ms += (time.perf_counter() - start) * 1000
+        _call.reset(token)
+
+
+def _iterate(call: DBCall, it: Iterator) -> Iterator:
+    """Yield the items of ``it``, recording the call once it is closed."""
+    # Capture the command being handled now, since the iterator could be
+    # consumed in another context
+    stats = _stats.get()
+
+    def items() -> Iterator:
+        try:
+            while True:
+                with _measure(call):
+                    try:
+                        item = next(it)
+                    except StopIteration:
+                        return
+                call.items += 1
+                yield item
+        finally:
+            _finish(call, stats)
+    return items()
+
+
+def _finish(call: DBCall, stats: Optional[DBStats] = None):
+    """Log a finished call, and add it to the command's statistics."""
+    logging.debug(f"db call {call.operation} on {call.table or '-'}: "
+                  f"{call.latency_ms:.1f} ms, {call.items} items, "
+                  f"{call.capacity_units} capacity units, "
+                  f"{call.throttles} throttles")
+    stats = stats or _stats.get()
+    if stats is not None:
+        stats.add(call)
@@ -0,0 +1,82 @@
+"""Plan how to find the items matching any of a list of parameters."""
+import logging
+
+from collections import Counter
+from typing import Dict, List, NamedTuple, Tuple
+
+# Get items by their primary keys
+KEYS = 'keys'
+# Query a global secondary index once per value
+INDEX = 'index'
+# Scan the whole table once, filtering items as they are read
+SCAN = 'scan'
+
+
+class Step(NamedTuple):
+    """
+    A single read of a query plan.
+
+    :param strategy: one of ``KEYS``, ``INDEX`` or ``SCAN``
+    :param params: parameters of the query that this step finds items for
+    :param index_name: name of the index to query, for ``INDEX`` steps
+    """
+
+    strategy: str
+    params: List[Tuple[str, str]]
+    index_name: str = ''
+
+
+class QueryPlanner:
+    """
+    Pick the cheapest reads to answer an OR query.
+
+    Parameters are grouped by attribute. Groups on the primary key can be
+    read directly, and groups on an attribute with an index can be read by
+    querying the index for every value. If any group can do neither, the
+    whole table has to be scanned anyway, so a single scan answers every
+    parameter at once.
+
+    Every decision is logged at debug level and counted in
+    :attr:`decisions`, keyed by table name and strategy.
+    """
+
+    def __init__(self):
+        """Initialize the planner with no decisions made."""
+        self.decisions: Counter = Counter()
+
+    def plan_or(self,
+                table_name: str,
+                params: List[Tuple[str, str]],
+                key: str,
+                indexes: Dict[str, str]) -> List[Step]:
+        """
+        Plan the reads for a query matching any of ``params``.
+
+        :param table_name: name of the table to read from
+        :param params: parameters of the query, which must not be empty
+        :param key: name of the table's primary key
+        :param indexes: map of attributes to the names of their usable
+                        indexes; set attributes must not be included, since
+                        their elements can't be looked up through an index
+        :return: steps whose results together answer the query
+        """
+        groups: Dict[str, List[Tuple[str, str]]] = {}
+        for param in dict.fromkeys(params):
+            groups.setdefault(param[0], []).append(param)
+
+        plan = []
+        for field, group in groups.items():
+            if field == key:
+                plan.append(Step(KEYS, group))
+            elif field in indexes:
+                plan.append(Step(INDEX, group, indexes[field]))
+            else:
+                plan = [Step(SCAN, list(dict.fromkeys(params)))]
+                break
+
+        for step in plan:
+            self.decisions[(table_name, step.strategy)] += 1
+            target = f" {step.index_name}" if step.index_name else ""
+            logging.debug(f"query plan for {table_name}: {step.strategy}"
+                          f"{target} ({len(step.params)} params)")
+        return plan
@@ -0,0 +1,514 @@
+"""SQLite implementation of the database facade."""
+import logging
+import sqlite3
+import threading
+
+from itertools import islice
+from app.model import User, Team
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, \
+    Tuple, Type, TypeVar
+from config import Config
+from db.facade import DBFacade
+from db.membership import Membership
+from db.utils import check_version, get_projection, now_ms, stamp
+
+T = TypeVar('T', User, Team)
+
+
+class SQLiteDB(DBFacade):
+    """
+    A database facade storing everything in a single SQLite file.
+
+    Meant for single-node deployments and local development, where the
+    network round trips to DynamoDB cost more than the reads themselves.
+    Every thread gets its own connection, and the database is kept in
+    write-ahead logging mode so that reads never wait for writes.
+
+    Users and teams are stored in the ``users`` and ``teams`` tables, with
+    one column per attribute of their ``to_dict`` representation. The sets
+    of team members and team leads are stored one element per row in the
+    ``team_members`` and ``team_leads`` tables, indexed in both directions.
+    Deletions are recorded in the ``deletions`` table, for incremental
+    backups.
+    """
+
+    # Number of rows read per query while iterating over results
+    PAGE_SIZE = 100
+    # Maximum number of values bound in a single statement
+    MAX_VARIABLES = 500
+
+    # Columns of every table, the first one being the primary key
+    COLUMNS = {
+        User: ['slack_id', 'permission_level', 'email', 'name', 'github',
+               'github_user_id', 'major', 'position', 'bio', 'image_url',
+               'karma', 'updated_at', 'version'],
+        Team: ['github_team_id', 'github_team_name', 'displayname',
+               'platform', 'folder', 'updated_at', 'version']
+    }
+    TABLES = {
+        User: 'users',
+        Team: 'teams'
+    }
+    # Set attributes of teams, and the tables they are stored in
+    SET_TABLES = {
+        'members': 'team_members',
+        'team_leads': 'team_leads'
+    }
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            slack_id TEXT PRIMARY KEY,
+            permission_level TEXT NOT NULL,
+            email TEXT,
+            name TEXT,
+            github TEXT,
+            github_user_id TEXT,
+            major TEXT,
+            position TEXT,
+            bio TEXT,
+            image_url TEXT,
+            karma INTEGER,
+            updated_at INTEGER,
+            version INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS users_github_user_id
+            ON users (github_user_id);
+        CREATE INDEX IF NOT EXISTS users_github ON users (github);
+        CREATE INDEX IF NOT EXISTS users_email ON users (email);
+
+        CREATE TABLE IF NOT EXISTS teams (
+            github_team_id TEXT PRIMARY KEY,
+            github_team_name TEXT NOT NULL,
+            displayname TEXT,
+            platform TEXT,
+            folder TEXT,
+            updated_at INTEGER,
+            version INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS teams_github_team_name
+            ON teams (github_team_name);
+
+        CREATE TABLE IF NOT EXISTS team_members (
+            github_team_id TEXT NOT NULL,
+            github_id TEXT NOT NULL,
+            PRIMARY KEY (github_team_id, github_id)
+        );
+        CREATE INDEX IF NOT EXISTS team_members_github_id
+            ON team_members (github_id);
+
+        CREATE TABLE IF NOT EXISTS team_leads (
+            github_team_id TEXT NOT NULL,
+            github_id TEXT NOT NULL,
+            PRIMARY KEY (github_team_id, github_id)
+        );
+        CREATE INDEX IF NOT EXISTS team_leads_github_id
+            ON team_leads (github_id);
+
+        CREATE TABLE IF NOT EXISTS deletions (
+            model TEXT NOT NULL,
+            key TEXT NOT NULL,
+            deleted_at INTEGER NOT NULL,
+            PRIMARY KEY (model, key)
+        );
+        CREATE INDEX IF NOT EXISTS deletions_deleted_at
+            ON deletions (model, deleted_at);
+    """
+    # Indexes on columns that databases made by older versions lack, created
+    # once the columns are added
+    COLUMN_INDEXES = """
+        CREATE INDEX IF NOT EXISTS users_updated_at ON users (updated_at);
+        CREATE INDEX IF NOT EXISTS teams_updated_at ON teams (updated_at);
+    """
+
+    def __init__(self, config: Config):
+        """
+        Open the database, creating its tables if they don't exist yet.
+
+        :param config: configuration used to initialize; the database is
+                       stored at ``config.sqlite_path``
+        """
+        logging.info(f"Initializing SQLite database {config.sqlite_path}")
+        self.path = config.sqlite_path
+        self.__local = threading.local()
+        conn = self.__conn()
+        conn.executescript(self.SCHEMA)
+        self.__add_missing_columns(conn)
+        conn.executescript(self.COLUMN_INDEXES)
+
+    def __conn(self) -> sqlite3.Connection:
+        """Return the connection of the current thread, opening it once."""
+        conn: Optional[sqlite3.Connection] = \
+            getattr(self.__local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Safe from corruption in WAL mode, only the last commits can be
+            # lost if the machine itself crashes
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.__local.conn = conn
+        return conn
+
+    def __add_missing_columns(self, conn: sqlite3.Connection):
+        """Add the columns of attributes added since a table was created."""
+        for Model, table in self.TABLES.items():
+            existing = {row['name'] for row in
+                        conn.execute(f"PRAGMA table_info({table})")}
+            for col in self.COLUMNS[Model]:
+                if col not in existing:
+                    logging.info(f"Adding column {col} to {table}")
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {col}")
+
+    def __check_model(self, obj: Any):
+        """Raise a ``RuntimeError`` if ``obj`` can't be stored."""
+        if obj.__class__ not in [User, Team]:
+            logging.error(f"Cannot store object {str(obj)}")
+            raise RuntimeError(f'Cannot store object{str(obj)}')
+
+    def __write(self, conn: sqlite3.Connection, obj: T):
+        """Insert or replace an object, without committing."""
+        Model = obj.__class__
+        d = Model.to_dict(obj)
+        cols = self.COLUMNS[Model]
+        conn.execute(f"INSERT OR REPLACE INTO {self.TABLES[Model]} "
+                     f"({', '.join(cols)}) "
+                     f"VALUES ({', '.join('?' * len(cols))})",
+                     [self.__to_column(d.get(col)) for col in cols])
+        if Model is Team:
+            for field, table in self.SET_TABLES.items():
+                conn.execute(f"DELETE FROM {table} WHERE github_team_id = ?",
+                             (d['github_team_id'],))
+                conn.executemany(f"INSERT INTO {table} VALUES (?, ?)",
+                                 [(d['github_team_id'], gh_id)
+                                  for gh_id in d.get(field, [])])
+
+    def __to_column(self, v: Any) -> Any:
+        """Convert an attribute of ``to_dict`` into a column value."""
+        if v is None or isinstance(v, (int, float)):
+            return v
+        return str(v)
+
+    def __delete(self,
+                 conn: sqlite3.Connection,
+                 Model: Type[T],
+                 k: str,
+                 deleted_at: int):
+        """Delete an object and record its deletion, without committing."""
+        key = self.COLUMNS[Model][0]
+        conn.execute(f"DELETE FROM {self.TABLES[Model]} WHERE {key} = ?",
+                     (k,))
+        conn.execute("INSERT OR REPLACE INTO deletions VALUES (?, ?, ?)",
+                     (Model.__name__, k, deleted_at))
+        if Model is Team:
+            for table in self.SET_TABLES.values():
+                conn.execute(f"DELETE FROM {table} WHERE github_team_id = ?",
+                             (k,))
+
+    def store(self, obj: T) -> bool:
+        self.__check_model(obj)
+        if not obj.__class__.is_valid(obj):
+            return False
+
+        logging.info(f"Storing obj {obj}")
+        with self.__conn() as conn:
+            if obj.version > 0:
+                # Lock the database until the object is written, so that
+                # nobody writes it between the check and the write
+                conn.execute('BEGIN IMMEDIATE')
+                check_version(obj, self.__version(conn, obj))
+            self.__write(conn, stamp(obj))
+        return True
+
+    def __version(self, conn: sqlite3.Connection, obj: T) -> int:
+        """Return the stored version of an object, or 0 if not stored."""
+        Model = obj.__class__
+        key = self.COLUMNS[Model][0]
+        row = conn.execute(f"SELECT version FROM {self.TABLES[Model]} "
+                           f"WHERE {key} = ?",
+                           (getattr(obj, key),)).fetchone()
+        return 0 if row is None else row[0] or 0
+
+    def bulk_store(self, objs: Iterable[T], keep_stamps: bool = False) -> int:
+        stored = 0
+        objs = iter(objs)
+        while True:
+            window = list(islice(objs, self.PAGE_SIZE))
+            if len(window) == 0:
+                return stored
+
+            logging.info(f"Storing {len(window)} objs in bulk")
+            with self.__conn() as conn:
+                for obj in window:
+                    self.__check_model(obj)
+                    if obj.__class__.is_valid(obj):
+                        self.__write(conn,
+                                     obj if keep_stamps else stamp(obj))
+                        stored += 1
+
+    def retrieve(self,
+                 Model: Type[T],
+                 k: str,
+                 attributes: Optional[List[str]] = None) -> T:
+        key = self.COLUMNS[Model][0]
+        objs = self.__select(Model, f"{key} = ?", [k], attributes)
+        if len(objs) == 0:
+            err_msg = f'{Model.__name__}(id={k}) not found'
+            logging.info(err_msg)
+            raise LookupError(err_msg)
+        return objs[0]
+
+    def bulk_retrieve(self, Model: Type[T], ks: List[str]) -> List[T]:
+        ks = list(dict.fromkeys(ks))
+        key = self.COLUMNS[Model][0]
+        found: Dict[str, T] = {}
+        for i in range(0, len(ks), self.MAX_VARIABLES):
+            chunk = ks[i: i + self.MAX_VARIABLES]
+            cond = f"{key} IN ({', '.join('?' * len(chunk))})"
+            for obj in self.__select(Model, cond, chunk):
+                found[getattr(obj, key)] = obj
+        return [found[k] for k in ks if k in found]
+
+    def query(self,
+              Model: Type[T],
+              params: List[Tuple[str, str]] = [],
+              attributes: Optional[List[str]] = None) -> List[T]:
+        return list(self.iter_query(Model, params, attributes=attributes))
+
+    def query_or(self,
+                 Model: Type[T],
+                 params: List[Tuple[str, str]] = [],
+                 attributes: Optional[List[str]] = None) -> List[T]:
+        return list(self.iter_query_or(Model, params, attributes=attributes))
+
+    def iter_query(self,
+                   Model: Type[T],
+                   params: List[Tuple[str, str]] = [],
+                   page_size: Optional[int] = None,
+                   attributes: Optional[List[str]] = None) -> Iterator[T]:
+        conds, values = [], []
+        for field, v in params:
+            cond, vs = self.__in_cond(Model, field, [v])
+            conds.append(cond)
+            values.extend(vs)
+        cond = ' AND '.join(conds) if conds else '1'
+        return self.__paginate(Model, cond, values, page_size, attributes)
+
+    def iter_query_or(self,
+                      Model: Type[T],
+                      params: List[Tuple[str, str]] = [],
+                      page_size: Optional[int] = None,
+                      attributes: Optional[List[str]] = None) \
+            -> Iterator[T]:
+        if len(params) == 0:
+            return self.iter_query(Model, page_size=page_size,
+                                   attributes=attributes)
+
+        groups: Dict[str, List[str]] = {}
+        for field, v in dict.fromkeys(params):
+            groups.setdefault(field, []).append(v)
+        conds, values = [], []
+        for field, vs in groups.items():
+            for i in range(0, len(vs), self.MAX_VARIABLES):
+                cond, cond_values = self.__in_cond(
+                    Model, field, vs[i: i + self.MAX_VARIABLES])
+                conds.append(cond)
+                values.extend(cond_values)
+        return self.__paginate(Model, ' OR '.join(conds), values, page_size,
+                               attributes)
+
+    def iter_changes(self, Model: Type[T], since: int) -> Iterator[T]:
+        return self.__paginate(Model, 'updated_at >= ?', [since])
+
+    def __in_cond(self,
+                  Model: Type[T],
+                  field: str,
+                  vs: List[str]) -> Tuple[str, List[str]]:
+        """
+        Return a condition matching rows whose ``field`` is one of ``vs``.
+
+        For set attributes, rows match if their set contains one of ``vs``.
+        Attributes that don't exist match nothing, like in DynamoDB.
+
+        :param Model: type of the rows to match
+        :param field: attribute to check
+        :param vs: values to match
+        :return: the condition and the values to bind to it
+        """
+        placeholders = ', '.join('?' * len(vs))
+        if Model is Team and field in self.SET_TABLES:
+            return (f"github_team_id IN (SELECT github_team_id FROM "
+                    f"{self.SET_TABLES[field]} "
+                    f"WHERE github_id IN ({placeholders}))", vs)
+        elif field in self.COLUMNS[Model]:
+            return f"{field} IN ({placeholders})", vs
+        return '0', []
+
+    def __paginate(self,
+                   Model: Type[T],
+                   cond: str,
+                   values: List[Any],
+                   page_size: Optional[int] = None,
+                   attributes: Optional[List[str]] = None) -> Iterator[T]:
+        """
+        Select the objects matching a condition, one page at a time.
+
+        Pages are read with separate statements, ordered by key, so no
+        statement is left open while the caller is consuming results (and
+        possibly writing to the same table).
+
+        :param Model: type of the objects to select
+        :param cond: SQL condition on the rows of ``Model``'s table
+        :param values: values to bind to the condition
+        :param page_size: number of rows to read per statement
+        :param attributes: attributes to read, or ``None`` for all of them
+        :return: a generator of the matching objects
+        """
+        key = self.COLUMNS[Model][0]
+        limit = page_size or self.PAGE_SIZE
+        last_key = None
+        while True:
+            page_cond = f"({cond})"
+            page_values = list(values)
+            if last_key is not None:
+                page_cond += f" AND {key} > ?"
+                page_values.append(last_key)
+            page = self.__select(Model, page_cond, page_values, attributes,
+                                 f"ORDER BY {key} LIMIT {int(limit)}")
+            yield from page
+            if len(page) < limit:
+                return
+            last_key = getattr(page[-1], key)
+
+    def __select(self,
+                 Model: Type[T],
+                 cond: str,
+                 values: List[Any],
+                 attributes: Optional[List[str]] = None,
+                 suffix: str = '') -> List[T]:
+        """
+        Select the objects matching a condition, along with their sets.
+
+        :param Model: type of the objects to select
+        :param cond: SQL condition on the rows of ``Model``'s table
+        :param values: values to bind to the condition
+        :param attributes: attributes to read, or ``None`` for all of them
+        :param suffix: SQL to add at the end of the statement
+        :return: the matching objects
+        """
+        projection = get_projection(Model, attributes)
+        cols = [col for col in self.COLUMNS[Model]
+                if projection is None or col in projection]
+        set_fields = [f for f in self.SET_TABLES
+                      if Model is Team and (projection is None or
+                                            f in projection)]
+
+        conn = self.__conn()
+        rows = conn.execute(f"SELECT {', '.join(cols)} "
+                            f"FROM {self.TABLES[Model]} "
+                            f"WHERE {cond} {suffix}", values).fetchall()
+        ds = [{col: row[col] for col in cols if row[col] is not None}
+              for row in rows]
+
+        if set_fields and ds:
+            by_id = {d['github_team_id']: d for d in ds}
+            for field in set_fields:
+                for d in ds:
+                    d[field] = set()
+                for t_id, gh_id in self.__set_rows(conn, field,
+                                                   list(by_id.keys())):
+                    by_id[t_id][field].add(gh_id)
+        return [Model.from_dict(d) for d in ds]
+
+    def __set_rows(self,
+                   conn: sqlite3.Connection,
+                   field: str,
+                   team_ids: List[str]) -> Iterator[Tuple[str, str]]:
+        """Return the (team ID, Github ID) rows of a set of some teams."""
+        for i in range(0, len(team_ids), self.MAX_VARIABLES):
+            chunk = team_ids[i: i + self.MAX_VARIABLES]
+            yield from conn.execute(
+                f"SELECT github_team_id, github_id "
+                f"FROM {self.SET_TABLES[field]} "
+                f"WHERE github_team_id IN ({', '.join('?' * len(chunk))})",
+                chunk)
+
+    def query_in(self,
+                 Model: Type[T],
+                 field: str,
+                 values: List[str]) -> List[T]:
+        if len(values) == 0:
+            return []
+        return self.query_or(Model, [(field, v) for v in values])
+
+    def increment(self,
+                  Model: Type[T],
+                  k: str,
+                  field: str,
+                  delta: int = 1) -> T:
+        if field not in self.COLUMNS[Model][1:] or \
+                field in ['updated_at', 'version']:
+            raise TypeError(f'{Model.__name__} has no attribute {field}')
+
+        key = self.COLUMNS[Model][0]
+        with self.__conn() as conn:
+            cur = conn.execute(f"UPDATE {self.TABLES[Model]} "
+                               f"SET {field} = COALESCE({field}, 0) + ?, "
+                               f"updated_at = ?, "
+                               f"version = COALESCE(version, 0) + 1 "
+                               f"WHERE {key} = ?", (delta, now_ms(), k))
+            if cur.rowcount == 0:
+                err_msg = f'{Model.__name__}(id={k}) not found'
+                logging.info(err_msg)
+                raise LookupError(err_msg)
+        return self.retrieve(Model, k)
+
+    def update_set(self,
+                   Model: Type[T],
+                   k: str,
+                   field: str,
+                   add: Iterable[str] = (),
+                   remove: Iterable[str] = ()):
+        if Model is not Team or field not in self.SET_TABLES:
+            raise TypeError(f'{Model.__name__} has no set attribute {field}')
+
+        table = self.SET_TABLES[field]
+        with self.__conn() as conn:
+            cur = conn.execute("UPDATE teams SET updated_at = ?, "
+                               "version = COALESCE(version, 0) + 1 "
+                               "WHERE github_team_id = ?", (now_ms(), k))
+            if cur.rowcount == 0:
+                err_msg = f'{Model.__name__}(id={k}) not found'
+                logging.info(err_msg)
+                raise LookupError(err_msg)
+            conn.executemany(f"INSERT OR IGNORE INTO {table} VALUES (?, ?)",
+                             [(k, gh_id) for gh_id in set(add)])
+            conn.executemany(f"DELETE FROM {table} "
+                             f"WHERE github_team_id = ? AND github_id = ?",
+                             [(k, gh_id) for gh_id in set(remove)])
+
+    def get_membership(self, github_id: str) -> Membership:
+        conn = self.__conn()
+
+        def team_ids(table: str) -> Set[str]:
+            rows = conn.execute(f"SELECT github_team_id FROM {table} "
+                                f"WHERE github_id = ?", (github_id,))
+            return {row[0] for row in rows}
+        return Membership(team_ids('team_members'), team_ids('team_leads'))
+
+    def delete(self, Model: Type[T], k: str):
+        logging.info(f"Deleting {Model.__name__}(id={k})")
+        with self.__conn() as conn:
+            self.__delete(conn, Model, k, now_ms())
+
+    def bulk_delete(self, Model: Type[T], ks: List[str]):
+        logging.info(f"Deleting {len(ks)} {Model.__name__}s in bulk")
+        deleted_at = now_ms()
+        with self.__conn() as conn:
+            for k in ks:
+                self.__delete(conn, Model, k, deleted_at)
+
+    def iter_deletions(self, Model: Type[T], since: int) -> Iterator[str]:
+        rows = self.__conn().execute(
+            "SELECT key FROM deletions WHERE model = ? AND deleted_at >= ?",
+            (Model.__name__, since)).fetchall()
+        return iter([row[0] for row in rows])
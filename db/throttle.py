@@ -0,0 +1,140 @@
+"""Adapt the rate of bulk requests to the throttling of every table."""
+import math
+import threading
+import time
+
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+
+class TableRate:
+    """The rate limit of a table, along with its recent requests."""
+
+    def __init__(self):
+        """Start without a limit."""
+        # Requests per second allowed, or None if unlimited
+        self.rate: Optional[float] = None
+        # Earliest time the next request can be made
+        self.next_at = 0.0
+        # Times of the requests made in the last window
+        self.requests: Deque[float] = deque()
+        self.throttled_at = -math.inf
+        self.decreased_at = -math.inf
+        self.throttles = 0
+
+    def forget(self, before: float):
+        """Forget the requests made before a time."""
+        while self.requests and self.requests[0] < before:
+            self.requests.popleft()
+
+
+class AdaptiveRateLimiter:
+    """
+    A thread-safe limit on the rate of requests to every table.
+
+    Tables start without a limit. When requests to a table get throttled,
+    its rate is halved, starting from the rate of requests seen in the last
+    ``WINDOW_SECS``, and every request that goes through raises it again
+    slightly, adding up to ``increase`` requests per second every second
+    (additive increase, multiplicative decrease). Once a table hasn't been
+    throttled for ``RESET_SECS``, its limit is lifted.
+
+    Only requests made through :meth:`acquire` are limited, but throttles
+    can be reported for any request. Throttles reported within
+    ``WINDOW_SECS`` of a decrease are counted but don't decrease the rate
+    again, so that a burst of throttled requests in flight at the same time
+    only halves it once.
+    """
+
+    WINDOW_SECS = 1.0
+    RESET_SECS = 60.0
+
+    def __init__(self,
+                 min_rate: float = 1.0,
+                 increase: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        Initialize a limiter that doesn't limit anything yet.
+
+        :param min_rate: requests per second that are always allowed
+        :param increase: requests per second added to the rate every second
+                         without throttling
+        :param clock: function returning the current time in seconds
+        :param sleep: function waiting for a number of seconds
+        """
+        self.min_rate = min_rate
+        self.increase = increase
+        self.clock = clock
+        self.sleep = sleep
+        self.__tables: Dict[str, TableRate] = {}
+        self.__lock = threading.Lock()
+
+    def __table(self, table: str) -> TableRate:
+        """Return the rate of a table; needs the lock."""
+        if table not in self.__tables:
+            self.__tables[table] = TableRate()
+        return self.__tables[table]
+
+    def acquire(self, table: str):
+        """
+        Wait until a request to a table fits in its rate.
+
+        :param table: name of the table about to be requested
+        """
+        with self.__lock:
+            t = self.__table(table)
+            now = self.clock()
+            t.forget(now - self.WINDOW_SECS)
+            t.requests.append(now)
+            if t.rate is not None and \
+                    now - t.throttled_at > self.RESET_SECS:
+                t.rate = None
+            if t.rate is None:
+                return
+            start = max(now, t.next_at)
+            t.next_at = start + 1 / t.rate
+        if start > now:
+            self.sleep(start - now)
+
+    def succeeded(self, table: str):
+        """Report that a request to a table was not throttled."""
+        with self.__lock:
+            t = self.__table(table)
+            if t.rate is not None:
+                t.rate += self.increase / t.rate
+
+    def throttled(self, table: str, n: int = 1):
+        """
+        Report that requests to a table were throttled.
+
+        :param table: name of the throttled table
+        :param n: number of throttled requests
+        """
+        with self.__lock:
+            t = self.__table(table)
+            now = self.clock()
+            t.throttles += n
+            t.throttled_at = now
+            t.forget(now - self.WINDOW_SECS)
+            if now - t.decreased_at < self.WINDOW_SECS or \
+                    (t.rate is None and not t.requests):
+                # Already slowed down, or no bulk work to slow down
+                return
+            recent = len(t.requests) / self.WINDOW_SECS
+            rate = recent if t.rate is None else min(t.rate, recent)
+            t.rate = max(self.min_rate, rate / 2)
+            t.decreased_at = now
+
+    def rate(self, table: str) -> Optional[float]:
+        """Return the requests per second allowed, or ``None`` if
+        unlimited."""
+        with self.__lock:
+            return self.__table(table).rate
+
+    def throttles(self) -> Dict[str, int]:
+        """Return the number of throttled requests to every table throttled
+        so far."""
+        with self.__lock:
+            return {name: t.throttles for name, t in self.__tables.items()
+                    if t.throttles > 0}
@@ -1,8 +1,175 @@
 """Database utilities, for functions that you use all the time."""
-from db.facade import DBFacade
+from db.facade import DBFacade, VersionConflict
 from app.model import Team, User
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Type, TypeVar
 import logging
+import random
+import time
+
+T = TypeVar('T', User, Team)
+
+# Maximum number of times to retry an update that lost a race
+MAX_UPDATE_RETRIES = 5
+
+# Attributes needed to build a model, which projections always include
+REQUIRED_ATTRS = {
+    User: ['slack_id'],
+    Team: ['github_team_id', 'github_team_name']
+}
+
+
+def get_projection(Model: Type[T],
+                   attributes: Optional[List[str]]) -> Optional[List[str]]:
+    """
+    Return the attributes to fetch for a projection on ``attributes``.
+
+    :param Model: type of the projected objects
+    :param attributes: attributes requested by the caller, or ``None`` for
+                       all of them
+    :return: the requested attributes along with the ones needed to build
+             ``Model``, or ``None`` to fetch all of them
+    """
+    if attributes is None:
+        return None
+    return list(dict.fromkeys(REQUIRED_ATTRS[Model] + list(attributes)))
+
+
+def project_dict(d: Dict[str, Any],
+                 Model: Type[T],
+                 attributes: Optional[List[str]]) -> Dict[str, Any]:
+    """
+    Keep only the projected attributes of an item.
+
+    :param d: the item, as returned by ``Model.to_dict``
+    :param Model: type of the item
+    :param attributes: attributes to keep, or ``None`` to keep all of them
+    :return: the projected item
+    """
+    projection = get_projection(Model, attributes)
+    if projection is None:
+        return d
+    return {a: d[a] for a in projection if a in d}
+
+
+def project(obj: T, attributes: Optional[List[str]]) -> T:
+    """
+    Return a partial copy of an object with only some of its attributes.
+
+    Attributes that aren't projected are left at their default values.
+
+    :param obj: the object to copy
+    :param attributes: attributes to keep, or ``None`` to return ``obj``
+    :return: the partial copy of ``obj``
+    """
+    if attributes is None:
+        return obj
+    Model = obj.__class__
+    return Model.from_dict(project_dict(Model.to_dict(obj), Model,
+                                        attributes))
+
+
+def now_ms() -> int:
+    """Return the current time, in milliseconds since the epoch."""
+    return int(time.time() * 1000)
+
+
+def backoff_delay(attempt: int,
+                  base: float = 0.05,
+                  cap: float = 5.0) -> float:
+    """
+    Return how long to wait before retrying a request, in seconds.
+
+    Uses exponential backoff with full jitter, so that threads retrying at
+    the same time don't all hit the database again at the same moment.
+
+    :param attempt: how many times the request has been retried (from 1)
+    :param base: delay of the first retry, before jitter
+    :param cap: maximum delay, before jitter
+    :return: number of seconds to wait
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def stamp(obj: T) -> T:
+    """
+    Set the ``updated_at`` and ``version`` of an object about to be stored.
+
+    Facades call this on every write, so that backups can export only the
+    objects changed since the previous one, and so that stale copies of the
+    object can no longer be stored (see :func:`check_version`).
+
+    :param obj: the object to stamp
+    :return: ``obj``
+    """
+    obj.updated_at = now_ms()
+    obj.version += 1
+    return obj
+
+
+def check_version(obj: T, version: int):
+    """
+    Check that an object is not stale before storing it.
+
+    Objects that were never read from or written to the database have
+    version 0, and are always allowed to overwrite what is stored. Objects
+    read from items written before versions were recorded have version 0
+    too, but are only stored if the item still has version 0.
+
+    :param obj: the object about to be stored
+    :param version: version of the object in the database, or 0 if it is
+                    not in the database
+    :raises: VersionConflict if the object was read at another version
+    """
+    if (obj.from_db or obj.version > 0) and obj.version != version:
+        Model = obj.__class__
+        k = getattr(obj, REQUIRED_ATTRS[Model][0])
+        raise VersionConflict(f'{Model.__name__}(id={k}) was changed since '
+                              f'version {obj.version}')
+
+
+def update_with_retry(dbf: DBFacade,
+                      Model: Type[T],
+                      k: str,
+                      mutate: Callable[[T], None],
+                      retries: int = MAX_UPDATE_RETRIES,
+                      current: Optional[T] = None) -> T:
+    """
+    Retrieve an object, change it and store it back, without losing updates.
+
+    If someone else stores the object in the meantime, it is retrieved again
+    and ``mutate`` is called on the fresh copy, so ``mutate`` must not have
+    side effects outside of the object.::
+
+        update_with_retry(dbf, Team, '12345',
+                          lambda team: team.add_member('abc123'))
+
+    :param dbf: database to update
+    :param Model: type of the object to update
+    :param k: ID or key of the object to update
+    :param mutate: function changing the object in place
+    :param retries: maximum number of times to retry
+    :param current: the object, if the caller just retrieved it, which is
+                    changed on the first attempt instead of retrieving it
+                    again
+    :raises: LookupError if the object does not exist
+    :raises: VersionConflict if every attempt lost a race
+    :return: the object, as stored
+    """
+    attempt = 0
+    while True:
+        obj = dbf.retrieve(Model, k) if current is None else current
+        current = None
+        mutate(obj)
+        try:
+            dbf.store(obj)
+            return obj
+        except VersionConflict:
+            attempt += 1
+            if attempt > retries:
+                raise
+            logging.info(f"{Model.__name__}(id={k}) changed while updating "
+                         f"it, retrying (attempt {attempt})")
+            time.sleep(backoff_delay(attempt))
 
 
 def get_team_by_name(dbf: DBFacade, gh_team_name: str) -> Team:
@@ -10,7 +177,8 @@ def get_team_by_name(dbf: DBFacade, gh_team_name: str) -> Team:
     Query team by github team name.
 
     Can only return a single team. If there are no teams with that name, or
-    there are multiple teams with that name, we raise an error.
+    there are multiple teams with that name, we raise an error. Databases
+    with an index on ``github_team_name`` answer this without a table scan.
 
     :raises: LookupError if the calling user, user to add,
              or specified team cannot be found in the database
@@ -50,9 +218,4 @@ def get_users_by_ghid(dbf: DBFacade, gh_ids: List[str]) -> List[User]:
 
     :return: List of users if found
     """
-    if len(gh_ids) == 0:
-        return []
-
-    q = [('github_user_id', gh_id) for gh_id in gh_ids]
-    users = dbf.query_or(User, q)
-    return users
+    return dbf.query_in(User, 'github_user_id', gh_ids)
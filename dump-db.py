@@ -1,26 +1,44 @@
 """
-Dumps all tables into a single python pickle file.
+Dumps all tables into a file, one JSON object per line.
 
-Run with pipenv run python dump-db.py
+Items are streamed from paginated scans, so the whole database is never held
+in memory. The file is compressed with gzip if its name ends in ``.gz``.
+
+Every dump records when it started in a checkpoint file. With
+``--incremental``, only the items stored since the last checkpoint are
+dumped, along with the items deleted since, so that the file can be restored
+on top of the previous ones. On DynamoDB, this needs ``AWS_DELETIONS_TABLE``
+to be set, and the first dump after setting it must be a full one.
+
+Run with pipenv run python dump-db.py [filename] [--incremental]
 """
 from config import Config
 from factory import make_dbfacade
-from app.model import Team, User
-import pickle
+from db.backup import dump, open_backup, read_checkpoint, write_checkpoint
+from db.utils import now_ms
+import argparse
 
-filename = 'db.pkl'
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+parser.add_argument('filename', nargs='?', default='db.ndjson.gz')
+parser.add_argument('--incremental', action='store_true',
+                    help='only dump items stored since the last checkpoint')
+parser.add_argument('--checkpoint', default='db.checkpoint',
+                    help='file recording when the last dump started')
+args = parser.parse_args()
 
-db = make_dbfacade(Config())
-all_teams = db.query(Team)
-all_users = db.query(User)
+since = 0
+if args.incremental:
+    try:
+        since = read_checkpoint(args.checkpoint)
+    except FileNotFoundError:
+        print(f'No checkpoint `{args.checkpoint}`; dumping everything')
+started_at = now_ms()
 
-data = {
-    'teams': all_teams,
-    'users': all_users
-}
+db = make_dbfacade(Config())
 
-with open(filename, 'wb') as f:
-    pickle.dump(data, f)
+with open_backup(args.filename, 'w') as f:
+    counts = dump(db, f, lambda n: print(f'Dumped {n} items...'), since)
+write_checkpoint(args.checkpoint, started_at)
 
 print('Data written to file `%s`; %d teams and %d users' %
-      (filename, len(all_teams), len(all_users)))
+      (args.filename, counts['Team'], counts['User']))
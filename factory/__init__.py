@@ -1,14 +1,19 @@
 """All necessary class initializations."""
 import random
 import string
+import atexit
 import json
 import logging
+import threading
 
 from app.controller.command import CommandParser
 from app.controller.command.commands.token import TokenCommandConfig
 from datetime import timedelta
 from db import DBFacade
+from db.cache import CachingDBFacade
 from db.dynamodb import DynamoDB
+from db.memory import IndexedMemoryDB
+from db.sqlite import SQLiteDB
 from interface.github import GithubInterface, DefaultGithubFactory
 from interface.slack import Bot
 from interface.gcp import GCPInterface
@@ -22,8 +27,37 @@ from googleapiclient.discovery import build as gcp_build
 from typing import Optional
 
 
+# Database facade shared by everything made in this process
+_dbfacade: Optional[DBFacade] = None
+_dbfacade_lock = threading.Lock()
+
+
 def make_dbfacade(config: Config) -> DBFacade:
-    return DynamoDB(config)
+    """
+    Return the database facade shared by the whole process.
+
+    The facade is only created the first time this is called, and it only
+    connects to the database once it is first used.
+    """
+    global _dbfacade
+    with _dbfacade_lock:
+        if _dbfacade is None:
+            facade: DBFacade
+            if config.db_backend == 'sqlite':
+                facade = SQLiteDB(config)
+            elif config.db_backend == 'memory':
+                memory_db = IndexedMemoryDB(config.memory_snapshot_path)
+                if config.memory_snapshot_path:
+                    atexit.register(memory_db.save_snapshot)
+                facade = memory_db
+            else:
+                facade = DynamoDB(config)
+            if config.db_cache_size > 0:
+                facade = CachingDBFacade(facade,
+                                         config.db_cache_size,
+                                         config.db_cache_ttl)
+            _dbfacade = facade
+        return _dbfacade
 
 
 def make_github_interface(config: Config) -> GithubInterface:
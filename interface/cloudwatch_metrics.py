@@ -1,6 +1,7 @@
 import logging
 import boto3
 from config import Config
+from db.metrics import DBStats
 
 
 class CWMetrics:
@@ -38,3 +39,48 @@ class CWMetrics:
                 }
             ]
         )
+
+    def submit_db_stats(self, cmd_name: str, stats: DBStats):
+        """Submit the totals of the database calls made by a command."""
+        if self.cw is None:
+            for (op, table), s in sorted(stats.ops.items()):
+                logging.info(
+                    f'Database Calls [{cmd_name}@Rocket 2]: {op} on '
+                    f'{table or "-"}: {s.calls} calls, {s.latency_ms} ms, '
+                    f'{s.items} items, {s.capacity_units} capacity units, '
+                    f'{s.throttles} throttles'
+                )
+            return
+
+        metric_data = []
+        for (op, table), s in stats.ops.items():
+            dimensions = [
+                {
+                    'Name': 'Command type',
+                    'Value': cmd_name
+                },
+                {
+                    'Name': 'Operation',
+                    'Value': op
+                },
+                {
+                    'Name': 'Table',
+                    'Value': table or '-'
+                }
+            ]
+            for name, value, unit in [
+                    ('Database Calls', s.calls, 'Count'),
+                    ('Database Latency', s.latency_ms, 'Milliseconds'),
+                    ('Database Items', s.items, 'Count'),
+                    ('Database Consumed Capacity', s.capacity_units,
+                     'Count'),
+                    ('Database Throttles', s.throttles, 'Count')]:
+                metric_data.append({
+                    'MetricName': name,
+                    'Dimensions': dimensions,
+                    'Value': value,
+                    'Unit': unit
+                })
+        if metric_data:
+            self.cw.put_metric_data(Namespace='Rocket 2',
+                                    MetricData=metric_data)
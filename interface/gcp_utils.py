@@ -29,7 +29,8 @@ def sync_user_email_perms(gcp: Optional[GCPInterface],
     if len(user.email) == 0 or len(user.github_id) == 0:
         return
 
-    teams_user_is_in = db.query(Team, [('members', user.github_id)])
+    team_ids = db.get_membership(user.github_id).member_of
+    teams_user_is_in = db.bulk_retrieve(Team, sorted(team_ids))
     for team in teams_user_is_in:
         sync_team_email_perms(gcp, db, team)
 
@@ -1,32 +1,49 @@
 """
-Restores all tables from a pickle file to database.
-
-This is done by inserting them into the database via the db.store function.
-With Amazon DynamoDB, nothing happens when the row inserted is a duplicate
-(i.e. has the same primary key).
-
-Run with pipenv run python restore-db.py
+Restores all tables from files written by dump-db.py.
+
+Items are read one line at a time and inserted into the database in chunks
+via the db.bulk_store function, which makes parallel batch writes. With
+Amazon DynamoDB, nothing happens when the row inserted is a duplicate (i.e.
+has the same primary key). Items keep the ``updated_at`` and ``version``
+they were dumped with. To restore incremental dumps, pass the full dump
+followed by every incremental dump made since, from oldest to newest; the
+items deleted between dumps are deleted again.
+Pickle files written by older versions of dump-db.py (ending in ``.pkl``)
+can still be restored.
+
+Run with pipenv run python restore-db.py [filename ...]
 """
 from config import Config
 from factory import make_dbfacade
+from db.backup import open_backup, read, restore
+import argparse
 import pickle
+import sys
 
-filename = 'db.pkl'
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+parser.add_argument('filenames', nargs='*', default=['db.ndjson.gz'])
+args = parser.parse_args()
 
 db = make_dbfacade(Config())
 
-with open(filename, 'rb') as f:
-    data = pickle.load(f)
-
-    if 'teams' in data and 'users' in data:
-        restored = 0
-
-        for team in data['teams']:
-            restored += 1 if db.store(team) else 0
-        for user in data['users']:
-            restored += 1 if db.store(user) else 0
-
-        print('Restored %d/%d items.' %
-              (restored, len(data['teams']) + len(data['users'])))
+restored, total = 0, 0
+for filename in args.filenames:
+    if filename.endswith('.pkl'):
+        with open(filename, 'rb') as pkl:
+            data = pickle.load(pkl)
+        if 'teams' not in data or 'users' not in data:
+            print('Could not read data; try exporting it again. '
+                  'Missing keys.')
+            sys.exit(1)
+        file_restored, file_total = restore(db,
+                                            data['teams'] + data['users'])
     else:
-        print('Could not read data; try exporting it again. Missing keys.')
+        with open_backup(filename, 'r') as f:
+            file_restored, file_total = restore(
+                db, read(f), lambda n: print(f'Restored {n} items...'))
+    print('Restored %d/%d items from `%s`.' %
+          (file_restored, file_total, filename))
+    restored += file_restored
+    total += file_total
+
+print('Restored %d/%d items.' % (restored, total))
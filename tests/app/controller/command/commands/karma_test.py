@@ -3,7 +3,8 @@ from tests.memorydb import MemoryDB
 from tests.util import create_test_admin
 from flask import Flask
 from app.model import User
-from unittest import TestCase
+from db.facade import VersionConflict
+from unittest import TestCase, mock
 
 
 class KarmaCommandTest(TestCase):
@@ -70,3 +71,10 @@ class KarmaCommandTest(TestCase):
         cmd = 'karma set rando.id 10'
         self.assertEqual(self.testcommand.handle(cmd, self.admin.slack_id),
                          (KarmaCommand.lookup_error, 200))
+
+    @mock.patch('db.utils.time.sleep')
+    def test_handle_set_version_conflict(self, sleep):
+        self.db.store = mock.Mock(side_effect=VersionConflict)
+        cmd = f'karma set {self.u0.slack_id} 10'
+        self.assertEqual(self.testcommand.handle(cmd, self.admin.slack_id),
+                         (KarmaCommand.conflict_error, 200))
@@ -1,6 +1,7 @@
 from app.controller.command.commands import TeamCommand
 from unittest import TestCase, mock
 from app.model import User, Team, Permissions
+from db.facade import VersionConflict
 from tests.memorydb import MemoryDB
 from tests.util import create_test_admin
 from interface.exceptions.github import GithubAPIException
@@ -200,7 +201,6 @@ class TestTeamCommand(TestCase):
                               (self.cmd.lookup_error, 200))
 
     def test_handle_add(self):
-        self.t0.github_team_id = 'githubid'
         self.u0.github_username = 'myuser'
         self.u0.github_id = 'otherID'
         with self.app.app_context():
@@ -211,7 +211,7 @@ class TestTeamCommand(TestCase):
                       'text': 'Added User to brs'}
             self.assertDictEqual(resp, expect)
         self.assertTrue(self.t0.has_member("otherID"))
-        self.gh.add_team_member.assert_called_once_with('myuser', 'githubid')
+        self.gh.add_team_member.assert_called_once_with('myuser', 'BRS')
 
     def test_handle_add_but_forgot_githubid(self):
         self.t0.github_team_id = 'githubid'
@@ -246,7 +246,6 @@ class TestTeamCommand(TestCase):
     def test_handle_add_promote(self):
         self.u0.github_username = 'myuser'
         self.u0.github_id = 'otherID'
-        self.t2.github_team_id = 'githubid'
         with self.app.app_context():
             resp, _ = self.cmd.handle(
                 f'team add leads {self.u0.slack_id}',
@@ -257,12 +256,11 @@ class TestTeamCommand(TestCase):
             self.assertDictEqual(resp, expect)
         self.assertTrue(self.t2.has_member('otherID'))
         self.assertEqual(self.u0.permissions_level, Permissions.team_lead)
-        self.gh.add_team_member.assert_called_once_with('myuser', 'githubid')
+        self.gh.add_team_member.assert_called_once_with('myuser', 'LEADS')
 
     def test_handle_add_promote_current_admin(self):
         self.u0.github_username = 'myuser'
         self.u0.github_id = 'otherID'
-        self.t2.github_team_id = 'githubid'
         # existing admin member should not be "promoted" to lead
         self.u0.permissions_level = Permissions.admin
         self.t3.add_member(self.u0.github_id)
@@ -276,7 +274,7 @@ class TestTeamCommand(TestCase):
             self.assertDictEqual(resp, expect)
         self.assertTrue(self.t2.has_member('otherID'))
         self.assertEqual(self.u0.permissions_level, Permissions.admin)
-        self.gh.add_team_member.assert_called_once_with('myuser', 'githubid')
+        self.gh.add_team_member.assert_called_once_with('myuser', 'LEADS')
 
     def test_handle_remove(self):
         self.u0.github_id = 'githubID'
@@ -448,6 +446,14 @@ class TestTeamCommand(TestCase):
             self.assertEqual(self.t0.displayname, 'brS')
             self.assertEqual(self.t0.platform, 'web')
 
+    @mock.patch('db.utils.time.sleep')
+    def test_handle_edit_version_conflict(self, sleep):
+        self.db.store = mock.Mock(side_effect=VersionConflict)
+        cmdtxt = f'team edit {self.t0.github_team_name} --platform web'
+        with self.app.app_context():
+            self.assertTupleEqual(self.cmd.handle(cmdtxt, self.admin.slack_id),
+                                  (self.cmd.conflict_error, 200))
+
     def test_handle_edit_not_admin(self):
         cmdtxt = f'team edit {self.t0.github_team_name}'
         with self.app.app_context():
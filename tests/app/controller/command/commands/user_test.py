@@ -1,4 +1,5 @@
 from app.controller.command.commands import UserCommand
+from db.facade import VersionConflict
 from tests.memorydb import MemoryDB
 from tests.util import create_test_admin
 from flask import Flask
@@ -171,6 +172,15 @@ class TestUserCommand(TestCase):
             expect = {'title': 'Name', 'value': 'rob', 'short': True}
             self.assertIn(expect, resp['attachments'][0]['fields'])
 
+    @mock.patch('db.utils.time.sleep')
+    def test_handle_edit_version_conflict(self, sleep):
+        self.db.store = mock.Mock(side_effect=VersionConflict)
+        with self.app.app_context():
+            self.assertEqual(
+                self.testcommand.handle('user edit --name rob',
+                                        self.u0.slack_id),
+                (UserCommand.conflict_error, 200))
+
     def test_handle_edit_github(self):
         """Test that editing github username sends request to interface."""
         self.mock_github.org_add_member.return_value = "123"
@@ -242,6 +252,18 @@ class TestUserCommand(TestCase):
                       'short': True}
             self.assertIn(expect, resp['attachments'][0]['fields'])
 
+    def test_handle_edit_retrieves_once(self):
+        self.db.retrieve = mock.Mock(wraps=self.db.retrieve)
+        with self.app.app_context():
+            self.testcommand.handle(
+                f"user edit --username {self.u0.slack_id} --name rob",
+                self.admin.slack_id)
+        self.assertEqual(self.db.retrieve.call_args_list,
+                         [mock.call(User, self.admin.slack_id),
+                          mock.call(User, self.u0.slack_id)])
+        self.assertEqual(self.db.retrieve(User, self.u0.slack_id).name,
+                         'rob')
+
     def test_handle_edit_make_self_admin_no_perms(self):
         with self.app.app_context():
             resp, _ = self.testcommand.handle(
@@ -67,6 +67,11 @@ class TestParser(TestCase):
         self.metrics.submit_cmd_mstime.assert_called_once_with(
             'i-quit', mock.ANY)
 
+    def test_handle_cmd_submits_db_stats(self):
+        self.parser.handle_app_command('i-quit', 'UFJ43EU67', '')
+        self.metrics.submit_db_stats.assert_called_once_with(
+            'i-quit', mock.ANY)
+
     @mock.patch('requests.post')
     def test_handle_make_post_req(self, post):
         self.parser.handle_app_command('i-quit', 'UFJ43EU67',
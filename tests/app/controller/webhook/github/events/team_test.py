@@ -1,5 +1,6 @@
 """test the handler for GitHub team events."""
 from app.model import Team
+from db.facade import VersionConflict
 from unittest import mock, TestCase
 from app.controller.webhook.github.events import TeamEventHandler
 from tests.memorydb import MemoryDB
@@ -203,6 +204,15 @@ class TestTeamHandles(TestCase):
 
         self.assertEqual(self.t.github_team_name, self.newteam)
 
+    @mock.patch('db.utils.time.sleep')
+    def test_handle_team_event_create_version_conflict(self, sleep):
+        self.db.teams = {str(self.newteamid): self.t}
+        self.db.store = mock.Mock(side_effect=VersionConflict)
+        rsp, code = self.webhook_handler.handle(self.created_payload)
+        self.assertEqual(rsp,
+                         f'team with github id {self.newteamid} kept changing')
+        self.assertEqual(code, 200)
+
     def test_handle_team_event_delete_team(self):
         rsp, code = self.webhook_handler.handle(self.deleted_payload)
         self.assertEqual(rsp, f'deleted team with github id {self.teamid}')
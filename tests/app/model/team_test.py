@@ -1,5 +1,8 @@
 from app.model import Team
+from boto3.dynamodb.types import Binary
+from app.model.team import pack_ids, read_ids, unpack_ids
 from unittest import TestCase
+import pickle
 
 
 class TestTeamModel(TestCase):
@@ -14,6 +17,70 @@ class TestTeamModel(TestCase):
         self.assertEqual(self.brussel_sprouts, self.brussel_sprouts_copy)
         self.assertNotEqual(self.brussel_sprouts, self.brussel_trouts)
 
+    def test_team_hash(self):
+        """Test that equal teams deduplicate in sets."""
+        self.brussel_sprouts.members = {'a', 'b', 'c'}
+        self.brussel_sprouts_copy.members = {'c', 'b', 'a'}
+        self.brussel_sprouts_copy.version = 2
+        self.assertEqual(self.brussel_sprouts, self.brussel_sprouts_copy)
+        self.assertEqual(len({self.brussel_sprouts, self.brussel_sprouts_copy,
+                              self.brussel_trouts}), 2)
+        self.brussel_sprouts_copy.team_leads = {'a'}
+        self.assertNotEqual(self.brussel_sprouts, self.brussel_sprouts_copy)
+
+    def test_dict_round_trip(self):
+        """Test the Team class methods to_dict() and from_dict()."""
+        self.brussel_sprouts.members = {'a', 'b'}
+        self.brussel_sprouts.team_leads = {'a'}
+        d = Team.to_dict(self.brussel_sprouts)
+        self.assertNotIn('folder', d)
+        team = Team.from_dict(d)
+        self.assertEqual(str(team), str(self.brussel_sprouts))
+        team.members.add('c')
+        self.assertEqual(self.brussel_sprouts.members, {'a', 'b'})
+
+    def test_pack_ids(self):
+        """Test packing Github IDs into delta-encoded varints."""
+        ids = {'0', '127', '128', '300', '16384', '98765432109876'}
+        packed = pack_ids(ids)
+        self.assertEqual(packed[:6], bytes([1, 0, 127, 1, 0xac, 0x01]))
+        self.assertEqual(unpack_ids(packed), ids)
+        self.assertEqual(unpack_ids(pack_ids([])), set())
+        self.assertIsNone(pack_ids(['123', 'abc']))
+        self.assertIsNone(pack_ids(['0123']))
+        self.assertIsNone(pack_ids(['']))
+        with self.assertRaises(ValueError):
+            unpack_ids(b'\x02\x01')
+        self.assertEqual(read_ids(bytearray(packed)), ids)
+        self.assertEqual(read_ids(Binary(packed)), ids)
+        self.assertEqual(read_ids(['1', '2']), {'1', '2'})
+
+    def test_packed_dict(self):
+        """Test converting teams to dicts with packed IDs and back."""
+        self.brussel_sprouts.members = {'1', '20', '300'}
+        self.brussel_sprouts.team_leads = {'lead'}
+        d = Team.to_dict(self.brussel_sprouts, packed=True)
+        self.assertEqual(d['members'], bytes([1, 1, 19, 0x98, 0x02]))
+        self.assertEqual(d['team_leads'], {'lead'})
+        self.assertEqual(Team.from_dict(d), self.brussel_sprouts)
+        self.assertEqual(Team.to_dict(self.brussel_sprouts)['members'],
+                         {'1', '20', '300'})
+
+    def test_pickle(self):
+        """Test pickling teams, and unpickling older teams."""
+        self.brussel_sprouts.members = {'a'}
+        self.assertFalse(hasattr(self.brussel_sprouts, '__dict__'))
+        team = pickle.loads(pickle.dumps(self.brussel_sprouts))
+        self.assertEqual(str(team), str(self.brussel_sprouts))
+
+        old = Team.__new__(Team)
+        old.__setstate__({'github_team_id': '1',
+                          'github_team_name': 'brussel-sprouts',
+                          'displayname': 'Brussel Sprouts',
+                          'members': {'a'}})
+        self.assertEqual(old.members, {'a'})
+        self.assertEqual(old.updated_at, 0)
+
     def test_valid_team(self):
         """Test the Team static class method is_valid()."""
         self.assertTrue(Team.is_valid(self.brussel_sprouts))
@@ -65,5 +132,7 @@ class TestTeamModel(TestCase):
             " 'platform': 'web'," \
             " 'team_leads': {'U0G9QF9C6'}," \
             " 'members': {'U0G9QF9C6'}," \
-            " 'folder': ''}"
+            " 'folder': ''," \
+            " 'updated_at': 0," \
+            " 'version': 0}"
         self.assertEqual(str(self.brussel_sprouts), expected)
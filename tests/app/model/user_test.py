@@ -1,6 +1,7 @@
 """Test the data model for a user."""
 from app.model import User, Permissions
 from unittest import TestCase
+import pickle
 
 
 class TestUserModel(TestCase):
@@ -23,6 +24,40 @@ class TestUserModel(TestCase):
         self.assertEqual(self.brussel_sprouts, self.brussel_sprouts2)
         self.assertNotEqual(self.brussel_sprouts2, self.brussel_trouts)
 
+    def test_user_hash(self):
+        """Test that equal users deduplicate in sets."""
+        self.brussel_sprouts2.updated_at = 10
+        self.brussel_sprouts2.version = 2
+        self.assertEqual(len({self.brussel_sprouts, self.brussel_sprouts2,
+                              self.brussel_trouts}), 2)
+
+    def test_slots(self):
+        """Test that users don't carry a __dict__."""
+        self.assertFalse(hasattr(self.admin, '__dict__'))
+        with self.assertRaises(AttributeError):
+            self.admin.nickname = 'sprouts'
+
+    def test_dict_round_trip(self):
+        """Test the User class methods to_dict() and from_dict()."""
+        self.admin.karma = 5
+        self.admin.version = 3
+        d = User.to_dict(self.admin)
+        self.assertNotIn('name', d)
+        user = User.from_dict(d)
+        self.assertEqual(str(user), str(self.admin))
+        self.assertEqual(str(User.from_dict({'slack_id': 'U0G9QF9C6'})),
+                         str(User('U0G9QF9C6')))
+
+    def test_pickle(self):
+        """Test pickling users, and unpickling older users."""
+        user = pickle.loads(pickle.dumps(self.admin))
+        self.assertEqual(str(user), str(self.admin))
+
+        old = User.__new__(User)
+        old.__setstate__({'slack_id': 'U0G9QF9C6', 'karma': 5})
+        self.assertEqual(old.karma, 5)
+        self.assertEqual(old.version, 0)
+
     def test_valid_user(self):
         """Test the User static class method is_valid()."""
         self.assertFalse(User.is_valid(self.no_id))
@@ -40,5 +75,7 @@ class TestUserModel(TestCase):
             " 'biography': 'bio test'," \
             " 'image_url': ''," \
             " 'permissions_level': <Permissions.admin: 3>,"\
-            " 'karma': 1}"
+            " 'karma': 1," \
+            " 'updated_at': 0," \
+            " 'version': 0}"
         self.assertEqual(str(self.admin), expected)
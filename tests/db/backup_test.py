@@ -0,0 +1,143 @@
+"""Test streaming backups."""
+import io
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase, mock
+from app.model import User, Team
+from db.backup import Deletion, decode, dump, encode, encode_deletion, \
+    open_backup, read, read_checkpoint, restore, write_checkpoint
+from tests.memorydb import MemoryDB
+from tests.util import create_test_admin, create_test_team
+
+
+class TestBackup(TestCase):
+    def setUp(self):
+        self.users = [create_test_admin(f'U{i}') for i in range(3)]
+        self.team = create_test_team('T1', 'brussel-sprouts', 'Sprouts')
+        self.team.members = {'b', 'a'}
+        self.db = MemoryDB(users=self.users, teams=[self.team])
+
+    def test_encode_decode(self):
+        line = encode(self.team)
+        self.assertNotIn('\n', line)
+        self.assertIn('"members":["a","b"]', line)
+        team = decode(line)
+        self.assertEqual(team.github_team_id, 'T1')
+        self.assertEqual(team.members, {'a', 'b'})
+        self.assertEqual(decode(encode(self.users[0])), self.users[0])
+
+    def test_decode_unknown_model(self):
+        with self.assertRaises(LookupError):
+            decode('{"type": "Project", "item": {}}')
+
+    def test_dump_and_restore(self):
+        f = io.StringIO()
+        progress = mock.Mock()
+        counts = dump(self.db, f, progress)
+        self.assertEqual(counts, {'User': 3, 'Team': 1})
+        progress.assert_called_with(4)
+
+        f.seek(0)
+        restored_db = MemoryDB()
+        self.assertEqual(restore(restored_db, read(f)), (4, 4))
+        self.assertEqual(restored_db.retrieve(User, 'U2'), self.users[2])
+        self.assertEqual(restored_db.retrieve(Team, 'T1').members,
+                         {'a', 'b'})
+
+    @mock.patch('db.backup.CHUNK_SIZE', 2)
+    def test_restore_in_chunks(self):
+        restored_db = mock.Mock()
+        restored_db.bulk_store.side_effect = lambda objs, **kwargs: len(objs)
+        progress = mock.Mock()
+        self.assertEqual(restore(restored_db, iter(self.users), progress),
+                         (3, 3))
+        self.assertEqual(restored_db.bulk_store.call_count, 2)
+        progress.assert_has_calls([mock.call(2), mock.call(3)])
+
+    def test_dump_delta(self):
+        self.users[0].updated_at = 100
+        self.users[1].updated_at = 200
+        self.users[2].updated_at = 300
+        self.team.updated_at = 50
+        f = io.StringIO()
+        self.assertEqual(dump(self.db, f, since=200), {'User': 2, 'Team': 0})
+        f.seek(0)
+        self.assertEqual({u.slack_id for u in read(f)}, {'U1', 'U2'})
+
+    def test_dump_delta_deletions(self):
+        self.db.delete(User, 'U1')
+        self.db.deletions[User]['U2'] = 10
+        f = io.StringIO()
+        dump(self.db, f, since=100)
+        self.assertEqual(f.getvalue().splitlines()[0],
+                         '{"deleted":"U1","type":"User"}')
+        f.seek(0)
+        self.assertEqual([x for x in read(f) if isinstance(x, Deletion)],
+                         [Deletion(User, 'U1')])
+
+    def test_encode_decode_deletion(self):
+        deletion = Deletion(Team, 'T1')
+        self.assertEqual(decode(encode_deletion(deletion)), deletion)
+
+    def test_restore_applies_deletions_in_order(self):
+        restored_db = MemoryDB(users=[create_test_admin('U0')])
+        entries = [Deletion(User, 'U0'), self.users[1],
+                   Deletion(User, 'U1'), self.users[0]]
+        self.assertEqual(restore(restored_db, entries), (4, 4))
+        self.assertEqual(sorted(u.slack_id for u in restored_db.query(User)),
+                         ['U0'])
+
+    def test_restore_keeps_stamps(self):
+        self.users[0].updated_at = 100
+        self.users[0].version = 7
+        restored_db = MemoryDB()
+        restore(restored_db, [self.users[0]])
+        u = restored_db.retrieve(User, 'U0')
+        self.assertEqual((u.updated_at, u.version), (100, 7))
+
+    def test_restore_chain(self):
+        base, delta = io.StringIO(), io.StringIO()
+        dump(self.db, base)
+        self.users[0].name = 'Renamed'
+        self.db.store(self.users[0])
+        self.db.delete(User, 'U2')
+        dump(self.db, delta, since=self.users[0].updated_at)
+        base.seek(0)
+        delta.seek(0)
+
+        restored_db = MemoryDB()
+        restore(restored_db, read(base))
+        restore(restored_db, read(delta))
+        self.assertEqual(restored_db.retrieve(User, 'U0').name, 'Renamed')
+        self.assertEqual(sorted(u.slack_id for u in restored_db.query(User)),
+                         ['U0', 'U1'])
+
+    def test_checkpoint(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp, 'db.checkpoint')
+            with self.assertRaises(FileNotFoundError):
+                read_checkpoint(filename)
+            write_checkpoint(filename, 1234)
+            self.assertEqual(read_checkpoint(filename), 1234)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_read_skips_blank_lines(self):
+        f = io.StringIO(encode(self.users[0]) + '\n\n')
+        self.assertEqual(list(read(f)), [self.users[0]])
+
+    def test_gzip(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp, 'db.ndjson.gz')
+            with open_backup(filename, 'w') as f:
+                dump(self.db, f)
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(2), b'\x1f\x8b')
+            with open_backup(filename, 'r') as f:
+                self.assertEqual(len(list(read(f))), 4)
+        finally:
+            shutil.rmtree(tmp)
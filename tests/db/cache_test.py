@@ -0,0 +1,242 @@
+"""Test the caching database facade."""
+from unittest import TestCase
+from unittest.mock import MagicMock
+from app.model import User, Team
+from db.facade import VersionConflict
+from db.cache import CachingDBFacade, LRUCache, matches, QUERY_AND, \
+    QUERY_OR, QUERY_IN
+from tests.memorydb import MemoryDB
+from tests.util import create_test_admin, create_test_team
+
+
+class TestLRUCache(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.cache = LRUCache(2, 10, clock=lambda: self.now)
+
+    def test_get_missing(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_put_get(self):
+        self.cache.put('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.get('a')
+        self.cache.put('c', 3)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), 3)
+
+    def test_expires(self):
+        self.cache.put('a', 1)
+        self.now = 11
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_pop_if(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.pop_if(lambda k, v: v > 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+
+
+class TestMatches(TestCase):
+    def setUp(self):
+        self.team = Team.to_dict(create_test_team('1', 'rocket', 'Rocket'))
+
+    def test_matches_and(self):
+        self.assertTrue(matches(self.team, QUERY_AND,
+                                [('members', 'abc_123'),
+                                 ('platform', 'slack')]))
+        self.assertFalse(matches(self.team, QUERY_AND,
+                                 [('members', 'abc_123'),
+                                  ('platform', 'ios')]))
+        self.assertTrue(matches(self.team, QUERY_AND, []))
+
+    def test_matches_or(self):
+        self.assertTrue(matches(self.team, QUERY_OR,
+                                [('team_leads', 'abc_123'),
+                                 ('github_team_name', 'rocket')]))
+        self.assertFalse(matches(self.team, QUERY_OR,
+                                 [('team_leads', 'abc_123')]))
+        self.assertTrue(matches(self.team, QUERY_OR, []))
+
+    def test_matches_in(self):
+        self.assertFalse(matches(self.team, QUERY_IN, []))
+        self.assertTrue(matches(self.team, QUERY_IN,
+                                [('github_team_id', '2'),
+                                 ('github_team_id', '1')]))
+
+
+class TestCachingDBFacade(TestCase):
+    def setUp(self):
+        self.admin = create_test_admin('Uadmin')
+        self.u0 = User('U0')
+        self.u0.github_id = '100'
+        self.t0 = create_test_team('T0', 'rocket', 'Rocket')
+        self.t0.add_member('100')
+        self.mem = MemoryDB(users=[self.admin, self.u0], teams=[self.t0])
+        self.db = MagicMock(wraps=self.mem)
+        self.cache = CachingDBFacade(self.db, maxsize=16, ttl=60)
+
+    def test_retrieve_cached(self):
+        u = self.cache.retrieve(User, 'U0')
+        self.assertEqual(self.cache.retrieve(User, 'U0'), u)
+        self.db.retrieve.assert_called_once_with(User, 'U0')
+        self.assertEqual(self.cache.stats()['User'],
+                         {'hits': 1, 'misses': 1})
+
+    def test_retrieve_returns_copies(self):
+        u = self.cache.retrieve(User, 'U0')
+        u.name = 'changed'
+        self.assertEqual(self.cache.retrieve(User, 'U0').name, '')
+
+    def test_retrieve_not_found(self):
+        with self.assertRaises(LookupError):
+            self.cache.retrieve(User, 'missing')
+        with self.assertRaises(LookupError):
+            self.cache.retrieve(User, 'missing')
+        self.assertEqual(self.db.retrieve.call_count, 2)
+
+    def test_store_invalidates_retrieve(self):
+        u = self.cache.retrieve(User, 'U0')
+        u.name = 'Steve'
+        self.assertTrue(self.cache.store(u))
+        self.assertEqual(self.cache.retrieve(User, 'U0').name, 'Steve')
+        self.assertEqual(self.db.retrieve.call_count, 2)
+
+    def test_version_conflict_invalidates_retrieve(self):
+        u = self.cache.retrieve(User, 'U0')
+        self.db.store.side_effect = VersionConflict
+        with self.assertRaises(VersionConflict):
+            self.cache.store(u)
+        self.cache.retrieve(User, 'U0')
+        self.assertEqual(self.db.retrieve.call_count, 2)
+
+    def test_bulk_retrieve_fetches_misses(self):
+        self.cache.retrieve(User, 'U0')
+        users = self.cache.bulk_retrieve(User, ['Uadmin', 'U0', 'nope'])
+        self.assertEqual(users, [self.admin, self.u0])
+        self.db.bulk_retrieve.assert_called_once_with(User,
+                                                      ['Uadmin', 'nope'])
+        self.cache.bulk_retrieve(User, ['Uadmin', 'U0'])
+        self.db.bulk_retrieve.assert_called_once()
+
+    def test_query_cached(self):
+        params = [('permission_level', 'admin')]
+        self.assertEqual(self.cache.query(User, params), [self.admin])
+        self.assertEqual(self.cache.query(User, list(reversed(params))),
+                         [self.admin])
+        self.db.query.assert_called_once()
+
+    def test_store_invalidates_matching_query(self):
+        params = [('permission_level', 'admin')]
+        self.cache.query(User, params)
+        other_query = self.cache.query(User, [('github_user_id', '100')])
+        admin = create_test_admin('Uadmin2')
+        self.cache.store(admin)
+
+        self.assertCountEqual(self.cache.query(User, params),
+                              [self.admin, admin])
+        self.assertEqual(self.cache.query(User, [('github_user_id', '100')]),
+                         other_query)
+        self.assertEqual(self.db.query.call_count, 3)
+
+    def test_store_invalidates_query_containing_obj(self):
+        self.cache.query_in(User, 'github_user_id', ['100'])
+        u = self.cache.retrieve(User, 'U0')
+        u.github_id = '200'
+        self.cache.store(u)
+        self.assertEqual(self.cache.query_in(User, 'github_user_id', ['100']),
+                         [])
+        self.assertEqual(self.db.query_in.call_count, 2)
+
+    def test_delete_invalidates(self):
+        self.assertEqual([t.github_team_id for t in
+                          self.cache.query_or(Team, [('members', '100')])],
+                         ['T0'])
+        self.cache.retrieve(Team, 'T0')
+        self.cache.delete(Team, 'T0')
+        self.assertEqual(self.cache.query_or(Team, [('members', '100')]), [])
+        with self.assertRaises(LookupError):
+            self.cache.retrieve(Team, 'T0')
+
+    def test_bulk_store_invalidates(self):
+        self.cache.query(User)
+        self.cache.retrieve(User, 'U0')
+        u = User('U0')
+        u.name = 'Steve'
+        self.assertEqual(self.cache.bulk_store(iter([u, User('U1')])), 2)
+        self.assertEqual(len(self.cache.query(User)), 3)
+        self.assertEqual(self.cache.retrieve(User, 'U0').name, 'Steve')
+
+    def test_bulk_delete_invalidates(self):
+        self.cache.query(User)
+        self.cache.retrieve(User, 'U0')
+        self.cache.bulk_delete(User, ['U0'])
+        self.assertEqual(self.cache.query(User), [self.admin])
+        with self.assertRaises(LookupError):
+            self.cache.retrieve(User, 'U0')
+
+    def test_retrieve_projection(self):
+        partial = self.cache.retrieve(User, 'U0', attributes=['github'])
+        self.assertEqual(partial.github_id, '')
+        self.db.retrieve.assert_called_once_with(User, 'U0', ['github'])
+        self.cache.retrieve(User, 'U0')
+        partial = self.cache.retrieve(User, 'U0',
+                                      attributes=['github_user_id'])
+        self.assertEqual(partial.github_id, '100')
+        self.assertEqual(self.db.retrieve.call_count, 2)
+
+    def test_query_projection_cached_separately(self):
+        self.assertEqual(self.cache.query(User, attributes=['email'])[0].name,
+                         '')
+        self.cache.query(User, attributes=['email', 'slack_id'])
+        self.cache.query(User)
+        self.assertEqual(self.db.query.call_count, 2)
+
+    def test_increment_invalidates(self):
+        self.cache.query(User)
+        self.assertEqual(self.cache.retrieve(User, 'U0').karma, 1)
+        self.assertEqual(self.cache.increment(User, 'U0', 'karma', 2).karma,
+                         3)
+        self.assertEqual(self.cache.retrieve(User, 'U0').karma, 3)
+        self.cache.query(User)
+        self.assertEqual(self.db.query.call_count, 2)
+
+    def test_update_set_invalidates(self):
+        self.cache.query(Team, [('members', '200')])
+        self.cache.query(Team, [('platform', 'ios')])
+        self.cache.retrieve(Team, 'T0')
+        self.cache.update_set(Team, 'T0', 'members', add=['200'])
+        self.assertEqual([t.github_team_id for t in
+                          self.cache.query(Team, [('members', '200')])],
+                         ['T0'])
+        self.assertEqual(self.cache.retrieve(Team, 'T0').members,
+                         {'abc_123', '100', '200'})
+        self.cache.query(Team, [('platform', 'ios')])
+        self.assertEqual(self.db.query.call_count, 3)
+
+    def test_iter_query_uses_cached_results(self):
+        self.assertEqual(list(self.cache.iter_query(User)),
+                         list(self.cache.query(User)))
+        self.cache.iter_query(User)
+        self.db.iter_query.assert_called_once()
+
+    def test_iter_query_or_passes_through(self):
+        self.assertEqual(list(self.cache.iter_query_or(Team)), [self.t0])
+        self.assertEqual(list(self.cache.iter_query_or(Team)), [self.t0])
+        self.assertEqual(self.db.iter_query_or.call_count, 2)
+
+    def test_changes_pass_through(self):
+        self.cache.delete(User, 'U0')
+        self.assertEqual(list(self.cache.iter_changes(Team, 0)), [self.t0])
+        self.assertEqual(list(self.cache.iter_deletions(User, 0)), ['U0'])
+        self.db.iter_changes.assert_called_once_with(Team, 0)
+        self.db.iter_deletions.assert_called_once_with(User, 0)
@@ -1,13 +1,20 @@
 """Test the dynamodb interface (requires dynamodb running)."""
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 import boto3
+from botocore.exceptions import ClientError
 
 from app.model import User, Team, Permissions
+from app.model.team import read_ids
 from config import Config
 from tests.util import create_test_team, create_test_admin
-from db.dynamodb import DynamoDB
+from db.dynamodb import DynamoDB, backoff_delay, updated_day
+from db.facade import VersionConflict
+from db.membership import Membership
+from db.metrics import record_db_calls
+from db.utils import now_ms, update_with_retry
 
 
 class TestDDBConstants(TestCase):
@@ -18,6 +25,9 @@ class TestDDBConstants(TestCase):
         self.config = MagicMock(Config)
         self.config.aws_users_tablename = 'users'
         self.config.aws_teams_tablename = 'teams'
+        self.config.aws_memberships_tablename = ''
+        self.config.aws_deletions_tablename = ''
+        self.config.db_pack_members = False
         self.const = DynamoDB.Const(self.config)
 
     def test_get_bad_table_name(self):
@@ -35,14 +45,43 @@ class TestDDBConstants(TestCase):
         with self.assertRaises(TypeError):
             self.const.get_set_attrs('non-existent-table-name')
 
+    def test_get_bad_indexes(self):
+        """Test getting indexes of a non-existent table."""
+        with self.assertRaises(TypeError):
+            self.const.get_indexes('non-existent-table-name')
+
+    def test_get_bad_local_indexes(self):
+        """Test getting local indexes of a non-existent table."""
+        with self.assertRaises(TypeError):
+            self.const.get_local_indexes('non-existent-table-name')
+
+
+class TestBackoffDelay(TestCase):
+    def test_backoff_delay_bounds(self):
+        for attempt in range(1, 20):
+            delay = backoff_delay(attempt, base=0.1, cap=2.0)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(2.0, 0.1 * 2 ** attempt))
+
 
 class TestDynamoDB(TestCase):
     def setUp(self):
         self.config = MagicMock(Config)
         self.config.aws_users_tablename = 'users_test'
         self.config.aws_teams_tablename = 'teams_test'
+        self.config.aws_memberships_tablename = ''
+        self.config.aws_deletions_tablename = 'deletions_test'
         self.config.aws_local = True
+        self.config.db_scan_segments = 0
+        self.config.db_max_connections = 10
+        self.config.db_max_retries = 2
+        self.config.db_billing_mode = 'PROVISIONED'
+        self.config.db_read_capacity = 1
+        self.config.db_write_capacity = 1
+        self.config.db_pack_members = False
         self.ddb = DynamoDB(self.config)
+        # Rate limits are checked, but not waited for
+        self.ddb.limiter.sleep = MagicMock()
 
     def tearDown(self):
         """Delete all database tables after usage."""
@@ -55,6 +94,20 @@ class TestDynamoDB(TestCase):
         for table in botodb.tables.all():
             table.delete()
 
+    @pytest.mark.db
+    def test_resource_per_thread(self):
+        resource = self.ddb.ddb
+        self.assertIs(self.ddb.ddb, resource)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            other = pool.submit(lambda: self.ddb.ddb).result()
+        self.assertIsNot(other, resource)
+        self.assertIs(other.meta.client, resource.meta.client)
+
+        config = resource.meta.client.meta.config
+        self.assertEqual(config.max_pool_connections, 10)
+        # botocore counts the first attempt too
+        self.assertEqual(config.retries['total_max_attempts'], 3)
+
     @pytest.mark.db
     def test_store_invalid_type(self):
         """Test that we cannot store an object that isn't one of the types."""
@@ -93,6 +146,25 @@ class TestDynamoDB(TestCase):
         self.assertTrue(success)
         self.assertEqual(user, another_user)
 
+    @pytest.mark.db
+    def test_record_db_calls(self):
+        self.ddb.store(create_test_admin('abc_123'))
+        self.ddb.store(create_test_admin('abc_456'))
+        with record_db_calls() as stats:
+            self.ddb.retrieve(User, 'abc_123')
+            self.assertEqual(len(self.ddb.query(User)), 2)
+            self.ddb.increment(User, 'abc_123', 'karma')
+
+        self.assertEqual(set(stats.ops), {('retrieve', 'users_test'),
+                                          ('query', 'users_test'),
+                                          ('increment', 'users_test')})
+        query = stats.ops[('query', 'users_test')]
+        self.assertEqual(query.calls, 1)
+        self.assertEqual(query.items, 2)
+        self.assertGreater(query.capacity_units, 0)
+        self.assertGreater(stats.ops[('retrieve', 'users_test')]
+                           .capacity_units, 0)
+
     @pytest.mark.db
     def test_retrieve_invalid_user(self):
         """Test to see if we can retrieve a non-existant user."""
@@ -112,6 +184,342 @@ class TestDynamoDB(TestCase):
         self.assertEqual(user, all_users[0])
         self.assertEqual(user, strict_users[0])
 
+    @pytest.mark.db
+    def test_retrieve_projection(self):
+        user = create_test_admin('abc_123')
+        self.assertTrue(self.ddb.store(user))
+        partial = self.ddb.retrieve(User, 'abc_123',
+                                    attributes=['name', 'email'])
+        self.assertEqual(partial.slack_id, 'abc_123')
+        self.assertEqual(partial.name, user.name)
+        self.assertEqual(partial.email, user.email)
+        self.assertEqual(partial.github_username, '')
+        self.assertEqual(partial.karma, 1)
+
+    @pytest.mark.db
+    def test_query_projection(self):
+        user = create_test_admin('abc_123')
+        user.karma = 5
+        self.assertTrue(self.ddb.store(user))
+
+        users = self.ddb.query(User, [('permission_level', 'admin')],
+                               attributes=['email', 'karma'])
+        self.assertEqual(len(users), 1)
+        self.assertEqual(users[0].slack_id, 'abc_123')
+        self.assertEqual(users[0].email, user.email)
+        self.assertEqual(users[0].karma, 5)
+        self.assertEqual(users[0].name, '')
+
+        by_index = self.ddb.query(User,
+                                  [('github_user_id', user.github_id)],
+                                  attributes=['github'])
+        self.assertEqual(by_index[0].github_username, user.github_username)
+        self.assertEqual(by_index[0].email, '')
+
+    @pytest.mark.db
+    def test_query_or_projection(self):
+        team = create_test_team('1', 'brussel-sprouts', 'Brussel Sprouts')
+        team.add_member('abc_123')
+        self.assertTrue(self.ddb.store(team))
+
+        teams = self.ddb.query_or(Team, [('members', 'abc_123'),
+                                         ('platform', 'ios')],
+                                  attributes=['members'])
+        self.assertEqual(len(teams), 1)
+        self.assertEqual(teams[0].github_team_name, 'brussel-sprouts')
+        self.assertEqual(teams[0].members, team.members)
+        self.assertEqual(teams[0].displayname, '')
+
+        self.ddb.scan_segments = 2
+        all_teams = list(self.ddb.iter_query_or(Team,
+                                                attributes=['platform']))
+        self.assertEqual(all_teams[0].platform, team.platform)
+        self.assertEqual(all_teams[0].members, set())
+
+    @pytest.mark.db
+    def test_increment_user_karma(self):
+        user = create_test_admin('abc_123')
+        user.karma = 5
+        self.assertTrue(self.ddb.store(user))
+
+        updated = self.ddb.increment(User, 'abc_123', 'karma', 2)
+        self.assertEqual(updated.karma, 7)
+        self.assertEqual(updated.name, user.name)
+        updated = self.ddb.increment(User, 'abc_123', 'karma', -10)
+        self.assertEqual(updated.karma, -3)
+        self.assertEqual(self.ddb.retrieve(User, 'abc_123').karma, -3)
+
+    @pytest.mark.db
+    def test_writes_stamp_updated_at(self):
+        user = create_test_admin('abc_123')
+        with patch('db.utils.now_ms', return_value=10):
+            self.ddb.store(user)
+        self.assertEqual(user.updated_at, 10)
+        self.assertEqual(self.ddb.retrieve(User, 'abc_123').updated_at, 10)
+        with patch('db.dynamodb.now_ms', return_value=20):
+            updated = self.ddb.increment(User, 'abc_123', 'karma')
+        self.assertEqual(updated.updated_at, 20)
+
+        team = create_test_team('1', 'brussel-sprouts', 'Brussel Sprouts')
+        self.ddb.bulk_store([team])
+        self.assertGreater(team.updated_at, 0)
+        with patch('db.dynamodb.now_ms', return_value=30):
+            self.ddb.update_set(Team, '1', 'members', add=['abc'])
+        self.assertEqual(self.ddb.retrieve(Team, '1').updated_at, 30)
+
+    @pytest.mark.db
+    def test_iter_changes(self):
+        now = now_ms()
+        day = 24 * 60 * 60 * 1000
+        old, new = create_test_admin('1'), create_test_admin('2')
+        team = create_test_team('1', 'brussel-sprouts', 'Brussel Sprouts')
+        with patch('db.utils.now_ms', return_value=now - 3 * day):
+            self.ddb.store(old)
+        self.ddb.bulk_store([new, team])
+        item = self.ddb.ddb.Table('users_test') \
+            .get_item(Key={'slack_id': '1'})['Item']
+        self.assertEqual(item['updated_day'], updated_day(now - 3 * day))
+
+        self.assertIsNotNone(
+            self.ddb.get_index_name('users_test', 'updated_day'))
+        self.assertEqual(list(self.ddb.iter_changes(User, now - day)), [new])
+        self.assertCountEqual(self.ddb.iter_changes(User, now - 4 * day),
+                              [old, new])
+        self.assertEqual(list(self.ddb.iter_changes(Team, now)), [team])
+        # Too many days to query, so the table is scanned instead
+        self.assertCountEqual(self.ddb.iter_changes(User, 0), [old, new])
+
+    @pytest.mark.db
+    def test_iter_changes_after_update(self):
+        self.ddb.store(create_test_admin('1'))
+        since = now_ms() + 1
+        with patch('db.dynamodb.now_ms', return_value=since):
+            self.ddb.increment(User, '1', 'karma')
+        changed, = self.ddb.iter_changes(User, since)
+        self.assertEqual(changed.karma, 2)
+
+    @pytest.mark.db
+    def test_iter_deletions(self):
+        self.ddb.bulk_store([create_test_admin(str(i)) for i in range(3)])
+        with patch('db.dynamodb.now_ms', return_value=10):
+            self.ddb.delete(User, '0')
+        with patch('db.dynamodb.now_ms', return_value=20):
+            self.ddb.bulk_delete(User, ['1'])
+        self.assertCountEqual(self.ddb.iter_deletions(User, 10), ['0', '1'])
+        self.assertEqual(list(self.ddb.iter_deletions(User, 20)), ['1'])
+        self.assertEqual(list(self.ddb.iter_deletions(Team, 0)), [])
+
+        # Read from an index, so that older deletions aren't read at all
+        self.assertEqual(
+            self.ddb.get_index_name('deletions_test', 'deleted_at'),
+            'deleted_at-index')
+        item = self.ddb.ddb.Table('deletions_test') \
+            .get_item(Key={'model': 'User', 'key': '1'})['Item']
+        self.assertEqual(item['expires_at'],
+                         DynamoDB.DELETIONS_TTL_DAYS * 24 * 60 * 60)
+        ttl = self.ddb.ddb.meta.client.describe_time_to_live(
+            TableName='deletions_test')['TimeToLiveDescription']
+        self.assertEqual(ttl['TimeToLiveStatus'], 'ENABLED')
+        self.assertEqual(ttl['AttributeName'], 'expires_at')
+
+        self.config.aws_deletions_tablename = ''
+        with self.assertRaises(RuntimeError):
+            list(DynamoDB(self.config).iter_deletions(User, 0))
+
+    @pytest.mark.db
+    def test_iter_deletions_without_index(self):
+        self.ddb.ddb.Table('deletions_test').delete()
+        self.ddb.ddb.create_table(
+            TableName='deletions_test',
+            AttributeDefinitions=[
+                {'AttributeName': 'model', 'AttributeType': 'S'},
+                {'AttributeName': 'key', 'AttributeType': 'S'}
+            ],
+            KeySchema=[{'AttributeName': 'model', 'KeyType': 'HASH'},
+                       {'AttributeName': 'key', 'KeyType': 'RANGE'}],
+            BillingMode='PAY_PER_REQUEST')
+
+        ddb = DynamoDB(self.config)
+        ddb.limiter.sleep = MagicMock()
+        ddb.store(create_test_admin('0'))
+        with patch('db.dynamodb.now_ms', return_value=10):
+            ddb.delete(User, '0')
+        self.assertIsNone(ddb.get_index_name('deletions_test', 'deleted_at'))
+        self.assertEqual(list(ddb.iter_deletions(User, 10)), ['0'])
+        self.assertEqual(list(ddb.iter_deletions(User, 11)), [])
+
+    @pytest.mark.db
+    def test_bulk_store_keep_stamps(self):
+        user = create_test_admin('1')
+        user.updated_at = 10
+        user.version = 3
+        self.ddb.bulk_store([user], keep_stamps=True)
+        user = self.ddb.retrieve(User, '1')
+        self.assertEqual((user.updated_at, user.version), (10, 3))
+
+    @pytest.mark.db
+    def test_store_checks_version(self):
+        self.ddb.store(create_test_team('1', 'brussel-sprouts', 'Sprouts'))
+        team = self.ddb.retrieve(Team, '1')
+        stale = self.ddb.retrieve(Team, '1')
+        self.assertEqual(team.version, 1)
+        team.platform = 'web'
+        self.ddb.store(team)
+        self.assertEqual(team.version, 2)
+
+        stale.platform = 'ios'
+        with self.assertRaises(VersionConflict):
+            self.ddb.store(stale)
+        self.assertEqual(stale.version, 1)
+        self.assertEqual(self.ddb.retrieve(Team, '1').platform, 'web')
+
+        self.ddb.update_set(Team, '1', 'members', add=['abc'])
+        self.assertEqual(self.ddb.retrieve(Team, '1').version, 3)
+        with self.assertRaises(VersionConflict):
+            self.ddb.store(team)
+
+        # Objects that weren't read from the database overwrite it
+        self.assertTrue(self.ddb.store(create_test_team('1', 'b', 'B')))
+
+    @pytest.mark.db
+    @patch('db.utils.time.sleep')
+    def test_store_checks_missing_version(self, sleep):
+        # Items written before versions were recorded have none
+        self.ddb.ddb.Table('teams_test').put_item(
+            Item={'github_team_id': '1', 'github_team_name': 'sprouts'})
+        first = self.ddb.retrieve(Team, '1')
+        second = self.ddb.retrieve(Team, '1')
+        self.assertEqual(first.version, 0)
+        first.platform = 'web'
+        self.assertTrue(self.ddb.store(first))
+        second.displayname = 'Sprouts'
+        with self.assertRaises(VersionConflict):
+            self.ddb.store(second)
+        self.assertEqual(self.ddb.retrieve(Team, '1').platform, 'web')
+
+        self.ddb.ddb.Table('teams_test').put_item(
+            Item={'github_team_id': '2', 'github_team_name': 'kale'})
+        seen = []
+
+        def rename(team: Team):
+            if not seen:
+                # Another writer gets in between the read and the write
+                other = self.ddb.retrieve(Team, '2')
+                other.platform = 'web'
+                self.ddb.store(other)
+            seen.append(team.platform)
+            team.displayname = 'Kale'
+
+        update_with_retry(self.ddb, Team, '2', rename)
+        self.assertEqual(seen, ['', 'web'])
+        team = self.ddb.retrieve(Team, '2')
+        self.assertEqual((team.platform, team.displayname), ('web', 'Kale'))
+
+    @pytest.mark.db
+    def test_increment_concurrently(self):
+        user = create_test_admin('abc_123')
+        self.assertTrue(self.ddb.store(user))
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for _ in range(20):
+                executor.submit(self.ddb.increment, User, 'abc_123', 'karma')
+        self.assertEqual(self.ddb.retrieve(User, 'abc_123').karma, 21)
+
+    @pytest.mark.db
+    def test_increment_missing_user(self):
+        with self.assertRaises(LookupError):
+            self.ddb.increment(User, 'abc_123', 'karma')
+        with self.assertRaises(LookupError):
+            self.ddb.retrieve(User, 'abc_123')
+
+    @pytest.mark.db
+    def test_update_set(self):
+        team = create_test_team('1', 'rocket', 'Rocket')
+        team.add_member('a')
+        team.add_member('b')
+        self.assertTrue(self.ddb.store(team))
+
+        self.ddb.update_set(Team, '1', 'members', add=['c', 'a'])
+        self.assertEqual(self.ddb.retrieve(Team, '1').members,
+                         team.members | {'a', 'c'})
+        self.ddb.update_set(Team, '1', 'members', add=['d'], remove=['b'])
+        self.assertEqual(self.ddb.retrieve(Team, '1').members,
+                         (team.members | {'a', 'c', 'd'}) - {'b'})
+        self.ddb.update_set(Team, '1', 'team_leads', add=['a'])
+        self.assertEqual(self.ddb.retrieve(Team, '1').team_leads, {'a'})
+
+    @pytest.mark.db
+    def test_update_set_remove_everything(self):
+        team = create_test_team('1', 'rocket', 'Rocket')
+        team.add_team_lead('a')
+        self.assertTrue(self.ddb.store(team))
+
+        self.ddb.update_set(Team, '1', 'team_leads', remove=['a', 'z'])
+        self.assertEqual(self.ddb.retrieve(Team, '1').team_leads, set())
+        self.ddb.update_set(Team, '1', 'team_leads')
+        self.ddb.update_set(Team, '1', 'team_leads', remove=['a'])
+
+    @pytest.mark.db
+    def test_update_set_missing_team(self):
+        with self.assertRaises(LookupError):
+            self.ddb.update_set(Team, '1', 'members', add=['a'])
+        with self.assertRaises(LookupError):
+            self.ddb.retrieve(Team, '1')
+
+    @pytest.mark.db
+    def test_get_membership(self):
+        team = create_test_team('1', 'rocket', 'Rocket')
+        team.add_member('a')
+        team.add_team_lead('a')
+        team2 = create_test_team('2', 'lame-o', 'Lame-O Team')
+        self.assertTrue(self.ddb.store(team))
+        self.ddb.bulk_store([team2])
+
+        self.assertEqual(self.ddb.get_membership('a'),
+                         Membership({'1'}, {'1'}))
+        self.assertEqual(self.ddb.get_membership('abc_123').member_of,
+                         {'1', '2'})
+
+        # Writes are reflected without rebuilding the index
+        built_at = self.ddb.membership.built_at
+        self.ddb.update_set(Team, '2', 'members', add=['a'])
+        self.ddb.update_set(Team, '1', 'team_leads', remove=['a'])
+        self.assertEqual(self.ddb.get_membership('a'),
+                         Membership({'1', '2'}, set()))
+        self.ddb.delete(Team, '1')
+        self.ddb.bulk_delete(Team, ['2'])
+        team3 = create_test_team('3', 'brussel-sprouts', 'Brussel Sprouts')
+        self.ddb.bulk_store([team3])
+        self.assertEqual(self.ddb.get_membership('abc_123').member_of,
+                         {'3'})
+        self.assertEqual(self.ddb.membership.built_at, built_at)
+
+    @pytest.mark.db
+    def test_get_membership_rebuilds_stale_index(self):
+        team = create_test_team('1', 'rocket', 'Rocket')
+        self.assertTrue(self.ddb.store(team))
+        self.assertEqual(self.ddb.get_membership('abc_123').member_of, {'1'})
+
+        # Written by another process
+        other = DynamoDB(self.config)
+        other.update_set(Team, '1', 'members', add=['b'])
+        self.assertEqual(self.ddb.get_membership('b').member_of, set())
+        self.ddb.membership.built_at = None
+        self.assertEqual(self.ddb.get_membership('b').member_of, {'1'})
+
+    @pytest.mark.db
+    def test_get_membership_rebuilds_once(self):
+        self.assertTrue(self.ddb.store(create_test_team('1', 'rocket',
+                                                        'Rocket')))
+        self.ddb.membership.built_at = None
+        with patch.object(self.ddb, 'iter_query',
+                          wraps=self.ddb.iter_query) as iter_query:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                found = list(executor.map(self.ddb.get_membership,
+                                          ['abc_123'] * 8))
+        self.assertEqual(found, [Membership({'1'}, set())] * 8)
+        iter_query.assert_called_once()
+
     @pytest.mark.db
     def test_retrieve_invalid_team(self):
         """Test to see if we can retrieve a non-existent team."""
@@ -169,6 +577,142 @@ class TestDynamoDB(TestCase):
         for user in retrieved_users:
             self.assertIn(user, users)
 
+    @pytest.mark.db
+    def test_bulk_retrieve_lotsa_users_in_order(self):
+        uids = list(map(str, range(250)))
+        users = [create_test_admin(i) for i in uids]
+        table = self.ddb.ddb.Table('users_test')
+        with table.batch_writer() as batch:
+            for user in users:
+                batch.put_item(Item=User.to_dict(user))
+
+        ks = list(reversed(uids)) + ['not-a-user', uids[0]]
+        self.assertEqual(self.ddb.bulk_retrieve(User, ks),
+                         list(reversed(users)))
+
+    @pytest.mark.db
+    @patch('db.dynamodb.time.sleep')
+    def test_bulk_retrieve_unprocessed_keys(self, mock_sleep):
+        uids = list(map(str, range(10)))
+        users = [create_test_admin(i) for i in uids]
+        for user in users:
+            self.assertTrue(self.ddb.store(user))
+
+        batch_get_item = self.ddb.ddb.batch_get_item
+
+        def throttled_batch_get_item(RequestItems):
+            # Only process the first two keys of every request
+            keys = RequestItems['users_test']['Keys']
+            resp = batch_get_item(
+                RequestItems={'users_test': {'Keys': keys[:2]}})
+            if len(keys) > 2:
+                resp['UnprocessedKeys'] = {
+                    'users_test': {'Keys': keys[2:]}}
+            return resp
+
+        self.ddb.ddb = MagicMock(wraps=self.ddb.ddb)
+        self.ddb.ddb.batch_get_item.side_effect = throttled_batch_get_item
+        with record_db_calls() as stats:
+            self.assertEqual(self.ddb.bulk_retrieve(User, uids), users)
+        self.assertEqual(self.ddb.ddb.batch_get_item.call_count, 5)
+        self.assertEqual(mock_sleep.call_count, 4)
+        self.assertEqual(stats.ops[('bulk_retrieve', 'users_test')].throttles,
+                         4)
+        self.assertEqual(self.ddb.limiter.throttles(), {'users_test': 4})
+        self.assertIsNotNone(self.ddb.limiter.rate('users_test'))
+
+    @pytest.mark.db
+    @patch('db.dynamodb.time.sleep')
+    def test_bulk_request_retries_throttles(self, mock_sleep):
+        self.ddb.bulk_store([create_test_admin('1')])
+        error = ClientError(
+            {'Error': {'Code': 'ProvisionedThroughputExceededException'}},
+            'Scan')
+        scan = self.ddb.ddb.Table('users_test').scan
+        table = MagicMock()
+        table.scan.side_effect = [error, error, scan()]
+        self.ddb.ddb = MagicMock(wraps=self.ddb.ddb)
+        self.ddb.ddb.Table.return_value = table
+        self.assertEqual(len(self.ddb.query(User)), 1)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+        table.scan.side_effect = error
+        with self.assertRaises(ClientError):
+            self.ddb.query(User)
+
+    @pytest.mark.db
+    def test_record_throttle(self):
+        request = {'body': b'{"TableName": "users_test"}'}
+        throttled = (None, {'Error': {'Code': 'ThrottlingException'}})
+        self.ddb.record_throttle(response=None, request_dict=request)
+        self.ddb.record_throttle(response=(None, {}), request_dict=request)
+        self.assertEqual(self.ddb.limiter.throttles(), {})
+        self.ddb.record_throttle(response=throttled, request_dict=request)
+        self.ddb.record_throttle(
+            response=throttled,
+            request_dict={'body': b'{"RequestItems": {"teams_test": []}}'})
+        self.assertEqual(self.ddb.limiter.throttles(),
+                         {'users_test': 1, 'teams_test': 1})
+
+    @pytest.mark.db
+    @patch('db.dynamodb.time.sleep')
+    def test_bulk_retrieve_gives_up(self, mock_sleep):
+        def unprocessed_batch_get_item(RequestItems):
+            return {'Responses': {}, 'UnprocessedKeys': RequestItems}
+
+        self.ddb.ddb = MagicMock(wraps=self.ddb.ddb)
+        self.ddb.ddb.batch_get_item.side_effect = unprocessed_batch_get_item
+        with self.assertRaises(RuntimeError):
+            self.ddb.bulk_retrieve(User, ['1', '2'])
+        self.assertEqual(mock_sleep.call_count, DynamoDB.MAX_BATCH_RETRIES)
+
+    @pytest.mark.db
+    def test_bulk_store_users_and_teams(self):
+        users = [create_test_admin(str(i)) for i in range(60)]
+        teams = [create_test_team(str(i), f'team{i}', 'Team')
+                 for i in range(30)]
+        invalid_user = User('')
+
+        stored = self.ddb.bulk_store(
+            iter(users + teams + [invalid_user, users[0]]))
+        self.assertEqual(stored, 90)
+        self.assertCountEqual(self.ddb.query(User), users)
+        self.assertCountEqual(self.ddb.query(Team), teams)
+
+    @pytest.mark.db
+    def test_bulk_store_invalid_type(self):
+        with self.assertRaises(RuntimeError):
+            self.ddb.bulk_store([create_test_admin('1'), 30])
+
+    @pytest.mark.db
+    @patch('db.dynamodb.time.sleep')
+    def test_bulk_store_unprocessed_items(self, mock_sleep):
+        users = [create_test_admin(str(i)) for i in range(10)]
+        batch_write_item = self.ddb.ddb.batch_write_item
+
+        def throttled_batch_write_item(RequestItems):
+            # Only process the first three items of every request
+            reqs = RequestItems['users_test']
+            resp = batch_write_item(
+                RequestItems={'users_test': reqs[:3]})
+            if len(reqs) > 3:
+                resp['UnprocessedItems'] = {'users_test': reqs[3:]}
+            return resp
+
+        self.ddb.ddb = MagicMock(wraps=self.ddb.ddb)
+        self.ddb.ddb.batch_write_item.side_effect = throttled_batch_write_item
+        self.assertEqual(self.ddb.bulk_store(users), 10)
+        self.assertEqual(mock_sleep.call_count, 3)
+        self.assertCountEqual(self.ddb.query(User), users)
+
+    @pytest.mark.db
+    def test_bulk_delete_users(self):
+        users = [create_test_admin(str(i)) for i in range(60)]
+        self.assertEqual(self.ddb.bulk_store(users), 60)
+
+        self.ddb.bulk_delete(User, [str(i) for i in range(50)] + ['bad'])
+        self.assertCountEqual(self.ddb.query(User), users[50:])
+
     @pytest.mark.db
     def test_query_or_teams(self):
         """Test edge cases like set inclusion in query_or."""
@@ -219,6 +763,300 @@ class TestDynamoDB(TestCase):
         queried_users = self.ddb.query_or(User, params)
         self.assertCountEqual(queried_users, users)
 
+    @pytest.mark.db
+    def test_iter_query_pages(self):
+        uids = list(map(str, range(25)))
+        users = [create_test_admin(i) for i in uids]
+        for user in users[:5]:
+            user.permissions_level = Permissions.member
+        for user in users:
+            self.assertTrue(self.ddb.store(user))
+
+        all_users = list(self.ddb.iter_query(User, page_size=4))
+        self.assertCountEqual(all_users, users)
+
+        admins = list(self.ddb.iter_query(
+            User, [('permission_level', 'admin')], page_size=4))
+        self.assertCountEqual(admins, users[5:])
+
+    @pytest.mark.db
+    def test_iter_query_or_pages(self):
+        uids = list(map(str, range(25)))
+        users = [create_test_admin(i) for i in uids]
+        for user in users:
+            self.assertTrue(self.ddb.store(user))
+
+        params = [('slack_id', uid) for uid in uids[:10]]
+        queried_users = list(self.ddb.iter_query_or(User, params,
+                                                    page_size=4))
+        self.assertCountEqual(queried_users, users[:10])
+
+    @pytest.mark.db
+    def test_small_table_scanned_sequentially(self):
+        self.assertEqual(self.ddb.get_scan_segments('users_test'), 1)
+
+    @pytest.mark.db
+    def test_scan_segments_from_table_size(self):
+        self.assertEqual(self.ddb.get_scan_segments('users_test'), 1)
+        self.ddb.table_sizes['users_test'] = \
+            3 * DynamoDB.SCAN_SEGMENT_BYTES + 1
+        self.assertEqual(self.ddb.get_scan_segments('users_test'), 4)
+        self.ddb.table_sizes['users_test'] = 10 ** 12
+        self.assertEqual(self.ddb.get_scan_segments('users_test'),
+                         DynamoDB.MAX_SCAN_SEGMENTS)
+
+    @pytest.mark.db
+    def test_scan_segments_configured(self):
+        self.ddb.scan_segments = 3
+        self.assertEqual(self.ddb.get_scan_segments('users_test'), 3)
+
+    @pytest.mark.db
+    def test_iter_query_segmented_scan(self):
+        self.ddb.scan_segments = 4
+        users = [create_test_admin(str(i)) for i in range(50)]
+        for user in users[:10]:
+            user.permissions_level = Permissions.member
+        self.ddb.bulk_store(users)
+
+        self.assertCountEqual(self.ddb.iter_query(User, page_size=3), users)
+        self.assertCountEqual(
+            self.ddb.query(User, [('permission_level', 'admin')]),
+            users[10:])
+
+        params = [('slack_id', str(i)) for i in range(0, 50, 2)]
+        self.assertCountEqual(self.ddb.query_or(User, params), users[::2])
+
+    @pytest.mark.db
+    def test_segmented_scan_closed_early(self):
+        self.ddb.scan_segments = 4
+        users = [create_test_admin(str(i)) for i in range(20)]
+        self.ddb.bulk_store(users)
+
+        it = self.ddb.iter_query(User, page_size=1)
+        first = next(it)
+        it.close()
+        self.assertIn(first, users)
+
+    @pytest.mark.db
+    def test_segmented_scan_error(self):
+        self.ddb.scan_segments = 2
+        self.ddb.ddb = MagicMock(wraps=self.ddb.ddb)
+        self.ddb.ddb.Table.return_value.scan.side_effect = \
+            RuntimeError('boom')
+        with self.assertRaises(RuntimeError):
+            self.ddb.query(User)
+
+    @pytest.mark.db
+    def test_query_or_plans(self):
+        users = [create_test_admin(str(i)) for i in range(250)]
+        for i, user in enumerate(users):
+            user.github_id = f'gh{i}'
+        self.ddb.bulk_store(users)
+
+        by_key = self.ddb.query_or(User, [('slack_id', str(i))
+                                          for i in range(0, 250, 2)] +
+                                   [('slack_id', 'nobody')])
+        self.assertCountEqual(by_key, users[::2])
+        self.assertEqual(self.ddb.planner.decisions[('users_test', 'keys')],
+                         1)
+
+        by_index = self.ddb.query_or(User, [('github_user_id', 'gh3'),
+                                            ('github_user_id', 'gh7'),
+                                            ('slack_id', '3'),
+                                            ('slack_id', '5')],
+                                     attributes=['github_user_id'])
+        self.assertCountEqual([u.slack_id for u in by_index],
+                              ['3', '5', '7'])
+        self.assertEqual(by_index[0].name, '')
+        self.assertEqual(self.ddb.planner.decisions[('users_test', 'index')],
+                         1)
+        self.assertEqual(self.ddb.planner.decisions[('users_test', 'scan')],
+                         0)
+
+    @pytest.mark.db
+    def test_query_or_single_scan_for_lotsa_params(self):
+        team = create_test_team('1', 'rocket', 'Rocket')
+        team2 = create_test_team('2', 'lame-o', 'Lame-O Team')
+        team2.members = set(['x'])
+        team3 = create_test_team('3', 'other', 'Other')
+        team3.members = set(['y'])
+        team3.platform = 'ios'
+        for t in [team, team2, team3]:
+            self.assertTrue(self.ddb.store(t))
+        self.ddb.ddb = MagicMock(wraps=self.ddb.ddb)
+
+        params = [('members', str(i)) for i in range(300)] + \
+            [('members', 'x'), ('platform', 'ios')]
+        self.assertCountEqual(self.ddb.query_or(Team, params),
+                              [team2, team3])
+        self.assertEqual(self.ddb.planner.decisions[('teams_test', 'scan')],
+                         1)
+        self.assertEqual(self.ddb.ddb.Table.call_count, 1)
+
+    @pytest.mark.db
+    def test_query_or_lotsa_duplicate_params(self):
+        users = [create_test_admin(str(i)) for i in range(3)]
+        for user in users:
+            self.assertTrue(self.ddb.store(user))
+
+        # Same parameters spread out across several filter expressions
+        params = [('slack_id', user.slack_id) for user in users] * 100
+        queried_users = self.ddb.query_or(User, params)
+        self.assertCountEqual(queried_users, users)
+
+    @pytest.mark.db
+    def test_users_table_has_github_id_index(self):
+        self.assertIsNotNone(
+            self.ddb.get_index_name('users_test', 'github_user_id'))
+
+    @pytest.mark.db
+    def test_connects_lazily(self):
+        with patch('db.dynamodb.boto3') as mock_boto3:
+            session = mock_boto3.session.Session.return_value
+            ddb = DynamoDB(self.config)
+            session.resource.assert_not_called()
+            ddb.ddb
+            ddb.ddb
+            session.resource.assert_called_once()
+
+    @pytest.mark.db
+    def test_check_valid_table_cached(self):
+        self.assertTrue(self.ddb.check_valid_table('users_test'))
+        self.ddb.ddb = MagicMock(wraps=self.ddb.ddb)
+        self.assertTrue(self.ddb.check_valid_table('users_test'))
+        self.assertTrue(self.ddb.check_valid_table('teams_test'))
+        self.ddb.ddb.meta.client.describe_table.assert_not_called()
+        self.assertFalse(self.ddb.check_valid_table('nope'))
+
+    @pytest.mark.db
+    def test_create_missing_index(self):
+        """Test that tables made before an index existed get the index."""
+        for table in self.ddb.ddb.tables.all():
+            table.delete()
+        self.ddb.ddb.create_table(
+            TableName='users_test',
+            AttributeDefinitions=[
+                {'AttributeName': 'slack_id', 'AttributeType': 'S'}
+            ],
+            KeySchema=[{'AttributeName': 'slack_id', 'KeyType': 'HASH'}],
+            ProvisionedThroughput={
+                'ReadCapacityUnits': 1,
+                'WriteCapacityUnits': 1
+            }
+        )
+
+        ddb = DynamoDB(self.config)
+        desc = ddb.ddb.meta.client.describe_table(TableName='users_test')
+        index_names = [index['IndexName']
+                       for index in desc['Table']['GlobalSecondaryIndexes']]
+        self.assertIn('github_user_id-index', index_names)
+
+    @pytest.mark.db
+    def test_billing_mode(self):
+        client = self.ddb.ddb.meta.client
+        desc = client.describe_table(TableName='teams_test')['Table']
+        self.assertEqual(desc['ProvisionedThroughput']['ReadCapacityUnits'],
+                         1)
+        for table in self.ddb.ddb.tables.all():
+            table.delete()
+
+        self.config.db_billing_mode = 'PAY_PER_REQUEST'
+        DynamoDB(self.config).ddb
+        desc = client.describe_table(TableName='teams_test')['Table']
+        self.assertEqual(desc['BillingModeSummary']['BillingMode'],
+                         'PAY_PER_REQUEST')
+
+        # Existing tables are switched back
+        self.config.db_billing_mode = 'PROVISIONED'
+        self.config.db_read_capacity = 5
+        DynamoDB(self.config).ddb
+        desc = client.describe_table(TableName='teams_test')['Table']
+        self.assertEqual(desc['BillingModeSummary']['BillingMode'],
+                         'PROVISIONED')
+        self.assertEqual(desc['ProvisionedThroughput']['ReadCapacityUnits'],
+                         5)
+
+    @pytest.mark.db
+    def test_billing_mode_unset(self):
+        for table in self.ddb.ddb.tables.all():
+            table.delete()
+        self.config.db_billing_mode = 'PAY_PER_REQUEST'
+        DynamoDB(self.config).ddb
+
+        # Existing tables are left alone
+        self.config.db_billing_mode = ''
+        DynamoDB(self.config).ddb
+        client = self.ddb.ddb.meta.client
+        desc = client.describe_table(TableName='teams_test')['Table']
+        self.assertEqual(desc['BillingModeSummary']['BillingMode'],
+                         'PAY_PER_REQUEST')
+
+    def test_unknown_billing_mode(self):
+        self.config.db_billing_mode = 'PAY_PER_REQUESTS'
+        with self.assertRaises(ValueError):
+            DynamoDB(self.config)
+
+    @pytest.mark.db
+    def test_query_user_by_github_id(self):
+        users = [create_test_admin(str(i)) for i in range(5)]
+        for i, user in enumerate(users):
+            user.github_id = f'gh{i % 2}'
+            self.assertTrue(self.ddb.store(user))
+
+        queried_users = self.ddb.query(User, [('github_user_id', 'gh1')])
+        self.assertCountEqual(queried_users, [users[1], users[3]])
+
+        queried_users = self.ddb.query(User, [('github_user_id', 'gh0'),
+                                              ('slack_id', '2')])
+        self.assertEqual(queried_users, [users[2]])
+
+    @pytest.mark.db
+    def test_query_in_users(self):
+        users = [create_test_admin(str(i)) for i in range(5)]
+        for i, user in enumerate(users):
+            user.github_id = f'gh{i}'
+            self.assertTrue(self.ddb.store(user))
+
+        queried_users = self.ddb.query_in(
+            User, 'github_user_id', ['gh0', 'gh3', 'gh3', 'gh9'])
+        self.assertCountEqual(queried_users, [users[0], users[3]])
+        self.assertEqual(self.ddb.query_in(User, 'github_user_id', []), [])
+
+    @pytest.mark.db
+    def test_query_in_without_index(self):
+        teams = [create_test_team(str(i), f'team{i}', f'Team {i}')
+                 for i in range(3)]
+        for team in teams:
+            self.assertTrue(self.ddb.store(team))
+
+        queried_teams = self.ddb.query_in(Team, 'displayname',
+                                          ['Team 0', 'Team 2'])
+        self.assertCountEqual(queried_teams, [teams[0], teams[2]])
+
+    @pytest.mark.db
+    def test_teams_table_has_team_name_index(self):
+        self.assertIsNotNone(
+            self.ddb.get_index_name('teams_test', 'github_team_name'))
+
+    @pytest.mark.db
+    def test_query_team_by_name(self):
+        team = create_test_team('1', 'rocket2.0', 'Rocket 2.0')
+        team2 = create_test_team('2', 'lame-o', 'Lame-O Team')
+        self.assertTrue(self.ddb.store(team))
+        self.assertTrue(self.ddb.store(team2))
+
+        self.assertEqual(self.ddb.query(Team, [('github_team_name',
+                                                'lame-o')]),
+                         [team2])
+        self.assertEqual(self.ddb.query(Team, [('github_team_name',
+                                                'lame-o'),
+                                               ('members', 'abc_123')]),
+                         [team2])
+        self.assertEqual(self.ddb.query(Team, [('github_team_name',
+                                                'lame-o'),
+                                               ('members', 'nobody')]),
+                         [])
+
     @pytest.mark.db
     def test_query_team(self):
         """Test to see if we can store and query the same team."""
@@ -259,3 +1097,241 @@ class TestDynamoDB(TestCase):
         self.assertEqual(len(self.ddb.query(Team)), 1)
         self.ddb.delete(Team, '1')
         self.assertEqual(len(self.ddb.query(Team)), 0)
+
+
+class TestShardedDynamoDB(TestDynamoDB):
+    """Run every test with members and leads in the memberships table."""
+
+    def setUp(self):
+        super().setUp()
+        self.config.aws_memberships_tablename = 'memberships_test'
+        self.ddb = DynamoDB(self.config)
+        self.ddb.limiter.sleep = MagicMock()
+
+    def roles(self):
+        """Return the roles of users in the memberships table."""
+        rows = self.ddb.ddb.Table('memberships_test').scan()['Items']
+        return {r['github_id']: r['roles'] for r in rows if 'roles' in r}
+
+    @pytest.mark.db
+    def test_get_membership_rebuilds_stale_index(self):
+        """Memberships are read from their table, so there is no index."""
+        self.assertTrue(self.ddb.store(create_test_team('1', 'rocket',
+                                                        'Rocket')))
+        other = DynamoDB(self.config)
+        other.update_set(Team, '1', 'members', add=['b'])
+        self.assertEqual(self.ddb.get_membership('b').member_of, {'1'})
+        self.assertIsNone(self.ddb.membership.built_at)
+
+    @pytest.mark.db
+    def test_get_membership_rebuilds_once(self):
+        """Memberships are read from their table, so there is no index."""
+        self.assertTrue(self.ddb.store(create_test_team('1', 'rocket',
+                                                        'Rocket')))
+        with patch.object(self.ddb, 'iter_query') as iter_query:
+            self.assertEqual(self.ddb.get_membership('abc_123'),
+                             Membership({'1'}, set()))
+        iter_query.assert_not_called()
+
+    @pytest.mark.db
+    def test_query_or_single_scan_for_lotsa_params(self):
+        team2 = create_test_team('2', 'lame-o', 'Lame-O Team')
+        team2.members = set(['x'])
+        team3 = create_test_team('3', 'other', 'Other')
+        team3.platform = 'ios'
+        self.ddb.bulk_store([create_test_team('1', 'rocket', 'Rocket'),
+                             team2, team3])
+
+        params = [('members', str(i)) for i in range(300)] + \
+            [('members', 'x'), ('platform', 'ios')]
+        self.assertCountEqual(self.ddb.query_or(Team, params),
+                              [team2, team3])
+        # Only the parameter on the platform needs a scan
+        self.assertEqual(self.ddb.planner.decisions[('teams_test', 'scan')],
+                         1)
+
+    @pytest.mark.db
+    def test_members_stored_apart(self):
+        team = create_test_team('1', 'rocket', 'Rocket')
+        team.members = {'a', 'b'}
+        team.team_leads = {'b', 'c'}
+        self.ddb.store(team)
+        item = self.ddb.ddb.Table('teams_test') \
+            .get_item(Key={'github_team_id': '1'})['Item']
+        self.assertNotIn('members', item)
+        self.assertNotIn('team_leads', item)
+        self.assertEqual(self.roles(),
+                         {'a': {'members'}, 'b': {'members', 'team_leads'},
+                          'c': {'team_leads'}})
+
+        team.members = {'a'}
+        self.ddb.store(team)
+        self.ddb.update_set(Team, '1', 'team_leads', add=['d'],
+                            remove=['c'])
+        self.assertEqual(self.roles(),
+                         {'a': {'members'}, 'b': {'team_leads'},
+                          'd': {'team_leads'}})
+        got = self.ddb.retrieve(Team, '1')
+        self.assertEqual(got.members, {'a'})
+        self.assertEqual(got.team_leads, {'b', 'd'})
+        self.assertEqual(got.version, 3)
+
+        self.ddb.delete(Team, '1')
+        self.assertEqual(self.roles(), {})
+
+    @pytest.mark.db
+    def test_update_set_only_writes_memberships(self):
+        self.ddb.store(create_test_team('1', 'rocket', 'Rocket'))
+        self.ddb.ddb = MagicMock(wraps=self.ddb.ddb)
+        self.ddb.update_set(Team, '1', 'members', add=['a'])
+        self.assertEqual(
+            [c.args[0] for c in self.ddb.ddb.Table.call_args_list],
+            ['teams_test', 'memberships_test'])
+        self.assertEqual(self.ddb.retrieve(Team, '1').members,
+                         {'abc_123', 'a'})
+
+    @pytest.mark.db
+    def test_migrate_memberships(self):
+        self.config.aws_memberships_tablename = ''
+        old = DynamoDB(self.config)
+        team = create_test_team('1', 'rocket', 'Rocket')
+        team.team_leads = {'a'}
+        old.bulk_store([team, create_test_team('2', 'lame-o', 'Lame-O')])
+
+        self.config.aws_memberships_tablename = 'memberships_test'
+        new = DynamoDB(self.config)
+        self.assertEqual(new.retrieve(Team, '1'), team)
+        self.assertEqual(new.get_membership('abc_123'),
+                         Membership({'1', '2'}, set()))
+        self.assertEqual(new.get_membership('a'), Membership(set(), {'1'}))
+        item = new.ddb.Table('teams_test') \
+            .get_item(Key={'github_team_id': '1'})['Item']
+        self.assertNotIn('members', item)
+
+    @pytest.mark.db
+    def test_resume_migrate_memberships(self):
+        self.config.aws_memberships_tablename = ''
+        old = DynamoDB(self.config)
+        team = create_test_team('1', 'rocket', 'Rocket')
+        old.store(team)
+
+        # The move was cut short, after the memberships table was created
+        self.config.aws_memberships_tablename = 'memberships_test'
+        with patch.object(DynamoDB, '_DynamoDB__migrate_memberships'):
+            cut = DynamoDB(self.config).ddb
+        self.assertEqual(cut.Table('memberships_test').scan()['Items'], [])
+
+        new = DynamoDB(self.config)
+        self.assertEqual(new.retrieve(Team, '1'), team)
+        self.assertEqual(self.roles(), {'abc_123': {'members'}})
+
+        # Once done, later processes don't move members again
+        new.ddb.Table('teams_test').update_item(
+            Key={'github_team_id': '1'},
+            UpdateExpression='ADD members :m',
+            ExpressionAttributeValues={':m': {'x'}})
+        DynamoDB(self.config).ddb
+        self.assertEqual(self.roles(), {'abc_123': {'members'}})
+
+
+class TestPackedDynamoDB(TestDynamoDB):
+    """Run every test with the member and lead IDs of teams packed."""
+
+    def setUp(self):
+        super().setUp()
+        self.config.db_pack_members = True
+        self.ddb = DynamoDB(self.config)
+        self.ddb.limiter.sleep = MagicMock()
+
+    @pytest.mark.db
+    def test_query_or_single_scan_for_lotsa_params(self):
+        team2 = create_test_team('2', 'lame-o', 'Lame-O Team')
+        team2.members = set(['x'])
+        team3 = create_test_team('3', 'other', 'Other')
+        team3.platform = 'ios'
+        self.ddb.bulk_store([create_test_team('1', 'rocket', 'Rocket'),
+                             team2, team3])
+        self.ddb.ddb = MagicMock(wraps=self.ddb.ddb)
+
+        params = [('members', str(i)) for i in range(300)] + \
+            [('members', 'x'), ('platform', 'ios')]
+        self.assertCountEqual(self.ddb.query_or(Team, params),
+                              [team2, team3])
+        # A scan for the packed members, and one for the platform
+        self.assertEqual(self.ddb.ddb.Table.call_count, 2)
+
+    @pytest.mark.db
+    def test_members_packed(self):
+        team = create_test_team('1', 'rocket', 'Rocket')
+        team.members = {str(10_000_000 + i) for i in range(0, 3000, 3)}
+        team.team_leads = {'10000000', 'not-a-number'}
+        self.ddb.store(team)
+        item = self.ddb.ddb.Table('teams_test') \
+            .get_item(Key={'github_team_id': '1'})['Item']
+        # Every member takes a single byte, after the first
+        self.assertEqual(len(item['members'].value), 1 + 4 + 999)
+        self.assertEqual(item['team_leads'], team.team_leads)
+        self.assertEqual(self.ddb.retrieve(Team, '1'), team)
+
+        self.ddb.update_set(Team, '1', 'members', add=['3'],
+                            remove=['10000000'])
+        got = self.ddb.retrieve(Team, '1')
+        self.assertIn('3', got.members)
+        self.assertNotIn('10000000', got.members)
+        # One update to add and one to remove, like unpacked sets
+        self.assertEqual(got.version, 3)
+        self.assertEqual(self.ddb.get_membership('3').member_of, {'1'})
+
+    @pytest.mark.db
+    def test_update_set_keeps_pending_ids(self):
+        team = create_test_team('1', 'rocket', 'Rocket')
+        team.members = {'100', '200'}
+        self.ddb.store(team)
+        with record_db_calls() as stats:
+            self.ddb.update_set(Team, '1', 'members', add=['300', '400'],
+                                remove=['100', '400'])
+            self.ddb.update_set(Team, '1', 'members', remove=['300'])
+            self.ddb.update_set(Team, '1', 'members', add=['300'])
+        # Updated in place, without reading or storing the team
+        self.assertEqual(set(stats.ops), {('update_set', 'teams_test')})
+
+        item = self.ddb.ddb.Table('teams_test') \
+            .get_item(Key={'github_team_id': '1'})['Item']
+        self.assertEqual(item['members_added'], {'300'})
+        self.assertEqual(item['members_removed'], {'100', '400'})
+        self.assertEqual(self.ddb.retrieve(Team, '1').members, {'200', '300'})
+        got = self.ddb.query(Team, [('members', '300')],
+                             attributes=['members'])
+        self.assertEqual([t.members for t in got], [{'200', '300'}])
+        self.assertEqual(self.ddb.query(Team, [('members', '100')]), [])
+
+    @pytest.mark.db
+    def test_update_set_packs_pending_ids(self):
+        self.ddb.MAX_PENDING_IDS = 2
+        self.ddb.store(create_test_team('1', 'rocket', 'Rocket'))
+        self.ddb.update_set(Team, '1', 'team_leads', add=['1', '2'])
+        item = self.ddb.ddb.Table('teams_test') \
+            .get_item(Key={'github_team_id': '1'})['Item']
+        self.assertEqual(item['team_leads_added'], {'1', '2'})
+
+        self.ddb.update_set(Team, '1', 'team_leads', remove=['3'])
+        item = self.ddb.ddb.Table('teams_test') \
+            .get_item(Key={'github_team_id': '1'})['Item']
+        self.assertNotIn('team_leads_added', item)
+        self.assertNotIn('team_leads_removed', item)
+        self.assertEqual(read_ids(item['team_leads']), {'1', '2'})
+        self.assertEqual(self.ddb.retrieve(Team, '1').team_leads, {'1', '2'})
+
+    @pytest.mark.db
+    def test_read_unpacked_teams(self):
+        self.config.db_pack_members = False
+        DynamoDB(self.config).store(create_test_team('1', 'rocket',
+                                                     'Rocket'))
+        self.ddb.update_set(Team, '1', 'members', add=['123'])
+        self.assertEqual(self.ddb.retrieve(Team, '1').members,
+                         {'abc_123', '123'})
+        got = self.ddb.query(Team, [('members', '123'),
+                                    ('platform', 'slack')],
+                             attributes=['platform'])
+        self.assertEqual([t.github_team_id for t in got], ['1'])
+        self.assertEqual(got[0].members, set())
@@ -0,0 +1,152 @@
+"""Test the team membership index."""
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from app.model import Team
+from db.membership import Membership, MembershipIndex
+
+
+class TestMembershipIndex(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.index = MembershipIndex(ttl=10, clock=lambda: self.now)
+        self.t0 = Team('t0', 'zero', 'Zero')
+        self.t0.members = {'a', 'b'}
+        self.t0.team_leads = {'a'}
+        self.t1 = Team('t1', 'one', 'One')
+        self.t1.members = {'b', 'c'}
+        self.index.rebuild([self.t0, self.t1])
+
+    def test_stale(self):
+        self.assertTrue(MembershipIndex().is_stale())
+        self.assertFalse(self.index.is_stale())
+        self.now = 11
+        self.assertTrue(self.index.is_stale())
+
+    def test_get(self):
+        self.assertEqual(self.index.get('a'), Membership({'t0'}, {'t0'}))
+        self.assertEqual(self.index.get('b'), Membership({'t0', 't1'},
+                                                         set()))
+        self.assertEqual(self.index.get('z'), Membership(set(), set()))
+
+    def test_get_returns_copies(self):
+        self.index.get('a').member_of.add('t9')
+        self.assertEqual(self.index.get('a').member_of, {'t0'})
+
+    def test_set_team(self):
+        t0 = Team('t0', 'zero', 'Zero')
+        t0.members = {'b', 'd'}
+        t0.team_leads = {'d'}
+        self.index.set_team(t0)
+        self.assertEqual(self.index.get('a'), Membership(set(), set()))
+        self.assertEqual(self.index.get('b').member_of, {'t0', 't1'})
+        self.assertEqual(self.index.get('d'), Membership({'t0'}, {'t0'}))
+
+    def test_set_new_team(self):
+        t2 = Team('t2', 'two', 'Two')
+        t2.members = {'c'}
+        self.index.set_team(t2)
+        self.assertEqual(self.index.get('c').member_of, {'t1', 't2'})
+
+    def test_remove_team(self):
+        self.index.remove_team('t0')
+        self.index.remove_team('nope')
+        self.assertEqual(self.index.get('a'), Membership(set(), set()))
+        self.assertEqual(self.index.get('b').member_of, {'t1'})
+
+    def test_update_team(self):
+        self.index.update_team('t1', 'members', add=['d'], remove=['b'])
+        self.index.update_team('t1', 'team_leads', add=['c'])
+        self.assertEqual(self.index.get('b').member_of, {'t0'})
+        self.assertEqual(self.index.get('c'), Membership({'t1'}, {'t1'}))
+        self.assertEqual(self.index.get('d').member_of, {'t1'})
+
+        t1 = Team('t1', 'one', 'One')
+        self.index.set_team(t1)
+        self.assertEqual(self.index.get('d'), Membership(set(), set()))
+        self.assertEqual(self.index.get('c'), Membership(set(), set()))
+
+    def test_update_unknown_team(self):
+        self.index.update_team('t2', 'members', add=['a'])
+        self.assertTrue(self.index.is_stale())
+
+    def test_writes_during_rebuild_are_kept(self):
+        t2 = Team('t2', 'two', 'Two')
+        t2.members = {'d'}
+
+        def teams():
+            # t0 is read before it is changed, t1 after
+            yield self.t0
+            self.index.update_team('t0', 'members', add=['e'])
+            self.index.set_team(t2)
+            self.index.remove_team('t1')
+            yield self.t1
+
+        self.index.rebuild(teams())
+        self.assertEqual(self.index.get('e').member_of, {'t0'})
+        self.assertEqual(self.index.get('d').member_of, {'t2'})
+        self.assertEqual(self.index.get('c'), Membership(set(), set()))
+        self.assertEqual(self.index.get('b').member_of, {'t0'})
+
+        # Nothing is replayed once the rebuild is done
+        self.index.rebuild([self.t1])
+        self.assertEqual(self.index.get('e'), Membership(set(), set()))
+        self.assertEqual(self.index.get('c').member_of, {'t1'})
+
+    def test_refresh(self):
+        self.index.refresh(lambda: [self.t1])
+        self.assertEqual(self.index.get('a'), Membership({'t0'}, {'t0'}))
+        self.now = 11
+        self.index.refresh(lambda: [self.t1])
+        self.assertEqual(self.index.get('a'), Membership(set(), set()))
+        self.assertFalse(self.index.is_stale())
+
+    def test_refresh_once_at_a_time(self):
+        self.now = 11
+        reads = []
+        reading = threading.Event()
+        done = threading.Event()
+
+        def read_teams():
+            reads.append(threading.current_thread())
+            reading.set()
+            done.wait(5)
+            return [self.t1]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            first = executor.submit(self.index.refresh, read_teams)
+            reading.wait(5)
+            # Other callers keep using the stale index meanwhile
+            others = [executor.submit(self.index.refresh, read_teams)
+                      for _ in range(7)]
+            for f in others:
+                f.result(5)
+            self.assertEqual(self.index.get('a').member_of, {'t0'})
+            done.set()
+            first.result(5)
+        self.assertEqual(len(reads), 1)
+        self.assertEqual(self.index.get('a'), Membership(set(), set()))
+
+    def test_refresh_waits_for_first_build(self):
+        index = MembershipIndex()
+        reads = []
+        reading = threading.Event()
+        done = threading.Event()
+
+        def read_teams():
+            reads.append(threading.current_thread())
+            reading.set()
+            done.wait(5)
+            return [self.t0]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            first = executor.submit(index.refresh, read_teams)
+            reading.wait(5)
+            others = [executor.submit(
+                lambda: (index.refresh(read_teams), index.get('a'))[1])
+                for _ in range(7)]
+            done.set()
+            first.result(5)
+            for f in others:
+                self.assertEqual(f.result(5), Membership({'t0'}, {'t0'}))
+        self.assertEqual(len(reads), 1)
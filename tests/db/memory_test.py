@@ -0,0 +1,225 @@
+"""Test the indexed in-memory database facade."""
+import os
+import shutil
+import tempfile
+import threading
+
+from unittest import TestCase, mock
+from app.model import User, Team, Permissions
+from db.facade import VersionConflict
+from db.membership import Membership
+from db.memory import IndexedMemoryDB
+
+
+def create_test_user(slack_id: str) -> User:
+    u = User(slack_id)
+    u.name = 'Jane Doe'
+    u.email = f'{slack_id}@ubc.ca'
+    u.github_username = f'gh-{slack_id}'
+    u.github_id = f'id-{slack_id}'
+    return u
+
+
+def create_test_team(team_id: str, members=(), leads=()) -> Team:
+    t = Team(team_id, f'team-{team_id}', f'Team {team_id}')
+    t.platform = 'web'
+    t.members = set(members)
+    t.team_leads = set(leads)
+    return t
+
+
+class TestIndexedMemoryDB(TestCase):
+    def setUp(self):
+        self.ddb = IndexedMemoryDB()
+
+    def test_store_retrieve(self):
+        u = create_test_user('U1')
+        self.assertTrue(self.ddb.store(u))
+        self.assertEqual(self.ddb.retrieve(User, 'U1'), u)
+        self.assertFalse(self.ddb.store(User('')))
+        with self.assertRaises(RuntimeError):
+            self.ddb.store('not a model')
+        with self.assertRaises(LookupError):
+            self.ddb.retrieve(User, 'U404')
+
+    def test_writes_stamp_updated_at(self):
+        u = create_test_user('U1')
+        with mock.patch('db.utils.now_ms', return_value=10):
+            self.ddb.store(u)
+        self.assertEqual(u.updated_at, 10)
+        self.assertEqual(self.ddb.retrieve(User, 'U1').updated_at, 10)
+        with mock.patch('db.memory.now_ms', return_value=20):
+            self.assertEqual(self.ddb.increment(User, 'U1', 'karma')
+                             .updated_at, 20)
+
+    def test_store_checks_version(self):
+        self.ddb.store(create_test_user('U1'))
+        u = self.ddb.retrieve(User, 'U1')
+        stale = self.ddb.retrieve(User, 'U1')
+        self.assertEqual(u.version, 1)
+        self.ddb.store(u)
+        self.assertEqual(u.version, 2)
+        with self.assertRaises(VersionConflict):
+            self.ddb.store(stale)
+        self.assertEqual(self.ddb.increment(User, 'U1', 'karma').version, 3)
+        self.ddb.bulk_store([stale])
+        self.assertEqual(self.ddb.retrieve(User, 'U1').version, 2)
+
+    def test_stored_objects_are_copies(self):
+        t = create_test_team('T1', members={'a'})
+        self.ddb.store(t)
+        t.members.add('b')
+        got = self.ddb.retrieve(Team, 'T1')
+        got.members.add('c')
+        self.assertEqual(self.ddb.retrieve(Team, 'T1').members, {'a'})
+        self.assertEqual(self.ddb.query(Team, [('members', 'b')]), [])
+
+    def test_retrieve_projection(self):
+        self.ddb.store(create_test_user('U1'))
+        u = self.ddb.retrieve(User, 'U1', attributes=['email'])
+        self.assertEqual(u.email, 'U1@ubc.ca')
+        self.assertEqual(u.name, '')
+
+    def test_bulk_retrieve(self):
+        self.ddb.bulk_store([create_test_user(f'U{i}') for i in range(5)])
+        got = self.ddb.bulk_retrieve(User, ['U3', 'U404', 'U1', 'U3'])
+        self.assertEqual([u.slack_id for u in got], ['U3', 'U1'])
+
+    def test_query(self):
+        admin = create_test_user('U2')
+        admin.permissions_level = Permissions.admin
+        self.ddb.bulk_store([create_test_user('U1'), admin])
+        got = self.ddb.query(User, [('permission_level', 'admin')])
+        self.assertEqual([u.slack_id for u in got], ['U2'])
+        got = self.ddb.query(User, [('name', 'Jane Doe'),
+                                    ('github_user_id', 'id-U1')])
+        self.assertEqual([u.slack_id for u in got], ['U1'])
+        self.assertEqual(len(self.ddb.query(User)), 2)
+        self.assertEqual(self.ddb.query(User, [('nope', 'x')]), [])
+
+    def test_query_set_membership(self):
+        self.ddb.store(create_test_team('T1', members={'a', 'b'}))
+        self.ddb.store(create_test_team('T2', members={'b'}, leads={'c'}))
+        got = self.ddb.query(Team, [('members', 'b')])
+        self.assertEqual({t.github_team_id for t in got}, {'T1', 'T2'})
+        got = self.ddb.query(Team, [('team_leads', 'c')])
+        self.assertEqual([t.github_team_id for t in got], ['T2'])
+
+    def test_query_or(self):
+        self.ddb.store(create_test_team('T1', members={'a'}))
+        self.ddb.store(create_test_team('T2'))
+        self.ddb.store(create_test_team('T3'))
+        got = self.ddb.query_or(Team, [('members', 'a'),
+                                       ('github_team_name', 'team-T2')])
+        self.assertEqual({t.github_team_id for t in got}, {'T1', 'T2'})
+        got = self.ddb.query_in(Team, 'github_team_id', ['T3', 'T404'])
+        self.assertEqual([t.github_team_id for t in got], ['T3'])
+
+    def test_index_updated_on_replace(self):
+        u = create_test_user('U1')
+        self.ddb.store(u)
+        u.email = 'new@ubc.ca'
+        self.ddb.store(u)
+        self.assertEqual(self.ddb.query(User, [('email', 'U1@ubc.ca')]), [])
+        self.assertEqual(len(self.ddb.query(User, [('email', 'new@ubc.ca')])),
+                         1)
+
+    def test_increment(self):
+        self.ddb.store(create_test_user('U1'))
+        self.assertEqual(self.ddb.increment(User, 'U1', 'karma', 3).karma, 4)
+        self.assertEqual(self.ddb.retrieve(User, 'U1').karma, 4)
+        with self.assertRaises(LookupError):
+            self.ddb.increment(User, 'U404', 'karma')
+
+    def test_concurrent_increments(self):
+        self.ddb.store(create_test_user('U1'))
+
+        def work():
+            for _ in range(100):
+                self.ddb.increment(User, 'U1', 'karma')
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.ddb.retrieve(User, 'U1').karma, 401)
+
+    def test_update_set(self):
+        self.ddb.store(create_test_team('T1', members={'a', 'b'}))
+        self.ddb.update_set(Team, 'T1', 'members', add=['c'], remove=['b'])
+        self.assertEqual(self.ddb.retrieve(Team, 'T1').members, {'a', 'c'})
+        self.assertEqual(self.ddb.query(Team, [('members', 'b')]), [])
+        self.ddb.update_set(Team, 'T1', 'members', remove=['a', 'c'])
+        self.assertEqual(self.ddb.retrieve(Team, 'T1').members, set())
+        with self.assertRaises(LookupError):
+            self.ddb.update_set(Team, 'T404', 'members', add=['a'])
+
+    def test_get_membership(self):
+        self.ddb.store(create_test_team('T1', members={'a'}, leads={'a'}))
+        self.ddb.store(create_test_team('T2', members={'a'}))
+        self.assertEqual(self.ddb.get_membership('a'),
+                         Membership({'T1', 'T2'}, {'T1'}))
+        self.ddb.delete(Team, 'T2')
+        self.assertEqual(self.ddb.get_membership('a'),
+                         Membership({'T1'}, {'T1'}))
+
+    def test_bulk_delete(self):
+        self.ddb.bulk_store([create_test_user(f'U{i}') for i in range(3)])
+        self.ddb.bulk_delete(User, ['U0', 'U2', 'U404'])
+        self.assertEqual([u.slack_id for u in self.ddb.query(User)], ['U1'])
+        self.assertEqual(self.ddb.query(User, [('email', 'U0@ubc.ca')]), [])
+
+    def test_iter_changes(self):
+        with mock.patch('db.utils.now_ms', return_value=10):
+            self.ddb.bulk_store([create_test_user(f'U{i}') for i in range(3)])
+        with mock.patch('db.utils.now_ms', return_value=20):
+            self.ddb.store(self.ddb.retrieve(User, 'U1'))
+        self.assertEqual([u.slack_id for u in
+                          self.ddb.iter_changes(User, 20)], ['U1'])
+        self.assertEqual(len(list(self.ddb.iter_changes(User, 10))), 3)
+        self.assertEqual(list(self.ddb.iter_changes(Team, 0)), [])
+
+    def test_iter_deletions(self):
+        self.ddb.bulk_store([create_test_user(f'U{i}') for i in range(3)])
+        with mock.patch('db.memory.now_ms', return_value=10):
+            self.ddb.delete(User, 'U0')
+        with mock.patch('db.memory.now_ms', return_value=20):
+            self.ddb.bulk_delete(User, ['U1'])
+        self.assertEqual(sorted(self.ddb.iter_deletions(User, 10)),
+                         ['U0', 'U1'])
+        self.assertEqual(list(self.ddb.iter_deletions(User, 20)), ['U1'])
+        self.assertEqual(list(self.ddb.iter_deletions(Team, 0)), [])
+
+    def test_bulk_store_keep_stamps(self):
+        u = create_test_user('U1')
+        u.updated_at = 10
+        u.version = 3
+        self.ddb.bulk_store([u], keep_stamps=True)
+        u = self.ddb.retrieve(User, 'U1')
+        self.assertEqual((u.updated_at, u.version), (10, 3))
+
+
+class TestIndexedMemoryDBSnapshot(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'snapshot.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_and_load(self):
+        ddb = IndexedMemoryDB(self.path)
+        ddb.store(create_test_user('U1'))
+        ddb.store(create_test_team('T1', members={'a', 'b'}, leads={'a'}))
+        ddb.save_snapshot()
+
+        loaded = IndexedMemoryDB(self.path)
+        self.assertEqual(loaded.retrieve(User, 'U1').email, 'U1@ubc.ca')
+        self.assertEqual(loaded.retrieve(Team, 'T1').members, {'a', 'b'})
+        self.assertEqual(loaded.get_membership('a'),
+                         Membership({'T1'}, {'T1'}))
+        self.assertEqual(os.listdir(self.dir), ['snapshot.json'])
+
+    def test_missing_snapshot(self):
+        ddb = IndexedMemoryDB(self.path)
+        self.assertEqual(ddb.query(User), [])
@@ -0,0 +1,107 @@
+"""Test the recording of database calls."""
+import threading
+
+from unittest import TestCase
+from db.metrics import add_capacity, add_throttles, in_context, \
+    instrument, record_db_calls, OpStats
+
+
+class FakeFacade:
+    @instrument(lambda self, table, *args: table)
+    def get(self, table, n=1):
+        add_capacity(0.5)
+        return [table] * n
+
+    @instrument(lambda self, table, *args: table)
+    def iter_get(self, table, n=1):
+        for _ in range(n):
+            add_capacity(1)
+            yield table
+
+    @instrument(lambda self, *args: '')
+    def get_all(self):
+        return self.get('users') + list(self.iter_get('users', 2))
+
+    @instrument(lambda self, table, *args: table, lambda self, *args: 3)
+    def delete(self, table):
+        pass
+
+    @instrument(lambda self, table, *args: table)
+    def get_throttled(self, table, throttles):
+        add_throttles(throttles)
+        return table
+
+    @instrument(lambda self, table, *args: table)
+    def get_threaded(self, table):
+        def work():
+            add_capacity(2)
+        threads = [threading.Thread(target=in_context(work))
+                   for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return True
+
+
+class TestRecordDBCalls(TestCase):
+    def setUp(self):
+        self.facade = FakeFacade()
+
+    def test_not_recording(self):
+        self.assertEqual(self.facade.get('users'), ['users'])
+
+    def test_aggregate_per_operation(self):
+        with record_db_calls() as stats:
+            self.facade.get('users', 2)
+            self.facade.get('users', 3)
+            self.facade.get('teams')
+        self.assertEqual(set(stats.ops), {('get', 'users'), ('get', 'teams')})
+        users = stats.ops[('get', 'users')]
+        self.assertEqual(users.calls, 2)
+        self.assertEqual(users.items, 5)
+        self.assertEqual(users.capacity_units, 1)
+        self.assertGreaterEqual(users.latency_ms, 0)
+
+    def test_iterator(self):
+        with record_db_calls() as stats:
+            it = self.facade.iter_get('teams', 3)
+            self.assertEqual(stats.ops, {})
+            self.assertEqual(list(it), ['teams'] * 3)
+        self.assertEqual(stats.ops[('iter_get', 'teams')].items, 3)
+        self.assertEqual(stats.ops[('iter_get', 'teams')].capacity_units, 3)
+
+    def test_iterator_closed_early(self):
+        with record_db_calls() as stats:
+            it = self.facade.iter_get('teams', 3)
+            next(it)
+            it.close()
+        self.assertEqual(stats.ops[('iter_get', 'teams')].items, 1)
+
+    def test_nested_calls(self):
+        with record_db_calls() as stats:
+            self.facade.get_all()
+        self.assertEqual(stats.ops,
+                         {('get_all', 'users'): stats.ops[('get_all',
+                                                           'users')]})
+        self.assertEqual(stats.ops[('get_all', 'users')].items, 3)
+        self.assertEqual(stats.ops[('get_all', 'users')].capacity_units, 2.5)
+
+    def test_count(self):
+        with record_db_calls() as stats:
+            self.facade.delete('users')
+        self.assertEqual(stats.ops[('delete', 'users')].items, 3)
+
+    def test_throttles(self):
+        add_throttles()
+        with record_db_calls() as stats:
+            self.facade.get_throttled('users', 2)
+            self.facade.get_throttled('users', 1)
+        self.assertEqual(stats.ops[('get_throttled', 'users')].throttles, 3)
+
+    def test_threads(self):
+        with record_db_calls() as stats:
+            self.facade.get_threaded('users')
+        self.assertEqual(stats.ops[('get_threaded', 'users')],
+                         OpStats(1, stats.ops[('get_threaded',
+                                               'users')].latency_ms, 1, 6))
@@ -0,0 +1,42 @@
+"""Test the query planner."""
+from unittest import TestCase
+from db.planner import QueryPlanner, Step, KEYS, INDEX, SCAN
+
+
+class TestQueryPlanner(TestCase):
+    def setUp(self):
+        self.planner = QueryPlanner()
+        self.indexes = {'github_user_id': 'github_user_id-index'}
+
+    def plan(self, params):
+        return self.planner.plan_or('users', params, 'slack_id',
+                                    self.indexes)
+
+    def test_plan_keys(self):
+        params = [('slack_id', 'U1'), ('slack_id', 'U2'), ('slack_id', 'U1')]
+        self.assertEqual(self.plan(params),
+                         [Step(KEYS, [('slack_id', 'U1'),
+                                      ('slack_id', 'U2')])])
+        self.assertEqual(self.planner.decisions[('users', KEYS)], 1)
+
+    def test_plan_index(self):
+        params = [('github_user_id', '1'), ('github_user_id', '2')]
+        self.assertEqual(self.plan(params),
+                         [Step(INDEX, params, 'github_user_id-index')])
+        self.assertEqual(self.planner.decisions[('users', INDEX)], 1)
+
+    def test_plan_keys_and_index(self):
+        params = [('github_user_id', '1'), ('slack_id', 'U1'),
+                  ('github_user_id', '2')]
+        self.assertEqual(self.plan(params),
+                         [Step(INDEX, [('github_user_id', '1'),
+                                       ('github_user_id', '2')],
+                               'github_user_id-index'),
+                          Step(KEYS, [('slack_id', 'U1')])])
+
+    def test_plan_scan(self):
+        params = [('slack_id', 'U1'), ('email', 'a@b.c'),
+                  ('github_user_id', '1'), ('email', 'a@b.c')]
+        self.assertEqual(self.plan(params), [Step(SCAN, params[:3])])
+        self.assertEqual(self.planner.decisions[('users', SCAN)], 1)
+        self.assertEqual(self.planner.decisions[('users', KEYS)], 0)
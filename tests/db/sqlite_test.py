@@ -0,0 +1,274 @@
+"""Test the SQLite database facade."""
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase, mock
+from app.model import User, Team, Permissions
+from config import Config
+from db.facade import VersionConflict
+from db.membership import Membership
+from db.sqlite import SQLiteDB
+
+
+def create_test_user(slack_id: str) -> User:
+    u = User(slack_id)
+    u.name = 'Jane Doe'
+    u.email = f'{slack_id}@ubc.ca'
+    u.github_username = f'gh-{slack_id}'
+    u.github_id = f'id-{slack_id}'
+    u.permissions_level = Permissions.member
+    return u
+
+
+def create_test_team(team_id: str, members=(), leads=()) -> Team:
+    t = Team(team_id, f'team-{team_id}', f'Team {team_id}')
+    t.platform = 'web'
+    t.members = set(members)
+    t.team_leads = set(leads)
+    return t
+
+
+class TestSQLiteDB(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config = mock.MagicMock(Config)
+        self.config.sqlite_path = os.path.join(self.dir, 'rocket2.db')
+        self.ddb = SQLiteDB(self.config)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_wal_mode(self):
+        conn = self.ddb._SQLiteDB__conn()
+        mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(mode, 'wal')
+
+    def test_reopen_keeps_data(self):
+        self.ddb.store(create_test_user('U1'))
+        other = SQLiteDB(self.config)
+        self.assertEqual(other.retrieve(User, 'U1').email, 'U1@ubc.ca')
+
+    def test_store_retrieve_user(self):
+        u = create_test_user('U1')
+        u.karma = 5
+        self.assertTrue(self.ddb.store(u))
+        self.assertEqual(self.ddb.retrieve(User, 'U1'), u)
+
+    def test_store_retrieve_team(self):
+        t = create_test_team('T1', members={'a', 'b'}, leads={'a'})
+        self.assertTrue(self.ddb.store(t))
+        got = self.ddb.retrieve(Team, 'T1')
+        self.assertEqual(got.members, {'a', 'b'})
+        self.assertEqual(got.team_leads, {'a'})
+        self.assertEqual(got.platform, 'web')
+
+    def test_store_replaces_sets(self):
+        t = create_test_team('T1', members={'a', 'b'})
+        self.ddb.store(t)
+        t.members = {'c'}
+        self.ddb.store(t)
+        self.assertEqual(self.ddb.retrieve(Team, 'T1').members, {'c'})
+
+    def test_writes_stamp_updated_at(self):
+        u = create_test_user('U1')
+        self.ddb.store(u)
+        self.assertGreater(u.updated_at, 0)
+        self.assertEqual(self.ddb.retrieve(User, 'U1').updated_at,
+                         u.updated_at)
+        with mock.patch('db.sqlite.now_ms', return_value=u.updated_at + 5):
+            self.assertEqual(self.ddb.increment(User, 'U1', 'karma')
+                             .updated_at, u.updated_at + 5)
+
+        self.ddb.store(create_test_team('T1'))
+        with mock.patch('db.sqlite.now_ms', return_value=42):
+            self.ddb.update_set(Team, 'T1', 'members', add=['a'])
+        self.assertEqual(self.ddb.retrieve(Team, 'T1').updated_at, 42)
+
+    def test_store_checks_version(self):
+        self.ddb.store(create_test_team('T1'))
+        t = self.ddb.retrieve(Team, 'T1')
+        stale = self.ddb.retrieve(Team, 'T1')
+        t.platform = 'ios'
+        self.ddb.store(t)
+        self.assertEqual(t.version, 2)
+        stale.platform = 'android'
+        with self.assertRaises(VersionConflict):
+            self.ddb.store(stale)
+        self.assertEqual(stale.version, 1)
+        self.assertEqual(self.ddb.retrieve(Team, 'T1').platform, 'ios')
+
+        self.ddb.update_set(Team, 'T1', 'members', add=['a'])
+        with self.assertRaises(VersionConflict):
+            self.ddb.store(t)
+        self.assertTrue(self.ddb.store(create_test_team('T1')))
+
+    def test_add_missing_columns(self):
+        conn = self.ddb._SQLiteDB__conn()
+        conn.execute('DROP INDEX users_updated_at')
+        conn.execute('ALTER TABLE users DROP COLUMN updated_at')
+        conn.execute('ALTER TABLE users DROP COLUMN version')
+        conn.execute("INSERT INTO users (slack_id, permission_level) "
+                     "VALUES ('U1', 'member')")
+        conn.commit()
+        other = SQLiteDB(self.config)
+        self.assertEqual(other.retrieve(User, 'U1').updated_at, 0)
+        other.store(create_test_user('U2'))
+        self.assertGreater(other.retrieve(User, 'U2').updated_at, 0)
+        self.assertEqual([u.slack_id for u in other.iter_changes(User, 1)],
+                         ['U2'])
+
+    def test_store_invalid(self):
+        self.assertFalse(self.ddb.store(User('')))
+        with self.assertRaises(RuntimeError):
+            self.ddb.store('not a model')
+
+    def test_retrieve_missing(self):
+        with self.assertRaises(LookupError):
+            self.ddb.retrieve(User, 'U404')
+
+    def test_retrieve_projection(self):
+        self.ddb.store(create_test_user('U1'))
+        u = self.ddb.retrieve(User, 'U1', attributes=['email'])
+        self.assertEqual(u.slack_id, 'U1')
+        self.assertEqual(u.email, 'U1@ubc.ca')
+        self.assertEqual(u.name, '')
+
+    def test_bulk_store_retrieve(self):
+        users = [create_test_user(f'U{i}') for i in range(250)]
+        self.assertEqual(self.ddb.bulk_store(users + [User('')]), 250)
+        got = self.ddb.bulk_retrieve(User, ['U3', 'U404', 'U200', 'U3'])
+        self.assertEqual([u.slack_id for u in got], ['U3', 'U200'])
+
+    def test_query(self):
+        self.ddb.store(create_test_user('U1'))
+        self.ddb.store(create_test_user('U2'))
+        got = self.ddb.query(User, [('github_user_id', 'id-U2')])
+        self.assertEqual([u.slack_id for u in got], ['U2'])
+        self.assertEqual(len(self.ddb.query(User)), 2)
+        self.assertEqual(self.ddb.query(User, [('nope', 'U1')]), [])
+
+    def test_query_set_membership(self):
+        self.ddb.store(create_test_team('T1', members={'a', 'b'}))
+        self.ddb.store(create_test_team('T2', members={'b'}, leads={'c'}))
+        got = self.ddb.query(Team, [('members', 'b')])
+        self.assertEqual({t.github_team_id for t in got}, {'T1', 'T2'})
+        got = self.ddb.query(Team, [('members', 'a'), ('platform', 'web')])
+        self.assertEqual([t.github_team_id for t in got], ['T1'])
+        got = self.ddb.query(Team, [('team_leads', 'c')])
+        self.assertEqual([t.github_team_id for t in got], ['T2'])
+
+    def test_query_or(self):
+        self.ddb.store(create_test_team('T1', members={'a'}))
+        self.ddb.store(create_test_team('T2'))
+        self.ddb.store(create_test_team('T3'))
+        got = self.ddb.query_or(Team, [('members', 'a'),
+                                       ('github_team_name', 'team-T2')])
+        self.assertEqual({t.github_team_id for t in got}, {'T1', 'T2'})
+        self.assertEqual(len(self.ddb.query_or(Team)), 3)
+
+    def test_query_in_many_values(self):
+        users = [create_test_user(f'U{i}') for i in range(1200)]
+        self.ddb.bulk_store(users)
+        ids = [f'id-U{i}' for i in range(0, 1200, 2)]
+        got = self.ddb.query_in(User, 'github_user_id', ids)
+        self.assertEqual(len(got), 600)
+        self.assertEqual(self.ddb.query_in(User, 'github_user_id', []), [])
+
+    def test_query_projection(self):
+        self.ddb.store(create_test_team('T1', members={'a'}, leads={'a'}))
+        t, = self.ddb.query(Team, attributes=['members'])
+        self.assertEqual(t.members, {'a'})
+        self.assertEqual(t.team_leads, set())
+        self.assertEqual(t.platform, '')
+
+    def test_iter_query_pages(self):
+        users = [create_test_user(f'U{i:03}') for i in range(25)]
+        self.ddb.bulk_store(users)
+        got = list(self.ddb.iter_query(User, page_size=10))
+        self.assertEqual([u.slack_id for u in got],
+                         [u.slack_id for u in users])
+
+    def test_iter_query_while_writing(self):
+        self.ddb.bulk_store([create_test_user(f'U{i}') for i in range(5)])
+        for u in self.ddb.iter_query(User, page_size=2):
+            self.ddb.increment(User, u.slack_id, 'karma')
+        self.assertTrue(all(u.karma == 2 for u in self.ddb.query(User)))
+
+    def test_increment(self):
+        self.ddb.store(create_test_user('U1'))
+        self.assertEqual(self.ddb.increment(User, 'U1', 'karma', 3).karma, 4)
+        self.assertEqual(self.ddb.increment(User, 'U1', 'karma', -1).karma,
+                         3)
+
+    def test_increment_missing(self):
+        with self.assertRaises(LookupError):
+            self.ddb.increment(User, 'U404', 'karma')
+        with self.assertRaises(TypeError):
+            self.ddb.increment(User, 'U1', 'nope')
+
+    def test_update_set(self):
+        self.ddb.store(create_test_team('T1', members={'a', 'b'}))
+        self.ddb.update_set(Team, 'T1', 'members', add=['c', 'a'],
+                            remove=['b', 'z'])
+        self.assertEqual(self.ddb.retrieve(Team, 'T1').members, {'a', 'c'})
+        self.ddb.update_set(Team, 'T1', 'team_leads', add=iter(['a']))
+        self.assertEqual(self.ddb.retrieve(Team, 'T1').team_leads, {'a'})
+
+    def test_update_set_missing(self):
+        with self.assertRaises(LookupError):
+            self.ddb.update_set(Team, 'T404', 'members', add=['a'])
+
+    def test_get_membership(self):
+        self.ddb.store(create_test_team('T1', members={'a', 'b'},
+                                        leads={'a'}))
+        self.ddb.store(create_test_team('T2', members={'a'}))
+        self.assertEqual(self.ddb.get_membership('a'),
+                         Membership({'T1', 'T2'}, {'T1'}))
+        self.ddb.update_set(Team, 'T2', 'members', remove=['a'])
+        self.assertEqual(self.ddb.get_membership('a'),
+                         Membership({'T1'}, {'T1'}))
+        self.assertEqual(self.ddb.get_membership('z'),
+                         Membership(set(), set()))
+
+    def test_delete(self):
+        self.ddb.store(create_test_team('T1', members={'a'}))
+        self.ddb.delete(Team, 'T1')
+        with self.assertRaises(LookupError):
+            self.ddb.retrieve(Team, 'T1')
+        self.assertEqual(self.ddb.get_membership('a'),
+                         Membership(set(), set()))
+
+    def test_bulk_delete(self):
+        self.ddb.bulk_store([create_test_user(f'U{i}') for i in range(3)])
+        self.ddb.bulk_delete(User, ['U0', 'U2', 'U404'])
+        self.assertEqual([u.slack_id for u in self.ddb.query(User)], ['U1'])
+
+    def test_iter_changes(self):
+        with mock.patch('db.utils.now_ms', return_value=10):
+            self.ddb.bulk_store([create_test_user(f'U{i}') for i in range(3)])
+        with mock.patch('db.utils.now_ms', return_value=20):
+            self.ddb.store(self.ddb.retrieve(User, 'U1'))
+        self.assertEqual([u.slack_id for u in
+                          self.ddb.iter_changes(User, 20)], ['U1'])
+        self.assertEqual(len(list(self.ddb.iter_changes(User, 10))), 3)
+        self.assertEqual(list(self.ddb.iter_changes(Team, 0)), [])
+
+    def test_iter_deletions(self):
+        self.ddb.bulk_store([create_test_user(f'U{i}') for i in range(3)])
+        with mock.patch('db.sqlite.now_ms', return_value=10):
+            self.ddb.delete(User, 'U0')
+        with mock.patch('db.sqlite.now_ms', return_value=20):
+            self.ddb.bulk_delete(User, ['U1'])
+        self.assertEqual(sorted(self.ddb.iter_deletions(User, 10)),
+                         ['U0', 'U1'])
+        self.assertEqual(list(self.ddb.iter_deletions(User, 20)), ['U1'])
+        self.assertEqual(list(self.ddb.iter_deletions(Team, 0)), [])
+
+    def test_bulk_store_keep_stamps(self):
+        u = create_test_user('U1')
+        u.updated_at = 10
+        u.version = 3
+        self.ddb.bulk_store([u], keep_stamps=True)
+        u = self.ddb.retrieve(User, 'U1')
+        self.assertEqual((u.updated_at, u.version), (10, 3))
@@ -0,0 +1,67 @@
+"""Test the adaptive rate limiter."""
+from unittest import TestCase
+from db.throttle import AdaptiveRateLimiter
+
+
+class TestAdaptiveRateLimiter(TestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.slept = []
+        self.limiter = AdaptiveRateLimiter(min_rate=1, increase=1,
+                                           clock=lambda: self.now,
+                                           sleep=self.slept.append)
+
+    def test_unlimited(self):
+        for _ in range(100):
+            self.limiter.acquire('users')
+        self.assertIsNone(self.limiter.rate('users'))
+        self.assertEqual(self.slept, [])
+
+    def test_throttle_halves_recent_rate(self):
+        for _ in range(20):
+            self.limiter.acquire('users')
+        self.limiter.throttled('users')
+        self.assertEqual(self.limiter.rate('users'), 10)
+        self.assertIsNone(self.limiter.rate('teams'))
+
+    def test_throttle_without_bulk_work(self):
+        self.limiter.throttled('users', 3)
+        self.assertIsNone(self.limiter.rate('users'))
+        self.assertEqual(self.limiter.throttles(), {'users': 3})
+
+    def test_burst_of_throttles_halves_once(self):
+        for _ in range(20):
+            self.limiter.acquire('users')
+        for _ in range(8):
+            self.limiter.throttled('users')
+        self.assertEqual(self.limiter.rate('users'), 10)
+        self.assertEqual(self.limiter.throttles(), {'users': 8})
+
+        self.now += AdaptiveRateLimiter.WINDOW_SECS
+        self.limiter.throttled('users')
+        self.assertEqual(self.limiter.rate('users'), 5)
+
+    def test_acquire_spaces_requests(self):
+        for _ in range(4):
+            self.limiter.acquire('users')
+        self.limiter.throttled('users')
+        self.assertEqual(self.limiter.rate('users'), 2)
+        for _ in range(3):
+            self.limiter.acquire('users')
+        self.assertEqual(self.slept, [0.5, 1.0])
+
+    def test_success_increases_rate(self):
+        for _ in range(4):
+            self.limiter.acquire('users')
+        self.limiter.throttled('users')
+        for _ in range(4):
+            self.limiter.succeeded('users')
+        self.assertGreater(self.limiter.rate('users'), 3.5)
+
+    def test_limit_lifted(self):
+        self.limiter.acquire('users')
+        self.limiter.throttled('users')
+        self.assertEqual(self.limiter.rate('users'), 1)
+        self.now += AdaptiveRateLimiter.RESET_SECS + 1
+        self.limiter.acquire('users')
+        self.assertIsNone(self.limiter.rate('users'))
@@ -1,7 +1,10 @@
-from db.utils import get_team_members, get_users_by_ghid, get_team_by_name
+from db.utils import get_team_members, get_users_by_ghid, get_team_by_name, \
+    get_projection, project, stamp, check_version, update_with_retry
+from db.facade import VersionConflict
+from db.memory import IndexedMemoryDB
 from tests.memorydb import MemoryDB
 from app.model import User, Team
-from unittest import TestCase
+from unittest import TestCase, mock
 
 
 class TestDbUtils(TestCase):
@@ -41,3 +44,83 @@ class TestDbUtils(TestCase):
                                         self.u1.github_id,
                                         self.u2.github_id]),
             [self.u0, self.u1, self.u2])
+
+    def test_get_projection(self):
+        self.assertIsNone(get_projection(User, None))
+        self.assertEqual(get_projection(User, ['email', 'slack_id']),
+                         ['slack_id', 'email'])
+        self.assertEqual(get_projection(Team, []),
+                         ['github_team_id', 'github_team_name'])
+
+    def test_project(self):
+        self.assertIs(project(self.u0, None), self.u0)
+        u = project(self.u0, ['name'])
+        self.assertEqual(u.slack_id, self.u0.slack_id)
+        self.assertEqual(u.github_id, '')
+        t = project(self.t0, ['members'])
+        self.assertEqual(t.members, self.t0.members)
+
+    @mock.patch('db.utils.now_ms', return_value=1234)
+    def test_stamp(self, now_ms):
+        self.assertIs(stamp(self.u0), self.u0)
+        self.assertEqual(self.u0.updated_at, 1234)
+        self.assertEqual(self.u0.version, 1)
+
+    def test_check_version(self):
+        check_version(self.u0, 3)
+        self.u0.version = 3
+        check_version(self.u0, 3)
+        with self.assertRaises(VersionConflict):
+            check_version(self.u0, 4)
+
+        # Read from an item without a version
+        u = User.from_dict({'slack_id': 'U0'})
+        check_version(u, 0)
+        with self.assertRaises(VersionConflict):
+            check_version(u, 1)
+
+    @mock.patch('db.utils.time.sleep')
+    def test_update_with_retry(self, sleep):
+        db = IndexedMemoryDB()
+        db.store(self.t0)
+
+        def add_lead(team):
+            if sleep.call_count == 0:
+                db.update_set(Team, team.github_team_id, 'members',
+                              add=['other'])
+            team.add_team_lead(self.u0.github_id)
+        team = update_with_retry(db, Team, self.t0.github_team_id, add_lead)
+        self.assertEqual(sleep.call_count, 1)
+        stored = db.retrieve(Team, self.t0.github_team_id)
+        self.assertEqual(stored.team_leads, {self.u0.github_id})
+        self.assertIn('other', stored.members)
+        self.assertEqual(stored.version, team.version)
+
+    @mock.patch('db.utils.time.sleep')
+    def test_update_with_retry_current(self, sleep):
+        db = mock.Mock(wraps=IndexedMemoryDB())
+        db.store(self.t0)
+        current = db.retrieve(Team, self.t0.github_team_id)
+        db.retrieve.reset_mock()
+
+        def add_lead(team):
+            if sleep.call_count == 0:
+                db.update_set(Team, team.github_team_id, 'members',
+                              add=['other'])
+            team.add_team_lead(self.u0.github_id)
+        update_with_retry(db, Team, self.t0.github_team_id, add_lead,
+                          current=current)
+        # Only the retry reads the team again
+        self.assertEqual(db.retrieve.call_count, 1)
+        stored = db.retrieve(Team, self.t0.github_team_id)
+        self.assertEqual(stored.team_leads, {self.u0.github_id})
+        self.assertIn('other', stored.members)
+
+    @mock.patch('db.utils.time.sleep')
+    def test_update_with_retry_gives_up(self, sleep):
+        db = mock.Mock(wraps=self.db)
+        db.store.side_effect = VersionConflict
+        with self.assertRaises(VersionConflict):
+            update_with_retry(db, User, self.u0.slack_id,
+                              lambda u: None, retries=2)
+        self.assertEqual(db.store.call_count, 3)
@@ -1,6 +1,7 @@
 from unittest import mock, TestCase
 from interface.cloudwatch_metrics import CWMetrics
 from config import Config
+from db.metrics import DBStats, OpStats
 
 
 class TestCWMetrics(TestCase):
@@ -39,3 +40,35 @@ class TestCWMetrics(TestCase):
 
         cwm.submit_cmd_mstime('team', 30)
         client.put_metric_data.assert_called_once()
+
+    @mock.patch('logging.info')
+    @mock.patch('boto3.client')
+    def test_disabled_db_stats(self, b3client, log):
+        stats = DBStats()
+        stats.ops[('query', 'users')] = OpStats(2, 30, 5, 1.5, 3)
+
+        cwm = CWMetrics(self.conf_disable_metrics)
+        cwm.submit_db_stats('team', stats)
+        log.assert_called_with(
+            'Database Calls [team@Rocket 2]: query on users: 2 calls, '
+            '30 ms, 5 items, 1.5 capacity units, 3 throttles')
+
+    @mock.patch('boto3.client')
+    def test_enabled_db_stats(self, b3client):
+        client = mock.Mock()
+        b3client.return_value = client
+        stats = DBStats()
+        stats.ops[('query', 'users')] = OpStats(2, 30, 5, 1.5, 3)
+
+        cwm = CWMetrics(self.conf_enable_metrics)
+        cwm.submit_db_stats('team', DBStats())
+        client.put_metric_data.assert_not_called()
+
+        cwm.submit_db_stats('team', stats)
+        data = client.put_metric_data.call_args[1]['MetricData']
+        self.assertEqual({d['MetricName']: d['Value'] for d in data},
+                         {'Database Calls': 2,
+                          'Database Latency': 30,
+                          'Database Items': 5,
+                          'Database Consumed Capacity': 1.5,
+                          'Database Throttles': 3})
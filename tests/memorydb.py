@@ -1,6 +1,9 @@
 from db.facade import DBFacade
+from db.membership import Membership
+from db.utils import check_version, now_ms, project, stamp
 from app.model import User, Team, Permissions
-from typing import TypeVar, List, Type, Tuple, cast, Set
+from typing import TypeVar, List, Type, Tuple, cast, Set, Iterator, \
+    Optional, Iterable, Dict
 
 T = TypeVar('T', User, Team)
 
@@ -96,6 +99,8 @@ class MemoryDB(DBFacade):
         """
         self.users = {u.slack_id: u for u in users}
         self.teams = {t.github_team_id: t for t in teams}
+        # Times at which objects were deleted, by key
+        self.deletions: Dict[type, Dict[str, int]] = {User: {}, Team: {}}
 
     def get_db(self, Model: Type[T]):
         if Model is User:
@@ -108,14 +113,29 @@ class MemoryDB(DBFacade):
         Model = obj.__class__
         if Model.is_valid(obj):
             key = get_key(obj)
-            self.get_db(Model)[key] = obj
+            current = self.get_db(Model).get(key)
+            check_version(obj, 0 if current is None else current.version)
+            self.get_db(Model)[key] = stamp(obj)
             return True
         return False
 
-    def retrieve(self, Model: Type[T], k: str) -> T:
+    def bulk_store(self, objs: Iterable[T], keep_stamps: bool = False) -> int:
+        stored = 0
+        for obj in objs:
+            Model = obj.__class__
+            if Model.is_valid(obj):
+                self.get_db(Model)[get_key(obj)] = \
+                    obj if keep_stamps else stamp(obj)
+                stored += 1
+        return stored
+
+    def retrieve(self,
+                 Model: Type[T],
+                 k: str,
+                 attributes: Optional[List[str]] = None) -> T:
         d = self.get_db(Model)
         if k in d:
-            return cast(T, d[k])
+            return project(cast(T, d[k]), attributes)
         else:
             raise LookupError(f'{Model.__name__}(id={k}) not found')
 
@@ -123,7 +143,7 @@ class MemoryDB(DBFacade):
                       Model: Type[T],
                       ks: List[str]) -> List[T]:
         r = []
-        for k in ks:
+        for k in dict.fromkeys(ks):
             try:
                 m = self.retrieve(Model, k)
                 r.append(m)
@@ -133,25 +153,90 @@ class MemoryDB(DBFacade):
 
     def query(self,
               Model: Type[T],
-              params: List[Tuple[str, str]] = []) -> List[T]:
+              params: List[Tuple[str, str]] = [],
+              attributes: Optional[List[str]] = None) -> List[T]:
         d = list(self.get_db(Model).values())
         for field, val in params:
             d = filter_by_matching_field(d, Model, field, val)
-        return d
+        return [project(x, attributes) for x in d]
 
     def query_or(self,
                  Model: Type[T],
-                 params: List[Tuple[str, str]] = []) -> List[T]:
+                 params: List[Tuple[str, str]] = [],
+                 attributes: Optional[List[str]] = None) -> List[T]:
         if len(params) == 0:
-            return self.query(Model)
+            return self.query(Model, attributes=attributes)
 
         d = list(self.get_db(Model).values())
         r: Set[T] = set()
         for field, val in params:
             r = r.union(set(filter_by_matching_field(d, Model, field, val)))
-        return list(r)
+        return [project(x, attributes) for x in r]
+
+    def iter_query(self,
+                   Model: Type[T],
+                   params: List[Tuple[str, str]] = [],
+                   page_size: Optional[int] = None,
+                   attributes: Optional[List[str]] = None) -> Iterator[T]:
+        return iter(self.query(Model, params, attributes))
+
+    def iter_query_or(self,
+                      Model: Type[T],
+                      params: List[Tuple[str, str]] = [],
+                      page_size: Optional[int] = None,
+                      attributes: Optional[List[str]] = None) \
+            -> Iterator[T]:
+        return iter(self.query_or(Model, params, attributes))
+
+    def iter_changes(self, Model: Type[T], since: int) -> Iterator[T]:
+        return iter([x for x in self.get_db(Model).values()
+                     if x.updated_at >= since])
+
+    def query_in(self,
+                 Model: Type[T],
+                 field: str,
+                 values: List[str]) -> List[T]:
+        if len(values) == 0:
+            return []
+        return self.query_or(Model, [(field, v) for v in values])
+
+    def increment(self,
+                  Model: Type[T],
+                  k: str,
+                  field: str,
+                  delta: int = 1) -> T:
+        obj = self.retrieve(Model, k)
+        attr = field_to_attr(Model, field)
+        setattr(obj, attr, getattr(obj, attr) + delta)
+        return obj
+
+    def update_set(self,
+                   Model: Type[T],
+                   k: str,
+                   field: str,
+                   add: Iterable[str] = (),
+                   remove: Iterable[str] = ()):
+        s = getattr(self.retrieve(Model, k), field_to_attr(Model, field))
+        s.update(add)
+        s.difference_update(remove)
+
+    def get_membership(self, github_id: str) -> Membership:
+        return Membership(
+            {t.github_team_id for t in self.teams.values()
+             if github_id in t.members},
+            {t.github_team_id for t in self.teams.values()
+             if github_id in t.team_leads})
 
     def delete(self, Model: Type[T], k: str):
         d = self.get_db(Model)
         if k in d:
             d.pop(k)
+        self.deletions[Model][k] = now_ms()
+
+    def bulk_delete(self, Model: Type[T], ks: List[str]):
+        for k in ks:
+            self.delete(Model, k)
+
+    def iter_deletions(self, Model: Type[T], since: int) -> Iterator[str]:
+        return iter([k for k, deleted_at in self.deletions[Model].items()
+                     if deleted_at >= since])
@@ -142,3 +142,58 @@ class TestMemoryDB(TestCase):
         ts = self.db.query(Team, [('displayname', 'T Zero Blasters')])
         self.assertEqual(len(ts), 1)
         self.assertEqual(ts[0], self.teams['t0'])
+
+    def test_iter_query(self):
+        ts = self.db.iter_query(Team, [('members', 'u0')])
+        self.assertCountEqual(list(ts), [self.teams['t0'], self.teams['t1']])
+
+    def test_iter_query_or(self):
+        ts = self.db.iter_query_or(Team, [('members', 'u1'),
+                                          ('members', 'u3')])
+        self.assertCountEqual(list(ts), [self.teams['t0'], self.teams['t1']])
+
+    def test_query_projection(self):
+        us = self.db.query(User, [('permission_level', 'admin')],
+                           attributes=['email'])
+        self.assertEqual(len(us), 1)
+        self.assertEqual(us[0].email, self.admin.email)
+        self.assertEqual(us[0].name, '')
+        self.assertEqual(self.db.retrieve(User, 'Uadmin').name,
+                         self.admin.name)
+
+    def test_retrieve_projection(self):
+        t = self.db.retrieve(Team, 't0', attributes=['platform'])
+        self.assertEqual(t.github_team_name, 'TZ')
+        self.assertEqual(t.platform, 'iOS')
+        self.assertEqual(t.members, set())
+
+    def test_increment(self):
+        u = self.db.increment(User, 'Uadmin', 'karma', 3)
+        self.assertEqual(u.karma, 4)
+        self.assertEqual(self.admin.karma, 4)
+
+    def test_increment_missing(self):
+        with self.assertRaises(LookupError):
+            self.db.increment(User, 'nope', 'karma')
+
+    def test_update_set(self):
+        self.db.update_set(Team, 't1', 'members', add=['u4'], remove=['u0'])
+        self.assertEqual(self.teams['t1'].members, {'u2', 'u3', 'u4'})
+        with self.assertRaises(LookupError):
+            self.db.update_set(Team, 'nope', 'members', add=['u4'])
+
+    def test_get_membership(self):
+        m = self.db.get_membership('u0')
+        self.assertEqual(m.member_of, {'t0', 't1'})
+        self.assertEqual(m.lead_of, {'t0', 't1'})
+        self.assertEqual(self.db.get_membership('u3').lead_of, set())
+
+    def test_bulk_store(self):
+        us = [User('u3'), User('u4'), User('')]
+        self.assertEqual(self.db.bulk_store(us), 2)
+        self.assertEqual(self.db.retrieve(User, 'u4'), us[1])
+
+    def test_bulk_delete(self):
+        selection = random.sample(list(self.users.keys()), k=10)
+        self.db.bulk_delete(User, selection)
+        self.assertEqual(self.db.bulk_retrieve(User, selection), [])